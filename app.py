@@ -1,15 +1,33 @@
+import logging
+
 import streamlit as st
-import pandas as pd
-import json
-import base64
-from io import BytesIO
-from PIL import Image, ImageOps, ImageEnhance
-from openai import OpenAI
 
-# ==========================================
-# 学校仕様
-# ==========================================
-LAP_M = 300  # 1周=300m
+# pandas・numpy・PIL・openai は読み込みに合わせて1秒以上かかるので、最初の画面（アップロード欄）までは読まない。
+# 使う画面・ジョブの関数の中で import する（2回目以降は sys.modules から返るだけ）。
+from pe_analysis.backends import make_backend
+from pe_analysis.cache import ExtractionCache
+from pe_analysis.core import (
+    AT_ALERT_THRESHOLD,
+    LAP_M,
+    infer_profile,
+    parse_sheet,
+    pick_best_time_run,
+    record_metrics,
+    sec_to_mmss,
+)
+from pe_analysis.glossary import GLOSSARY_HTML
+from pe_analysis.history import HistoryStore
+from pe_analysis.jobs import FINISHED, JOB_WORKERS, PRIORITY_BATCH, PRIORITY_INTERACTIVE, JobQueue
+from pe_analysis.metrics import METRICS, enable_json_log
+from pe_analysis.report import (
+    REPORT_MODES,
+    iter_reports,
+    report_cache_key,
+    report_request,
+    sheet_report_requests,
+    stream_text_report,
+)
+from pe_analysis.singleflight import SingleFlight
 
 # ==========================================
 # UI
@@ -25,482 +43,518 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ==========================================
-# 用語解説（固定文）
-# ==========================================
-GLOSSARY_TEXT = """
-## 🔍 用語解説：VO₂Max（最大酸素摂取量）とは？
-**VO₂Max（最大酸素摂取量）**は、運動中に体が取り込んで使える**酸素の最大量**のことです。  
-簡単に言うと、**心肺のエンジンの大きさ**を表す数値です。
-
-### ✅ どんな能力を表す？
-VO₂Maxが高い人は…
-- 心臓や肺が強く、体に酸素をたくさん送れる  
-- 筋肉が酸素を使ってエネルギーを作りやすい  
-- **長い時間、速いペースを維持しやすい**  
-
-つまり、持久走に必要な「**基礎体力（持久力の土台）**」が大きいです。
-
-### ✅ どう活きてくる？
-VO₂Maxが高いと…
-- **後半でもペースが落ちにくい**
-- 3000m / 2100mで「粘れる」
-- 練習を積むほど記録が伸びやすい（伸びしろが大きい）
-
-> ※このアプリのVO₂Maxは、時間走の結果から計算した**推定値（目安）**です。実験室で測る本来の測定とは違います。
-
----
-
-## 🔍 用語解説：AT（無酸素性作業閾値）とは？
-**AT（Anaerobic Threshold：無酸素性作業閾値）**は、運動強度が上がっていく中で、  
-体が「**酸素だけでは足りなくなり始める境目**」のことです。
-
-イメージで言うと…
-- ここまでは「まだ余裕がある」
-- ここを超えると「急に苦しくなって、ペースが落ちやすくなる」
-
-という **限界ライン**です。
-
-### ✅ どんな能力を表す？
-ATが高い（強い）人は…
-- 苦しくなる境目が遅い  
-- つまり、**速いペースで長く走れる**
-
-これはVO₂Max（エンジンの大きさ）とは少し違って、  
-レースでの「**粘り・実戦力**」に直結します。
-
-### ✅ どう活きてくる？
-ATが強いと…
-- 中盤で失速しにくい（タレにくい）
-- 苦しい区間でもスピードを維持できる
-- 3000m / 2100mで自己ベストを狙いやすい
-
----
-
-## 🧠 このアプリでのATの見方（授業用の簡易判定）
-このアプリでは、300mごとのラップの変化から  
-「ATのサイン（失速の始まり）」を見つけます。
-
-### ⚠️ 失速アラート（ATサイン）
-前の300mより **+3秒以上遅くなった**場合、  
-「ここで苦しくなってペースが落ち始めた可能性がある」と判定します。
-
-> ※本当のATは専門的な測定が必要ですが、授業では「失速が始まる地点＝ATのサイン」として理解すると分かりやすいです。
-
----
-
-## ✅ VO₂MaxとATの関係（まとめ）
-- **VO₂Max＝エンジンの大きさ（基礎体力）**
-- **AT＝そのエンジンをレースで使い切る力（粘り）**
-
-つまり…
-- VO₂Maxが高い → 伸びる土台がある  
-- ATが高い → レースで崩れにくい  
-"""
-
-# ==========================================
-# OpenAI
+# モデルの呼び出し先（MODEL_BACKEND: openai / record / replay / standin）
 # ==========================================
+MODEL_BACKEND = st.secrets.get("MODEL_BACKEND", "openai")
 API_KEY = st.secrets.get("OPENAI_API_KEY", "")
-if not API_KEY:
+if MODEL_BACKEND in ("openai", "record") and not API_KEY:
     st.error("Secretsに OPENAI_API_KEY が設定されていません。")
     st.stop()
 
-client = OpenAI(api_key=API_KEY)
+@st.cache_resource
+def get_client(kind, api_key, base_url, replay_dir):
+    # 全セッションで1つのクライアント（HTTP 接続プール・keep-alive を共有）
+    return make_backend(kind, api_key, base_url, replay_dir)
 
-# ==========================================
-# utils
-# ==========================================
-def safe_json_load(text: str):
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(text[start:end+1])
-            except:
-                pass
-    return None
-
-def empty_result():
-    return {"name": "選手", "sheet_hints": "", "records": []}
-
-def mmss_to_sec(s: str) -> float:
-    if s is None:
-        return 0.0
-    s = str(s).strip().replace(" ", "")
-    if ":" not in s:
-        try:
-            return float(s)
-        except:
-            return 0.0
-    parts = s.split(":")
-    if len(parts) != 2:
-        return 0.0
-    try:
-        m = int(parts[0])
-        sec = int(parts[1])
-        return float(m * 60 + sec)
-    except:
-        return 0.0
-
-def sec_to_mmss(sec: float) -> str:
-    if sec <= 0:
-        return "0:00"
-    m = int(sec // 60)
-    s = int(round(sec - m * 60))
-    if s == 60:
-        m += 1
-        s = 0
-    return f"{m}:{s:02d}"
-
-def splits_to_laps(splits_sec):
-    laps = []
-    prev = 0.0
-    for s in splits_sec:
-        s = float(s)
-        laps.append(max(0.0, s - prev))
-        prev = s
-    return laps
-
-def detect_at_alerts(laps_sec, threshold=3.0):
-    alerts = []
-    for i in range(1, len(laps_sec)):
-        prev = float(laps_sec[i-1])
-        cur = float(laps_sec[i])
-        diff = cur - prev
-        if diff >= threshold:
-            alerts.append((i+1, prev, cur, diff))
-    return alerts
-
-def pace_per_km(dist_m, time_sec):
-    if dist_m <= 0 or time_sec <= 0:
-        return 0.0
-    return time_sec / (dist_m / 1000)
-
-def predict_time_by_same_speed(dist_m, time_sec, target_m):
-    if dist_m <= 0 or time_sec <= 0:
-        return 0.0
-    v = dist_m / time_sec
-    return target_m / v
-
-def estimate_vo2max_by_speed(v_m_per_min):
-    if v_m_per_min <= 0:
-        return 0.0
-    return round(0.2 * v_m_per_min + 3.5, 1)
-
-def build_pace_guide(target_m, target_time_sec):
-    if target_m <= 0 or target_time_sec <= 0:
-        return []
-    plans = [("維持", 1.03), ("目標", 1.00), ("突破", 0.97)]
-    full_laps = target_m // LAP_M
-    rem = target_m % LAP_M
-
-    out = []
-    for label, mult in plans:
-        t = target_time_sec * mult
-        per_m = t / target_m
-        lap_sec = per_m * LAP_M
-        rem_sec = per_m * rem if rem else 0
-        detail = f"{LAP_M}m:{sec_to_mmss(lap_sec)} × {full_laps}"
-        if rem:
-            detail += f" + {rem}m:{sec_to_mmss(rem_sec)}"
-        out.append({"プラン": label, "想定タイム": sec_to_mmss(t), "目標ラップ": detail})
-    return out
+def model_client():
+    """初めてジョブを積むときに作る（openai の import もここまで遅らせる）"""
+    return get_client(MODEL_BACKEND, API_KEY, st.secrets.get("MODEL_BASE_URL", ""), st.secrets.get("REPLAY_DIR", ""))
 
-# ==========================================
-# ★方法A：欄外トリミング
-# ==========================================
-def crop_margin_for_ignore_notes(image):
-    w, h = image.size
-    left = int(w * 0.06)
-    right = int(w * 0.96)
-    top = int(h * 0.03)
-    bottom = int(h * 0.98)
-    return image.crop((left, top, right, bottom))
-
-def optimize_image_for_cost(image, max_width=768):
-    image = ImageOps.exif_transpose(image).convert("RGB")
-    image = crop_margin_for_ignore_notes(image)
-
-    w, h = image.size
-    if w > max_width:
-        new_h = int(h * (max_width / w))
-        image = image.resize((max_width, new_h))
-
-    image = ImageEnhance.Contrast(image).enhance(1.15)
-    return image
-
-def image_to_data_url(image, jpeg_quality=65):
-    buf = BytesIO()
-    image.save(buf, format="JPEG", quality=jpeg_quality, optimize=True)
-    b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-    return f"data:image/jpeg;base64,{b64}"
+@st.cache_resource
+def get_flights():
+    # 同じ画像の抽出・同じプロンプトのレポートが同時に来たら、API は1回だけ呼んで結果を共有する
+    return {"extract": SingleFlight("extract_flight"), "report": SingleFlight("report_flight")}
 
 # ==========================================
-# records から「ベスト回」を選ぶ（最重要）
+# 計測（JSON 1行ログ / Prometheus テキスト / 管理者パネル）
 # ==========================================
-def pick_best_time_run(records):
+METRICS_PROM_FILE = st.secrets.get("METRICS_PROM_FILE", "")
+if st.secrets.get("METRICS_LOG", False):
+    enable_json_log()
+
+def export_metrics():
+    # ジョブのワーカーから呼ぶ。書き出しに失敗しても抽出・レポート自体は失敗にしない
+    if METRICS_PROM_FILE:
+        try:
+            METRICS.write_prometheus(METRICS_PROM_FILE)
+        except Exception as e:
+            logging.getLogger("pe_analysis.metrics").warning("metrics export failed: %s", e)
+
+def render_admin_metrics():
+    # ?admin=1 または Secrets の ADMIN_METRICS で表示（プロセス全体の直近値）
+    if not (st.query_params.get("admin") == "1" or st.secrets.get("ADMIN_METRICS", False)):
+        return
+    import pandas as pd
+
+    with st.sidebar.expander("🛠 管理者：処理時間・トークン", expanded=True):
+        st.button("更新")
+        summary = METRICS.summary()
+        if summary:
+            st.dataframe(pd.DataFrame(summary).round(1), hide_index=True)
+        else:
+            st.caption("まだ計測データがありません")
+        tokens = METRICS.tokens()
+        if tokens:
+            st.dataframe(pd.DataFrame([{"呼び出し": k, "種別": d, "トークン": n} for (k, d), n in tokens.items()]),
+                         hide_index=True)
+
+render_admin_metrics()
+
+@st.cache_resource
+def get_extract_cache():
+    # ディスク層は Secrets に EXTRACT_CACHE_DB（SQLiteファイルパス）があるときだけ有効
+    return ExtractionCache(db_path=st.secrets.get("EXTRACT_CACHE_DB", "") or None)
+
+def run_extract_cached(client, raw_bytes, source, box, cache, flight):
     """
-    時間走の3回（①②③）がある前提で、time_run_dist_m が最大の回をベストとして返す。
-    取れない場合は records[0] を返す。
+    同じ画像バイト列＋同じ前処理設定なら、API を呼ばずにキャッシュから返す。
+    source, box は prepare_extract_source の結果。縮小・JPEG 化は実際に送る段階だけ行う。
+    失敗結果はキャッシュしない（撮り直し・再試行できるように）。
+    ワーカースレッドから呼ぶので、クライアント・キャッシュ・single-flight は引数で受け取る。
     """
-    if not records:
-        return None
-    best = None
-    best_dist = -1
-    for r in records:
-        d = float(r.get("time_run_dist_m", 0) or 0)
-        if d > best_dist:
-            best_dist = d
-            best = r
-    return best if best else records[0]
-
-# ==========================================
-# 推理（男子/女子）
-# ==========================================
-def infer_profile(rec, sheet_hints: str):
-    hints = (sheet_hints or "").replace("　", " ").lower()
-
-    dist_race_m = int(rec.get("distance_race_m", 0) or 0)
-    if dist_race_m == 3000:
-        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "distance_race_m=3000"}
-    if dist_race_m == 2100:
-        return {"gender": "female", "time_min": 12, "target_m": 2100, "reason": "distance_race_m=2100"}
-
-    if any(k in hints for k in ["男子", "15分", "3000", "3000m", "15"]):
-        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": f"keyword:{sheet_hints}"}
-    if any(k in hints for k in ["女子", "12分", "2100", "2100m", "12"]):
-        return {"gender": "female", "time_min": 12, "target_m": 2100, "reason": f"keyword:{sheet_hints}"}
-
-    splits_mmss = rec.get("splits_mmss", []) or []
-    splits_sec = [mmss_to_sec(x) for x in splits_mmss if str(x).strip()]
-    total_time = max(splits_sec) if splits_sec else 0.0
-    if total_time > 12.5 * 60:
-        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "time>12:30"}
-
-    time_dist = float(rec.get("time_run_dist_m", 0) or 0)
-    if time_dist >= 3200:
-        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "time_run_dist>=3200"}
-    if time_dist > 0 and time_dist < 2600:
-        return {"gender": "female", "time_min": 12, "target_m": 2100, "reason": "time_run_dist<2600"}
-
-    return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "fallback"}
+    from pe_analysis.extract import extract_cache_key, extract_cascade, tier_data_urls
+
+    key = extract_cache_key(raw_bytes)
+    hit = cache.get(key)
+    if hit is not None:
+        return parse_sheet(hit["data"]), None, hit["meta"]
+
+    def work():
+        hit = cache.get(key)  # 同じ画像の先行分がちょうど終わったところなら、それを使う
+        if hit is not None:
+            return parse_sheet(hit["data"]), None, hit["meta"]
+        sheet, err, meta = extract_cascade(client, tier_data_urls(source, box))
+        if not err:
+            cache.put(key, {"data": sheet.to_dict(), "meta": meta})
+        return sheet, err, meta
+
+    result, _ = flight.do(key, work)
+    return result
+
+@st.cache_resource
+def get_report_cache():
+    # 同じプロンプト（＝同じ回の同じ数値）のレポートは再生成しない
+    return ExtractionCache(db_path=st.secrets.get("EXTRACT_CACHE_DB", "") or None, table="report_cache")
 
 # ==========================================
-# 抽出（画像→JSON）
+# 記録の蓄積（Secrets に HISTORY_DB があるときだけ）
 # ==========================================
-def run_extract(image):
-    prompt = f"""
-あなたは帳票読取の専門家です。記録用紙から必要情報を抽出し、必ずJSONのみを出力してください。
-説明文や```は禁止です。
-
-【重要】
-- 手書きのメモ（欄外・余白・枠の外）は一切無視すること。
-- 読み取るのは表の枠内（記入欄）のみ。
-
-【最優先で抽出するもの】
-1) 300mごとの通過タイム（スプリットタイム）
-- 形式は "m:ss" の配列（例 "2:02"）
-- 見える範囲で全て抽出
-- ①②③の列がある場合は records に複数入れる
-
-2) 時間走（15分/12分）の最下段「走行距離（m）」→ time_run_dist_m
-- ①②③がある場合はそれぞれ入れる
-
-3) 距離走（3000m/2100m）の最下段「記録（分:秒）」→ distance_race_time_mmss
-- あわせて distance_race_m を 3000 or 2100 にする
-
-【JSON形式】
-{{
-  "name": "選手名",
-  "sheet_hints": "用紙内で読み取れたキーワード（男子/女子/15分/12分/3000/2100 等）を短く列挙。無ければ空文字",
-  "records": [
-    {{
-      "attempt": 1,
-      "lap_m": {LAP_M},
-      "splits_mmss": ["0:58","2:02","3:08"],
-      "time_run_dist_m": 4100,
-      "distance_race_m": 3000,
-      "distance_race_time_mmss": "11:12"
-    }}
-  ]
-}}
-
-【ルール】
-- 不明は推測せず 0/空配列/空文字
-"""
-
-    optimized = optimize_image_for_cost(image, max_width=768)
-    url = image_to_data_url(optimized, jpeg_quality=65)
-
-    resp = client.responses.create(
-        model="gpt-4.1-mini",
-        input=[{
-            "role": "user",
-            "content": [
-                {"type": "input_text", "text": prompt},
-                {"type": "input_image", "image_url": url},
-            ]
-        }],
-        temperature=0.2,
-    )
-
-    data = safe_json_load(resp.output_text.strip())
-    if not data:
-        return empty_result(), "JSON解析に失敗しました（抽出）"
-    if "sheet_hints" not in data:
-        data["sheet_hints"] = ""
-    return data, None
-
-# ==========================================
-# 文章レポート（画像なし）
-# ==========================================
-def build_report_prompt(name, profile, rec, all_records):
-    time_min = profile["time_min"]
-    time_sec = time_min * 60
-    target_m = profile["target_m"]
-
-    # ベスト/平均/ワースト（時間走距離）
-    dists = [int(float(r.get("time_run_dist_m", 0) or 0)) for r in all_records]
-    dists = [d for d in dists if d > 0]
-    best_dist = max(dists) if dists else int(float(rec.get("time_run_dist_m", 0) or 0))
-    worst_dist = min(dists) if dists else int(float(rec.get("time_run_dist_m", 0) or 0))
-    avg_dist = int(round(sum(dists) / len(dists))) if dists else int(float(rec.get("time_run_dist_m", 0) or 0))
-
-    time_run_dist_m = float(rec.get("time_run_dist_m", 0) or 0)
-
-    splits_mmss = rec.get("splits_mmss", []) or []
-    splits_sec = [mmss_to_sec(x) for x in splits_mmss if str(x).strip()]
-    splits_sec = [s for s in splits_sec if s > 0]
-    splits_sec = sorted(splits_sec)
-
-    laps_sec = splits_to_laps(splits_sec) if len(splits_sec) >= 2 else []
-    alerts = detect_at_alerts(laps_sec, threshold=3.0)
-
-    pace_sec_km = pace_per_km(time_run_dist_m, time_sec) if time_run_dist_m > 0 else 0.0
-    target_time_pred_sec = predict_time_by_same_speed(time_run_dist_m, time_sec, target_m) if time_run_dist_m > 0 else 0.0
-
-    # VO2Maxは「時間走の平均速度」から推定
-    v_m_per_min = (time_run_dist_m / time_min) if (time_run_dist_m > 0 and time_min > 0) else 0.0
-    vo2 = estimate_vo2max_by_speed(v_m_per_min)
+@st.cache_resource
+def get_history_store():
+    path = st.secrets.get("HISTORY_DB", "")
+    return HistoryStore(path) if path else None
+
+def history_inputs():
+    """保存先のクラス名と記録日（蓄積が無効なら None）"""
+    if get_history_store() is None:
+        return None
+    c1, c2 = st.columns(2)
+    class_name = c1.text_input("クラス（記録の蓄積用）", key="history_class")
+    run_date = c2.date_input("記録日", key="history_date")
+    return class_name, run_date
 
-    pace_guide = build_pace_guide(target_m, target_time_pred_sec)
-    pace_guide_text = "\n".join([f"- {r['プラン']}: {r['想定タイム']} / {r['目標ラップ']}" for r in pace_guide]) if pace_guide else "- 作成できませんでした"
+def save_history(store, raw_bytes, sheet, target):
+    if store is not None and target is not None:
+        from pe_analysis.extract import extract_cache_key
 
-    alert_lines = "\n".join(
-        [f"- {idx}本目（{idx*LAP_M}m）: {prev:.1f}→{cur:.1f}（+{diff:.1f}秒）" for idx, prev, cur, diff in alerts]
-    ) if alerts else "- 目立った失速アラートなし"
+        store.add_sheet(extract_cache_key(raw_bytes), sheet, class_name=target[0], run_date=target[1])
 
-    dist_race_m = int(rec.get("distance_race_m", 0) or 0)
-    dist_race_time_mmss = str(rec.get("distance_race_time_mmss", "") or "").strip()
+def render_history(name, class_name):
+    store = get_history_store()
+    rows = store.trend(name, class_name)
+    if len(rows) < 2:
+        return
+    import pandas as pd
 
-    if dist_race_m in (3000, 2100) and dist_race_time_mmss:
-        dist_race_line = f"- 距離走の記録：{dist_race_m}m **{dist_race_time_mmss}**（用紙記載）"
-    else:
-        dist_race_line = "- 距離走の記録：用紙から読み取れませんでした"
+    st.markdown("### 📈 これまでの記録（時間走のベスト距離）")
+    df = pd.DataFrame(rows)
+    st.line_chart(df.set_index("run_date")[["best_dist_m", "avg_dist_m"]])
+    pb = store.personal_best(name, class_name)
+    st.caption(f"自己ベスト: {pb['best_dist_m']}m（{pb['run_date']}）｜記録 {len(rows)}回")
 
-    gender_jp = "男子" if profile["gender"] == "male" else "女子"
+REPORT_MODE_DEFAULT = st.secrets.get("REPORT_MODE", "local")
+REPORT_MODE_LABELS = {"local": "数値は即時＋④だけAI", "local_only": "数値のみ（AIなし）", "llm": "全文AI"}
 
-    return f"""
-あなたは陸上長距離のトップコーチ兼データ分析官です。
-以下の数値だけを根拠に、指定の①〜④構成で「文章レポート」を作成してください。
-
-【絶対条件】
-- 日本語（中学生に伝わる）
-- 必ず数字を根拠として入れる
-- 推定は「推定」と明記（VO2Max、換算参考記録）
-- 見出し①〜④をそのまま使う
-- ②は失速地点を必ず言及（何本目/何m地点）
-- ③は維持/目標/突破の3段階（300mラップ）
-- ④は熱く前向きに140文字程度
-- 距離走の記録が用紙にあれば必ず拾って言及する
-- 「何を評価しているか」が分かるように、冒頭で評価軸を一言で示す
-- 時間走は3回（①②③）の結果がある前提で、**ベスト（最大距離）**も必ず示す
-
-【選手・種別】
-選手名: {name}
-推定: {gender_jp}（{time_min}分間走 / {target_m}m）
-判定理由: {profile["reason"]}
-
-【時間走（3回）の結果】
-- ベスト距離: {best_dist}m
-- 平均距離: {avg_dist}m
-- ワースト距離: {worst_dist}m
-
-【今回の詳細（このレポートが解析している回）】
-- 今回の時間走の距離：{int(time_run_dist_m) if time_run_dist_m else 0}m（最下段）
-{dist_race_line}
-
-【通過タイム（秒）】
-{splits_sec}
-
-【ラップ（秒）=通過差分】
-{laps_sec}
-
-【平均ペース（時間走）】
-{sec_to_mmss(pace_sec_km)} /km
-
-【換算参考記録（推定）】
-{target_m}m = {sec_to_mmss(target_time_pred_sec)}
-
-【推定VO2Max（推定：時間走の平均速度から）】
-{vo2} ml/kg/min
-
-【失速アラート（前の本より+3秒以上）】
-{alert_lines}
-
-【③ 目標ラップ表（Pace Guide）】
-{pace_guide_text}
-
-【出力フォーマット（この順番で必ず）】
-① 科学的ポテンシャル診断 (RESULT / Best)
-② ラップ推移 & 失速地点（ATサイン）
-③ 目標ラップ表 (Pace Guide)
-④ COACH'S EYE (専門的アドバイス)
-"""
-
-def generate_text_report(name, profile, rec, all_records):
-    prompt = build_report_prompt(name, profile, rec, all_records)
-    resp = client.responses.create(
-        model="gpt-4.1-mini",
-        input=prompt,
-        temperature=0.4,
-    )
-    return resp.output_text.strip()
+def report_box_html(report):
+    return f'<div class="report-box">{report.replace(chr(10), "<br>")}</div>'
 
 # ==========================================
-# Main
+# バックグラウンドジョブ（抽出・レポート・一括解析の間も画面は止めない）
 # ==========================================
-st.markdown("## 🏃 持久走データサイエンス（ベスト回対応 + 用語解説 + 欄外無視）")
-st.markdown('<div class="small-note">時間走は①②③から「ベスト回（最大距離）」を自動採用できます</div>', unsafe_allow_html=True)
-
-uploaded_file = st.file_uploader("記録用紙を撮影してアップロードしてください", type=["jpg", "jpeg", "png"])
-
-if uploaded_file:
-    raw_img = Image.open(uploaded_file)
-    raw_img = ImageOps.exif_transpose(raw_img).convert("RGB")
-    st.image(raw_img, caption="アップロード画像（元）", width=320)
-
-    preview = optimize_image_for_cost(raw_img, max_width=900)
-    st.image(preview, caption="送信する画像（欄外カット＋軽量化）", width=320)
-
-    with st.spinner("AI解析中（抽出）..."):
-        data, err = run_extract(raw_img)
-
+# ハンドラはワーカースレッドで動くので st.* は呼ばない。クライアント・キャッシュ等は payload で渡す。
+# 画面側は submit してすぐ描画を終え、待ち・実行中のジョブがある間だけ自動更新で見に来る。
+JOB_POLL_SEC = 1.0      # アップロード・一括解析の状態を見に来る間隔
+REPORT_POLL_SEC = 0.3   # レポートのストリーミング表示の更新間隔
+JOB_STATUS_LABELS = {"queued": "⏳ 待ち", "running": "🔄 解析中", "done": "✅ 完了", "error": "❌ エラー"}
+
+def extract_job(p, job):
+    """1枚分：前処理 → 抽出（キャッシュ・single-flight 経由）→ 記録の蓄積"""
+    from pe_analysis.extract import prepare_extract_source, tier_image
+
+    raw_bytes = p["raw_bytes"]
+    # デコード・向き補正・表の検出は1回だけ。プレビューも送信用画像もここから作る
+    preview, source, box = prepare_extract_source(raw_bytes)
+    job.artifacts["preview"] = preview
+    sheet, err, meta = run_extract_cached(p["client"], raw_bytes, source, box, p["cache"], p["flight"])
+    export_metrics()
     if err:
-        st.error(err)
-        st.stop()
+        return {"data": None, "err": err, "meta": meta}
+    # 表示に要る小さい画像と結果だけ残す（元画像・中間画像はここで捨てる）
+    job.artifacts["sent_image"] = tier_image(source, box, meta["tier"])
+    job.artifacts["sheet"] = sheet
+    save_history(p["history"], raw_bytes, sheet, p["target"])
+    return {"data": sheet.to_dict(), "err": None, "meta": meta}
+
+def report_job(p, job):
+    """レポート生成：届いた分を job.progress に書き、完成品はプロンプトごとにキャッシュする"""
+    cache, prompt = p["cache"], p["prompt"]
+    key = report_cache_key(prompt)
+
+    def generate():
+        text = cache.get(key)
+        if text is not None:
+            return text
+        text = ""
+        for delta in stream_text_report(p["client"], prompt):
+            text += delta
+            job.progress = text
+        # ここまで来るのは response.completed を受け取ったときだけ。空の本文は残さない
+        text = text.strip()
+        if not text:
+            raise RuntimeError("レポート: 空の応答が返りました")
+        cache.put(key, text)
+        return text
+
+    # 同じプロンプトを別セッションが生成中なら、こちらはその完成を待つ
+    text, _ = p["flight"].do(key, generate)
+    export_metrics()
+    return {"text": text}
+
+def reports_job(p, job):
+    """レポートのまとめ生成：同時数を抑えて並行に作り、できた順に job.progress（本文のリスト）を埋める"""
+    from pe_analysis.backends import without_sdk_retries
+    from pe_analysis.batch import call_with_backoff
+
+    items = p["items"]  # [(見出し, prefix, prompt), ...]
+    texts = [prefix if prompt is None else None for _, prefix, prompt in items]
+    job.progress = texts
+    todo = [i for i, (_, _, prompt) in enumerate(items) if prompt is not None]
+    client = without_sdk_retries(p["client"])  # 再試行は call_with_backoff だけで行う
+    for k, text, _, err in iter_reports(client, [items[i][2] for i in todo], cache=p["cache"],
+                                        call=call_with_backoff):
+        i = todo[k]
+        # 1人分が失敗しても他の人の分は捨てない（その人の欄にだけ理由を出す）
+        texts[i] = items[i][1] + (text if err is None else f"⚠️ 生成できませんでした（{err}）")
+    export_metrics()
+    return [{"label": label, "text": text} for (label, _, _), text in zip(items, texts)]
+
+def batch_job(p, job):
+    """クラス一括：終わった順に job.progress（1枚ずつの結果リスト）を埋める"""
+    from pe_analysis.batch import iter_batch_extract
+
+    items = p["items"]
+    results = [None] * len(items)
+    job.progress = results
+    stream = iter_batch_extract(p["client"], items, cache=p["cache"], flight=p["flight"],
+                                pack_size=p["pack_size"], pack_layout=p["pack_layout"])
+    for i, res in stream:
+        results[i] = res
+        if not res["err"]:
+            save_history(p["history"], items[i][1], res["data"], p["target"])
+    export_metrics()
+    return [{**r, "data": r["data"].to_dict()} for r in results]
+
+@st.cache_resource
+def get_job_queue():
+    # 全セッションで1つ。1枚ずつのアップロードはクラス一括より先に取り出される（優先度つき）
+    # JOBS_DB（SQLiteファイルパス）があれば状態と結果をジョブIDで残す
+    queue = JobQueue(workers=int(st.secrets.get("JOB_WORKERS", JOB_WORKERS)),
+                     db_path=st.secrets.get("JOBS_DB", "") or None)
+    queue.register("extract", extract_job)
+    queue.register("report", report_job)
+    queue.register("batch", batch_job)
+    queue.register("reports", reports_job)
+    return queue
+
+def job_state(job_id):
+    # 終わったジョブはセッションに写しておく（キューは古い順にメモリから捨てるので、JOBS_DB が無くても
+    # このセッションの結果・画像は再実行のたびに残る）
+    finished = st.session_state.setdefault("finished_jobs", {})
+    if job_id in finished:
+        return finished[job_id]
+    snap = get_job_queue().get(job_id)
+    if snap is None:
+        return {"status": "error", "error": "ジョブが見つかりません", "progress": None, "result": None, "artifacts": {}}
+    if snap["status"] in FINISHED:
+        finished[job_id] = snap
+    return snap
+
+def start_report(prompt, prefix=""):
+    """キャッシュにあればその場で返し、無ければレポート生成ジョブを積む（prompt が None なら prefix が全文）"""
+    if prompt is None:
+        return {"job": None, "prefix": prefix, "text": ""}
+    report_cache = get_report_cache()
+    key = report_cache_key(prompt)
+    text = report_cache.get(key)
+    if text is not None:
+        return {"job": None, "prefix": prefix, "text": text}
+    job_id = get_job_queue().submit(
+        "report", {"client": model_client(), "cache": report_cache, "flight": get_flights()["report"], "prompt": prompt},
+        priority=PRIORITY_INTERACTIVE, key=f"report:{key}",
+    )
+    return {"job": job_id, "prefix": prefix, "text": None}
+
+def render_report(report):
+    """レポート本文。生成中の間だけこの部分を自動更新し、終わったら全体を描き直して更新を止める"""
+    if report["job"] is None:
+        st.markdown(report_box_html(report["prefix"] + report["text"]), unsafe_allow_html=True)
+        return
+    running = job_state(report["job"])["status"] not in FINISHED
+
+    @st.fragment(run_every=REPORT_POLL_SEC if running else None)
+    def report_box():
+        snap = job_state(report["job"])
+        if running and snap["status"] in FINISHED:
+            st.rerun()
+        if snap["status"] == "error":
+            st.error(f"レポート生成エラー: {snap['error']}")
+        elif snap["status"] == "done":
+            st.markdown(report_box_html(report["prefix"] + snap["result"]["text"]), unsafe_allow_html=True)
+        else:
+            text = snap["progress"]
+            st.markdown(report_box_html(report["prefix"] + (text + " ▌" if text else "⏳ 生成中...")),
+                        unsafe_allow_html=True)
+
+    report_box()
+
+def batch_row(res):
+    """一括解析の1枚分を一覧表の1行にまとめる（ベスト回基準）。"""
+    if res is None:
+        return {"状態": "処理中"}
+    row = {"ファイル": res["file"], "状態": "キャッシュ" if res["cached"] else "完了"}
+    if res["err"]:
+        row["状態"] = f"エラー: {res['err']}"
+        return row
+    sheet = res["data"]
+    row["選手名"] = sheet.name
+    best = pick_best_time_run(sheet.records)
+    if best is None:
+        row["状態"] = "recordsが空"
+        return row
+    profile = infer_profile(best, sheet.sheet_hints)
+    m = record_metrics(best, profile)
+    row["推定"] = "男子" if profile["gender"] == "male" else "女子"
+    row["ベスト距離(m)"] = int(m["time_run_dist_m"])
+    row["推定VO2Max"] = m["vo2max"]
+    row["失速アラート数"] = len(m["alerts"])
+    return row
+
+def batch_results(snap):
+    """途中経過（メモリ上の Sheet）か、終わったジョブの結果（JSON）から一覧用の結果リストを作る"""
+    if snap["progress"] is not None:
+        return snap["progress"]
+    if snap["result"] is None:
+        return None
+    return [{**r, "data": parse_sheet(r["data"])} for r in snap["result"]]
+
+def class_index(job_id, results):
+    """一括解析の結果から作ったクラスのインデックス（同じジョブの間はセッションに保持して作り直さない）"""
+    from pe_analysis.ranking import ClassIndex
+
+    cached = st.session_state.get("class_index")
+    if cached is None or cached[0] != job_id:
+        named = [(r["data"].name or r["file"], r["data"]) for r in results if r and not r["err"]]
+        cached = (job_id, ClassIndex.from_sheets(named))
+        st.session_state["class_index"] = cached
+    return cached[1]
+
+@st.fragment
+def render_class_ranking(index):
+    # 絞り込み・しきい値を動かしてもこの部分だけ再実行（並べ済みの配列を引くだけ）
+    import pandas as pd
+
+    from pe_analysis.ranking import ALL, RANK_METRIC_LABELS
+
+    if not len(index):
+        return
+    st.markdown("### 🏅 クラス内の順位・分布（ベスト回）")
+    c1, c2, c3 = st.columns(3)
+    group = c1.selectbox("種目", [ALL, *index.group_names], key="rank_group")
+    # 種目で意味が変わる指標（時間走の距離・予測タイム）は、種目が混ざる「全体」では選べない
+    metric = c2.selectbox("指標", index.metrics(group), format_func=RANK_METRIC_LABELS.get, key="rank_metric")
+    top_n = c3.number_input("上位何人", min_value=3, max_value=50, value=10, key="rank_top")
+    label = RANK_METRIC_LABELS[metric]
+
+    left, right = st.columns(2)
+    top = index.top(metric, top_n, group)
+    left.dataframe(pd.DataFrame([{"順位": i + 1, "名前": name, label: v} for i, (name, v) in enumerate(top)]),
+                   hide_index=True)
+    counts, edges = index.histogram(metric, 10, group)
+    right.bar_chart(pd.DataFrame({"人数": counts}, index=pd.Index(edges[:-1].round(1), name=label)))
+
+    threshold = st.slider("失速アラートのしきい値（前の本より何秒以上遅くなったら）", 1.0, 10.0,
+                          AT_ALERT_THRESHOLD, 0.5, key="rank_threshold")
+    st.caption(f"このしきい値で失速アラートが出る人: {index.alerted_share(threshold, group):.0%}"
+               f"｜{label}が取れている人: {index.count(metric, group)}人（パーセンタイルは種目ごと）")
+    st.dataframe(index.table(threshold, group), hide_index=True)
+
+def class_report_items(results, mode):
+    """一括解析の結果から、1人1件（ベスト回）の [(見出し, prefix, prompt), ...] をまとめて作る"""
+    items = []
+    for r in results:
+        if not r or r["err"]:
+            continue
+        sheet = r["data"]
+        best = pick_best_time_run(sheet.records)
+        if best is None:
+            continue
+        name = sheet.name or r["file"]
+        prefix, prompt = report_request(name, infer_profile(best, sheet.sheet_hints), best, sheet.records, mode)
+        items.append((f"{name}（{best.attempt}回目）", prefix, prompt))
+    return items
+
+def render_class_reports(batch_job_id, results):
+    st.markdown("### 📝 全員分のレポート（ベスト回）")
+    mode = st.radio("レポートの作り方", REPORT_MODES, index=REPORT_MODES.index(REPORT_MODE_DEFAULT),
+                    format_func=REPORT_MODE_LABELS.get, horizontal=True, key="class_report_mode")
+    if st.button("📚 全員分のレポートを生成"):
+        items = class_report_items(results, mode)
+        payload = {"client": model_client(), "items": items, "cache": get_report_cache()}
+        job_id = get_job_queue().submit("reports", payload, priority=PRIORITY_BATCH)
+        st.session_state["class_reports"] = {"for": (batch_job_id, mode), "job": job_id,
+                                             "labels": [label for label, _, _ in items]}
+
+    reports = st.session_state.get("class_reports")
+    if reports is None or reports["for"] != (batch_job_id, mode):
+        return
+    running = job_state(reports["job"])["status"] not in FINISHED
+
+    @st.fragment(run_every=JOB_POLL_SEC if running else None)
+    def reports_panel():
+        snap = job_state(reports["job"])
+        if running and snap["status"] in FINISHED:
+            st.rerun()
+        if snap["status"] == "error":
+            st.error(f"レポート生成エラー: {snap['error']}")
+            return
+        if snap["status"] == "done":
+            rows = snap["result"]
+        elif snap["progress"] is None:
+            st.info("⏳ 順番待ちです")
+            return
+        else:
+            rows = [{"label": label, "text": text} for label, text in zip(reports["labels"], snap["progress"])]
+        n = sum(r["text"] is not None for r in rows)
+        if snap["status"] != "done":
+            st.progress(n / max(1, len(rows)), text=f"{n}/{len(rows)} 完了（できた順に表示）")
+        else:
+            st.download_button("⬇️ まとめてダウンロード（テキスト）",
+                               "\n\n".join(f"■ {r['label']}\n{r['text']}" for r in rows),
+                               file_name="reports.txt", key="class_reports_download")
+        for r in rows:
+            if r["text"] is not None:
+                with st.expander(r["label"]):
+                    st.markdown(report_box_html(r["text"]), unsafe_allow_html=True)
+
+    reports_panel()
+
+def render_batch_mode():
+    import pandas as pd
+
+    from pe_analysis.batch import BATCH_PACK_LAYOUT, BATCH_PACK_SIZE
+    from pe_analysis.extract import summarize_cascade
+
+    files = st.file_uploader("記録用紙をまとめてアップロードしてください（クラス全員分）",
+                             type=["jpg", "jpeg", "png"], accept_multiple_files=True)
+    target = history_inputs()
+    if files and st.button(f"🚀 {len(files)}枚を一括解析"):
+        payload = {
+            "client": model_client(),
+            "items": [(f.name, f.getvalue()) for f in files],
+            "cache": get_extract_cache(),
+            "flight": get_flights()["extract"],
+            "history": get_history_store(),
+            "target": target,
+            # EXTRACT_PACK_SIZE が2以上なら、その枚数ずつまとめて1回で抽出する
+            "pack_size": int(st.secrets.get("EXTRACT_PACK_SIZE", BATCH_PACK_SIZE)),
+            "pack_layout": st.secrets.get("EXTRACT_PACK_LAYOUT", BATCH_PACK_LAYOUT),
+        }
+        st.session_state["batch_job"] = get_job_queue().submit("batch", payload, priority=PRIORITY_BATCH)
+
+    job_id = st.session_state.get("batch_job")
+    if job_id is None:
+        return
+    running = job_state(job_id)["status"] not in FINISHED
+
+    @st.fragment(run_every=JOB_POLL_SEC if running else None)
+    def batch_panel():
+        snap = job_state(job_id)
+        if running and snap["status"] in FINISHED:
+            st.rerun()
+        if snap["status"] == "error":
+            st.error(f"一括解析エラー: {snap['error']}")
+            return
+        results = batch_results(snap)
+        if results is None:
+            st.info("⏳ 順番待ちです（1枚ずつの解析を先に処理しています）")
+            return
+        if snap["status"] != "done":
+            n = sum(r is not None for r in results)
+            st.progress(n / len(results), text=f"{n}/{len(results)} 完了")
+            st.dataframe(pd.DataFrame([batch_row(r) for r in results]), hide_index=True)
+            return
+        st.markdown("### 📋 一括解析の結果（ベスト回）")
+        st.dataframe(pd.DataFrame([batch_row(r) for r in results]), hide_index=True)
+        summary = summarize_cascade([r["meta"] for r in results if r])
+        if summary:
+            tiers = " / ".join(f"{k}: {v}枚" for k, v in summary["tier_counts"].items())
+            st.caption(f"段階的解像度 — {tiers}｜平均 {summary['avg_calls']:.2f}回呼び出し・"
+                       f"入力 {summary['avg_input_tokens']:.0f}トークン・{summary['avg_latency_ms'] / 1000:.1f}秒 / 枚")
+        render_class_ranking(class_index(job_id, results))
+        render_class_reports(job_id, results)
+
+    batch_panel()
 
-    st.success("抽出完了")
+# ==========================================
+# アップロード → 抽出ジョブ（同じファイルは1回だけ積む。結果を待たずに次の用紙を上げられる）
+# ==========================================
+def submit_upload(uploaded_file, history_target=None):
+    uploads = st.session_state.setdefault("uploads", {})
+    if uploaded_file.file_id in uploads:
+        return
+    payload = {
+        "client": model_client(),
+        "raw_bytes": uploaded_file.getvalue(),
+        "cache": get_extract_cache(),
+        "flight": get_flights()["extract"],
+        "history": get_history_store(),
+        "target": history_target,
+    }
+    job_id = get_job_queue().submit("extract", payload, priority=PRIORITY_INTERACTIVE)
+    uploads[uploaded_file.file_id] = {"name": uploaded_file.name, "job": job_id}
+    st.session_state["current_upload"] = uploaded_file.file_id  # 新しく上げた用紙を表示する
+
+def render_upload_queue(uploads):
+    """アップロードした用紙の状態。待ち・解析中がある間だけ自動更新し、どれかが終わったら全体を描き直す"""
+    pending = {fid for fid, u in uploads.items() if job_state(u["job"])["status"] not in FINISHED}
+
+    @st.fragment(run_every=JOB_POLL_SEC if pending else None)
+    def queue_panel():
+        states = {fid: job_state(u["job"])["status"] for fid, u in uploads.items()}
+        if any(states[fid] in FINISHED for fid in pending):
+            st.rerun()
+        if len(uploads) > 1 or pending:
+            st.caption("解析キュー: " + " / ".join(f"{u['name']} {JOB_STATUS_LABELS[states[fid]]}"
+                                                   for fid, u in uploads.items()))
+
+    queue_panel()
 
-    name = data.get("name", "選手")
-    sheet_hints = data.get("sheet_hints", "")
-    records = data.get("records", []) or []
-    if not records:
-        st.error("recordsが空でした。撮影（明るさ・傾き・用紙全体）を改善して再試行してください。")
-        st.stop()
+# ==========================================
+# 回の選択〜レポート（ここでの操作はこの部分だけ再実行）
+# ==========================================
+@st.fragment
+def render_analysis(name, sheet_hints, records):
+    import pandas as pd
 
     # --- ベスト回の自動選択（最大距離） ---
     best_rec = pick_best_time_run(records)
@@ -508,10 +562,8 @@ if uploaded_file:
     # --- UIで手動選択も可能にする（任意）---
     st.markdown("### ✅ どの回をレポート対象にしますか？")
     labels = []
-    for i, r in enumerate(records):
-        att = r.get("attempt", i + 1)
-        d = int(float(r.get("time_run_dist_m", 0) or 0))
-        labels.append(f"{att}回目（{d}m）")
+    for r in records:
+        labels.append(f"{r.attempt}回目（{int(r.time_run_dist_m)}m）")
 
     default_idx = 0
     # best_rec と同じものを初期値にする
@@ -531,11 +583,9 @@ if uploaded_file:
     st.markdown(f"# 🏃‍♂️ {name} 選手｜能力分析レポート（推定：{gender_jp}）")
     st.caption(f"判定理由: {profile['reason']}")
 
-    # 通過タイム
-    splits_mmss = rec.get("splits_mmss", []) or []
-    splits_sec = [mmss_to_sec(x) for x in splits_mmss if str(x).strip()]
-    splits_sec = [s for s in splits_sec if s > 0]
-    splits_sec = sorted(splits_sec)
+    # 通過タイム・ラップ・失速アラート（レポートと同じ計算を1回だけ）
+    metrics = record_metrics(rec, profile)
+    splits_sec = metrics["splits_sec"]
 
     st.markdown("### 📊 通過タイム（300mごと）")
     rows = []
@@ -547,9 +597,9 @@ if uploaded_file:
         st.warning("通過タイムが抽出できませんでした。画像の写りを改善して再試行してください。")
 
     # 最下段値
-    time_run_dist_m = int(float(rec.get("time_run_dist_m", 0) or 0))
-    dist_race_m = int(rec.get("distance_race_m", 0) or 0)
-    dist_race_time = str(rec.get("distance_race_time_mmss", "") or "").strip()
+    time_run_dist_m = int(rec.time_run_dist_m)
+    dist_race_m = rec.distance_race_m
+    dist_race_time = rec.distance_race_time_mmss
 
     c1, c2 = st.columns(2)
     c1.metric("時間走の距離（最下段）", f"{time_run_dist_m} m" if time_run_dist_m else "未取得")
@@ -559,25 +609,104 @@ if uploaded_file:
         c2.metric("距離走の記録（最下段）", "未取得")
 
     # 失速アラート
-    laps_sec = splits_to_laps(splits_sec) if len(splits_sec) >= 2 else []
-    alerts = detect_at_alerts(laps_sec, threshold=3.0)
+    alerts = metrics["alerts"]
     if alerts:
-        st.warning("⚠️ 失速アラート（前の本より+3秒以上）: " +
+        st.warning(f"⚠️ 失速アラート（前の本より+{metrics['alert_threshold']:g}秒以上）: " +
                    " / ".join([f"{idx2}本目(+{diff:.1f}s)" for idx2, _, _, diff in alerts]))
     else:
         st.info("失速アラート：目立った失速なし")
 
     st.markdown("### 📝 文章レポート（画像なし生成）")
-    if st.button("📄 詳細レポートを生成（画像なし）"):
-        with st.spinner("文章レポート生成中..."):
-            try:
-                report = generate_text_report(name, profile, rec, records)
+    report_mode = st.radio("レポートの作り方", REPORT_MODES, index=REPORT_MODES.index(REPORT_MODE_DEFAULT),
+                           format_func=REPORT_MODE_LABELS.get, horizontal=True)
+    upload = st.session_state.get("current_upload")
+    c1, c2 = st.columns(2)
+    if c1.button("📄 詳細レポートを生成（画像なし）"):
+        prefix, prompt = report_request(name, profile, rec, records, report_mode)
+        report = start_report(prompt, prefix)
+        # 生成は裏で進む。どの用紙・どの回・どの作り方のレポートかを覚えておき、一致する間だけ表示する
+        report["for"] = (upload, idx, report_mode)
+        st.session_state["report"] = report
+    if len(records) > 1 and c2.button(f"📚 全ての回（{len(records)}回分）のレポートを生成"):
+        # プロンプトを全部先に作って一度に積む（同時に走る数はジョブキューのワーカー数まで）
+        st.session_state["reports_all"] = {
+            "for": (upload, report_mode),
+            "items": [(attempt, start_report(prompt, prefix))
+                      for attempt, prefix, prompt in sheet_report_requests(name, sheet_hints, records, report_mode)],
+        }
+
+    report = st.session_state.get("report")
+    shown = report is not None and report["for"] == (upload, idx, report_mode)
+    if shown:
+        st.markdown("#### レポート本文")
+        render_report(report)
+    reports_all = st.session_state.get("reports_all")
+    if reports_all is not None and reports_all["for"] == (upload, report_mode):
+        shown = True
+        for attempt, r in reports_all["items"]:
+            st.markdown(f"#### {attempt}回目のレポート")
+            render_report(r)
+    if shown:
+        st.markdown("#### 用語解説（授業用）")
+        st.markdown(GLOSSARY_HTML, unsafe_allow_html=True)
+
+# ==========================================
+# Main
+# ==========================================
+st.markdown("## 🏃 持久走データサイエンス（ベスト回対応 + 用語解説 + 欄外無視）")
+st.markdown('<div class="small-note">時間走は①②③から「ベスト回（最大距離）」を自動採用できます</div>', unsafe_allow_html=True)
 
-                st.markdown("#### レポート本文")
-                st.markdown(f'<div class="report-box">{report.replace(chr(10), "<br>")}</div>', unsafe_allow_html=True)
+mode = st.radio("モード", ["1枚ずつ", "クラス一括"], horizontal=True)
+if mode == "クラス一括":
+    render_batch_mode()
+    st.stop()
 
-                st.markdown("#### 用語解説（授業用）")
-                st.markdown(f'<div class="glossary-box">{GLOSSARY_TEXT.replace(chr(10), "<br>")}</div>', unsafe_allow_html=True)
+history_target = history_inputs()
+uploaded_file = st.file_uploader("記録用紙を撮影してアップロードしてください", type=["jpg", "jpeg", "png"])
+if uploaded_file:
+    submit_upload(uploaded_file, history_target)
+
+uploads = st.session_state.get("uploads")
+if uploads:
+    render_upload_queue(uploads)
+    if len(uploads) > 1:
+        st.selectbox("表示する用紙", list(uploads), key="current_upload", format_func=lambda fid: uploads[fid]["name"])
+
+    current = st.session_state["current_upload"]
+    snap = job_state(uploads[current]["job"])
+    artifacts = snap["artifacts"]
+    if "preview" in artifacts:
+        st.image(artifacts["preview"], caption="アップロード画像（元）", width=320)
+
+    if snap["status"] not in FINISHED:
+        st.info("⏳ AI解析中（抽出）... 終わると自動で表示されます。その間に次の用紙をアップロードできます。")
+        st.stop()
+    result = snap["result"] or {}
+    err = snap["error"] or result.get("err")
+    if err:
+        st.error(err)
+        # 失敗結果はキャッシュしていないので、同じファイルのままもう一度積み直せる
+        if uploaded_file is not None and uploaded_file.file_id == current and st.button("🔁 もう一度解析"):
+            del uploads[current]
+            st.rerun()
+        st.stop()
+
+    from pe_analysis.extract import EXTRACT_TIERS
+
+    meta = result["meta"]
+    tier_w, tier_q = EXTRACT_TIERS[meta["tier"]]
+    if "sent_image" in artifacts:
+        st.image(artifacts["sent_image"], caption=f"送信した画像（表の枠で切り抜き＋軽量化：{tier_w}px / 品質{tier_q}）", width=320)
+    st.success("抽出完了")
+    if meta["issues"]:
+        st.warning("読み取り結果に気になる点があります: " + " / ".join(meta["issues"]))
+
+    # 同じプロセスで解析した分は型つきの Sheet をそのまま使う（再起動後など DB から読んだときだけ組み立て直す）
+    data = artifacts.get("sheet") or parse_sheet(result["data"])
+    if not data.records:
+        st.error("recordsが空でした。撮影（明るさ・傾き・用紙全体）を改善して再試行してください。")
+        st.stop()
 
-            except Exception as e:
-                st.error(f"レポート生成エラー: {e}")
+    render_analysis(data.name, data.sheet_hints, data.records)
+    if history_target is not None:
+        render_history(data.name, history_target[0])
@@ -0,0 +1,95 @@
+"""
+コールドスタートの計測（新しいコンテナ・新しいプロセスで最初の画面が出るまで）。
+毎回まっさらな Python プロセスを立て、AppTest でアプリを1回動かして（アップロード欄が出るまで）の時間と、
+続けてもう1回動かしたとき（描き直し）の時間、その時点で読み込まれていた重いモジュールを出す。
+あわせてモジュールごとの import 時間（これも別プロセスで1つずつ）を出す。
+
+    python benchmarks/cold_start.py                 # 今の app.py
+    python benchmarks/cold_start.py --app /tmp/old/app.py --repeat 7   # 別の版（git worktree 等）と比べる
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+HEAVY_MODULES = ("pandas", "numpy", "PIL.Image", "openai", "pyarrow")
+IMPORT_MODULES = ("streamlit", "pandas", "numpy", "PIL.Image", "openai",
+                  "pe_analysis.report", "pe_analysis.extract", "pe_analysis.batch", "pe_analysis.ranking")
+
+# 子プロセスで動かす本体（結果は JSON 1行で stdout へ）
+FIRST_PAINT = """
+import json, logging, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t_streamlit = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.secrets["MODEL_BACKEND"] = "standin"
+at.run()
+t_first = time.perf_counter()
+if at.exception or not at.file_uploader:
+    raise SystemExit(f"最初の画面が出ませんでした: {at.exception}")
+at.run()
+t_rerun = time.perf_counter()
+print(json.dumps({
+    "streamlit_ms": (t_streamlit - t0) * 1000,
+    "first_paint_ms": (t_first - t0) * 1000,
+    "app_first_run_ms": (t_first - t_streamlit) * 1000,
+    "rerun_ms": (t_rerun - t_first) * 1000,
+    "heavy_loaded": [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+}))
+"""
+
+IMPORT_ONE = """
+import sys, time
+t0 = time.perf_counter()
+__import__(sys.argv[1])
+print((time.perf_counter() - t0) * 1000)
+"""
+
+
+def child(code, *argv, cwd):
+    out = subprocess.run([sys.executable, "-c", code, *argv], cwd=cwd, capture_output=True, text=True, check=True)
+    return out.stdout.strip().splitlines()[-1]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--app", default=str(ROOT / "app.py"), help="計測する app.py（pe_analysis はその隣のものを使う）")
+    ap.add_argument("--repeat", type=int, default=5, help="プロセスを立て直して測る回数（中央値を出す）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出す")
+    args = ap.parse_args()
+    app = Path(args.app).resolve()
+
+    child(FIRST_PAINT, str(app), json.dumps(HEAVY_MODULES), cwd=app.parent)  # .pyc 作成・ディスクキャッシュ分を除く
+    runs = [json.loads(child(FIRST_PAINT, str(app), json.dumps(HEAVY_MODULES), cwd=app.parent))
+            for _ in range(args.repeat)]
+    keys = ("streamlit_ms", "app_first_run_ms", "first_paint_ms", "rerun_ms")
+    result = {
+        "app": str(app),
+        "median": {k: round(statistics.median(r[k] for r in runs), 1) for k in keys},
+        "heavy_loaded": runs[-1]["heavy_loaded"],
+        "import_ms": {m: round(statistics.median(float(child(IMPORT_ONE, m, cwd=app.parent)) for _ in range(args.repeat)), 1)
+                      for m in IMPORT_MODULES},
+    }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    med = result["median"]
+    print(f"{app}（{args.repeat}回の中央値）")
+    print(f"  streamlit の import      {med['streamlit_ms']:8.1f} ms")
+    print(f"  アプリの初回実行          {med['app_first_run_ms']:8.1f} ms")
+    print(f"  最初の画面まで（合計）    {med['first_paint_ms']:8.1f} ms")
+    print(f"  描き直し（2回目の実行）   {med['rerun_ms']:8.1f} ms")
+    print(f"  最初の画面の時点で読み込み済みの重いモジュール: {', '.join(result['heavy_loaded']) or 'なし'}")
+    print("  import 時間（単独）:")
+    for m, ms in result["import_ms"].items():
+        print(f"    {m:22s} {ms:8.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+一括計算エンジン（pe_analysis.engine）と1件ずつの関数（pe_analysis.core）の一致確認＋速度比較。
+
+    python benchmarks/engine_throughput.py --n 100000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from pe_analysis.core import build_pace_guide, infer_profile, parse_record, record_metrics, sec_to_mmss  # noqa: E402
+from pe_analysis.engine import compute_batch  # noqa: E402
+
+
+def synthetic_records(n, seed=0):
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        male = rng.random() < 0.5
+        n_splits = rng.randint(0, 12)
+        t = 0.0
+        splits = []
+        for _ in range(n_splits):
+            t += rng.uniform(55, 90)
+            splits.append(sec_to_mmss(t))
+        if splits and rng.random() < 0.1:
+            splits[rng.randrange(len(splits))] = rng.choice(["", "?", "1:0x", " "])
+        out.append({
+            "attempt": i % 3 + 1,
+            "splits_mmss": splits,
+            "time_run_dist_m": rng.choice([0, rng.randint(2000, 4800)]) if rng.random() < 0.1 else rng.randint(2000, 4800),
+            "distance_race_m": 3000 if male else 2100,
+        })
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100_000)
+    ap.add_argument("--threshold", type=float, default=3.0)
+    args = ap.parse_args()
+
+    raw = synthetic_records(args.n)
+    t0 = time.perf_counter()
+    records = [parse_record(r, i) for i, r in enumerate(raw)]
+    t_parse = time.perf_counter() - t0
+    profiles = [infer_profile(r, "") for r in records]
+
+    t0 = time.perf_counter()
+    scalar = [record_metrics(r, p, threshold=args.threshold) for r, p in zip(records, profiles)]
+    guides = [build_pace_guide(p["target_m"], m["target_time_pred_sec"]) for p, m in zip(profiles, scalar)]
+    t_scalar = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    out = compute_batch(records, profiles, threshold=args.threshold)
+    t_batch = time.perf_counter() - t0
+
+    # 一致確認
+    rec_df, lap_df = out["records"], out["laps"]
+    assert np.allclose(rec_df["vo2max"], [m["vo2max"] for m in scalar])
+    assert np.allclose(rec_df["pace_sec_km"], [m["pace_sec_km"] for m in scalar])
+    assert np.allclose(rec_df["target_time_pred_sec"], [m["target_time_pred_sec"] for m in scalar])
+    assert (rec_df["alert_count"].to_numpy() == [len(m["alerts"]) for m in scalar]).all()
+    assert np.allclose(lap_df["lap_sec"], [x for m in scalar for x in m["laps_sec"]])
+    flat_guides = [(i, g["プラン"], g["想定タイム"], g["目標ラップ"]) for i, gs in enumerate(guides) for g in gs]
+    assert list(out["pace_guide"].itertuples(index=False, name=None)) == flat_guides
+
+    # しきい値だけ変える場合
+    t0 = time.perf_counter()
+    mask = lap_df["diff_sec"].to_numpy() >= 5.0
+    t_sweep = time.perf_counter() - t0
+
+    print(f"records: {args.n}  laps: {len(lap_df)}")
+    print(f"parse  : {t_parse:.3f}s  ({args.n / t_parse:,.0f} records/s, 1回だけ)")
+    print(f"scalar : {t_scalar:.3f}s  ({args.n / t_scalar:,.0f} records/s)")
+    print(f"batch  : {t_batch:.3f}s  ({args.n / t_batch:,.0f} records/s)  x{t_scalar / t_batch:.1f}")
+    print(f"threshold sweep: {t_sweep * 1000:.2f}ms  ({int(mask.sum())} alerts @5.0s)")
+
+
+if __name__ == "__main__":
+    main()
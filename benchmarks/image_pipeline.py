@@ -0,0 +1,109 @@
+"""
+アップロード1枚あたりの前処理コスト（CPU時間・ピークメモリ）を、旧方式と prepare_upload で比較する。
+各方式は別プロセス（同じ import 状態）で実行し、ru_maxrss をピークメモリとして比べる。
+旧方式は表の検出なし（欄外カットのみ）なので、比べるのは同じ条件の single_pass。表の検出（grid）の分は
+single_pass+grid の行と「表の検出」の差で別に出す。
+
+    python benchmarks/image_pipeline.py --width 4032 --height 3024 --repeat 5
+"""
+import argparse
+import importlib
+import json
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def synthetic_photo(width, height, orientation=6, seed=0):
+    """罫線入りの記録用紙っぽい画像（EXIF で90度回転指定つき）を JPEG で作る"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    arr = rng.integers(150, 200, size=(height, width, 3), dtype=np.uint8)
+    arr[::max(1, height // 40), :, :] = 30
+    arr[:, ::max(1, width // 12), :] = 30
+    image = Image.fromarray(arr)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buf = BytesIO()
+    image.save(buf, format="JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def legacy(raw_bytes):
+    # 以前の app.py：原寸デコード → プレビュー(900px) と送信用(768px) を別々に前処理
+    from PIL import Image, ImageOps
+    from pe_analysis.image import image_to_data_url, optimize_image_for_cost
+
+    raw_img = Image.open(BytesIO(raw_bytes))
+    raw_img = ImageOps.exif_transpose(raw_img).convert("RGB")
+    preview = optimize_image_for_cost(raw_img, max_width=900, detect_grid=False)
+    url = image_to_data_url(optimize_image_for_cost(raw_img, max_width=768, detect_grid=False), jpeg_quality=65)
+    return raw_img.size, preview.size, len(url)
+
+
+def single_pass(raw_bytes, detect_grid=False):
+    from pe_analysis.image import image_to_data_url, prepare_upload, resize_enhance
+
+    original_preview, source, box = prepare_upload(raw_bytes, max_width=768, detect_grid=detect_grid)
+    api_img = resize_enhance(source, box, 768)
+    url = image_to_data_url(api_img, jpeg_quality=65)
+    return original_preview.size, api_img.size, len(url)
+
+
+def run_child(name, path, repeat):
+    importlib.import_module("pe_analysis.image")  # PIL を含むインポート分をベースライン側に入れておく
+
+    raw_bytes = Path(path).read_bytes()
+    fn = {"legacy": legacy, "single_pass": single_pass,
+          "single_pass+grid": lambda raw: single_pass(raw, detect_grid=True)}[name]
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu = []
+    for _ in range(repeat):
+        t0 = time.process_time()
+        out = fn(raw_bytes)
+        cpu.append(time.process_time() - t0)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"name": name, "cpu_ms": min(cpu) * 1000, "base_mb": base_kb / 1024,
+                      "peak_mb": peak_kb / 1024, "out": out}))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--width", type=int, default=4032)
+    ap.add_argument("--height", type=int, default=3024)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.repeat)
+        return
+
+    path = ROOT / "benchmarks" / f".photo_{args.width}x{args.height}.jpg"
+    if not path.exists():
+        path.write_bytes(synthetic_photo(args.width, args.height))
+
+    results = {}
+    for name in ("legacy", "single_pass", "single_pass+grid"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--repeat", str(args.repeat), "--child", name, str(path)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[name] = json.loads(out)
+        r = results[name]
+        print(f"{name:16s} cpu {r['cpu_ms']:8.1f} ms   peak RSS {r['peak_mb']:6.1f} MB "
+              f"(import後 {r['base_mb']:.1f} MB)   sizes {r['out']}")
+    print(f"cpu x{results['legacy']['cpu_ms'] / results['single_pass']['cpu_ms']:.1f}（同じ条件：表の検出なし）")
+    print(f"表の検出 +{results['single_pass+grid']['cpu_ms'] - results['single_pass']['cpu_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Streamlit アプリの同時セッション負荷試験。
+代役サーバ（python -m pe_analysis standin）を別プロセスで立て、AppTest で N セッションを同時に動かす。
+各セッションは「記録用紙をアップロード → 回を切り替え → レポート生成」を行い（抽出・レポートは
+アプリ側で裏のジョブになるので、結果が表示されるまで描き直して待った時間を測る）、
+同時数ごとにスループット・操作ごとの遅延（p50/p95/max）・1セッションあたりの RSS を出す。
+同時数を倍にしてもスループットが伸びなくなった（+10%未満）所を飽和点とする。
+
+    python benchmarks/load_test.py --levels 1,2,4,8,16 --latency-ms 800
+"""
+import argparse
+import json
+import logging
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from image_pipeline import synthetic_photo  # noqa: E402
+
+from pe_analysis.metrics import _quantile  # noqa: E402
+
+APP = ROOT / "app.py"
+SATURATION_GAIN = 1.10
+POLL_SEC = 0.1  # 抽出・レポートは裏のジョブで進むので、終わるまでこの間隔で描き直して待つ
+# AppTest は実行のたびにグローバルの Runtime・st.secrets を差し替えるので、スクリプトの実行は1つずつ。
+# 抽出・レポート本体はアプリのジョブキューで並行に進むので、測りたい待ち時間はこれで歪まない。
+RUN_LOCK = threading.Lock()
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class PeakRSS:
+    """別スレッドで RSS を見張り、区間中の最大値を取る"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def start_standin(port, latency_ms, report_latency_ms, fail_rate, extra_args=()):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "pe_analysis", "standin", "--port", str(port),
+         "--latency-ms", str(latency_ms), "--report-latency-ms", str(report_latency_ms),
+         "--fail-rate", str(fail_rate), *extra_args],
+        cwd=ROOT, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("standin サーバが起動しませんでした")
+
+
+def extracting(at):
+    return any("AI解析中" in el.value for el in at.info)
+
+
+def reporting(at):
+    return any("report-box" in el.value and ("▌" in el.value or "⏳" in el.value) for el in at.markdown)
+
+
+def run(target):
+    """AppTest か操作した要素の run()（RUN_LOCK の中で）"""
+    with RUN_LOCK:
+        return target.run()
+
+
+def run_until(at, busy, timeout):
+    """busy(at) が偽になるまで再実行する（画面の自動更新の代わり）"""
+    deadline = time.monotonic() + timeout
+    while busy(at) and time.monotonic() < deadline:
+        time.sleep(POLL_SEC)
+        run(at)
+    if busy(at):
+        raise TimeoutError("ジョブが終わりませんでした")
+
+
+def run_session(photo, name, base_url, timeout, keep):
+    """1人分の操作。(操作名, 秒) のリストと、エラーがあればその内容を返す"""
+    from streamlit.testing.v1 import AppTest
+
+    timings = []
+    at = AppTest.from_file(str(APP), default_timeout=timeout)
+    at.secrets["MODEL_BACKEND"] = "standin"
+    at.secrets["MODEL_BASE_URL"] = base_url
+
+    def step(label, action):
+        t0 = time.perf_counter()
+        action()
+        timings.append((label, time.perf_counter() - t0))
+        if at.exception:
+            raise RuntimeError(f"{label}: {at.exception[0].value}")
+        if at.error:
+            raise RuntimeError(f"{label}: {at.error[0].value}")
+
+    try:
+        step("open", lambda: run(at))
+        step("upload", lambda: run_until(run(at.file_uploader[0].set_value((name, photo, "image/jpeg"))), extracting, timeout))
+        n_attempts = len(at.selectbox[0].options)
+        for i in range(n_attempts):
+            step("switch", lambda: run(at.selectbox[0].select_index(i)))
+        step("report", lambda: run_until(run(at.button[0].click()), reporting, timeout))
+        err = None
+    except Exception as e:
+        err = str(e)
+    keep.append(at)  # 測定区間が終わるまでセッションを生かしておく（RSS に載せる）
+    return timings, err
+
+
+def run_level(n, photos, base_url, timeout):
+    keep = []
+    base = rss_mb()
+    with PeakRSS() as peak, ThreadPoolExecutor(max_workers=n) as pool:
+        t0 = time.perf_counter()
+        futures = [pool.submit(run_session, photo, f"sheet_{i}.jpg", base_url, timeout, keep)
+                   for i, photo in enumerate(photos)]
+        results = [f.result() for f in futures]
+        wall = time.perf_counter() - t0
+    keep.clear()
+
+    by_step = {}
+    for timings, _ in results:
+        for label, sec in timings:
+            by_step.setdefault(label, []).append(sec)
+    errors = [err for _, err in results if err]
+    return {
+        "sessions": n,
+        "ok": n - len(errors),
+        "wall_s": round(wall, 2),
+        "throughput_per_min": round((n - len(errors)) / wall * 60, 1),
+        "rss_per_session_mb": round((peak.peak - base) / n, 1),
+        "latency_ms": {
+            label: {
+                "p50": round(_quantile(sorted(v), 0.50) * 1000),
+                "p95": round(_quantile(sorted(v), 0.95) * 1000),
+                "max": round(max(v) * 1000),
+            }
+            for label, v in by_step.items()
+        },
+        "errors": errors[:3],
+    }
+
+
+def saturation_point(levels):
+    """スループットの伸びが SATURATION_GAIN 未満になった最初の同時数（なければ None）"""
+    for prev, cur in zip(levels, levels[1:]):
+        if cur["throughput_per_min"] < prev["throughput_per_min"] * SATURATION_GAIN:
+            return cur["sessions"]
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--levels", default="1,2,4,8", help="同時セッション数（カンマ区切り）")
+    ap.add_argument("--width", type=int, default=4032)
+    ap.add_argument("--height", type=int, default=3024)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=800.0, help="代役サーバの抽出遅延")
+    ap.add_argument("--report-latency-ms", type=float, default=1500.0, help="代役サーバのレポート遅延")
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--timeout", type=float, default=300.0, help="1操作あたりのタイムアウト（秒）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出す")
+    args = ap.parse_args()
+
+    # AppTest が別スレッドから動くたびに出る警告を黙らせる
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: "missing ScriptRunContext" not in record.getMessage())
+    levels = [int(x) for x in args.levels.split(",")]
+    # 全セッションで別々の用紙を使う（同じ画像だと抽出・レポートのキャッシュに当たってしまう）
+    seeds = iter(range(10**6))
+
+    def fresh_photos(n):
+        return [synthetic_photo(args.width, args.height, seed=next(seeds)) for _ in range(n)]
+
+    proc = start_standin(args.port, args.latency_ms, args.report_latency_ms, args.fail_rate)
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+    try:
+        run_level(1, fresh_photos(1), base_url, args.timeout)  # ウォームアップ（import・初回コンパイル分を除く）
+        results = []
+        for n in levels:
+            r = run_level(n, fresh_photos(n), base_url, args.timeout)
+            results.append(r)
+            if not args.json:
+                lat = "  ".join(f"{k} {v['p50']}/{v['p95']}ms" for k, v in r["latency_ms"].items())
+                print(f"{n:3d}同時  {r['ok']}/{n}成功  {r['throughput_per_min']:6.1f}件/分  "
+                      f"RSS {r['rss_per_session_mb']:6.1f}MB/人  {lat}")
+                for err in r["errors"]:
+                    print(f"     エラー: {err}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    sat = saturation_point(results)
+    if args.json:
+        print(json.dumps({"levels": results, "saturation_sessions": sat}, ensure_ascii=False, indent=2))
+    else:
+        print(f"飽和点: {sat}同時" if sat else "飽和点: 測定範囲内では未到達")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+純粋な計算関数と画像前処理のマイクロベンチマーク（asv 風：固定シードの合成データ＋保存済みベースライン比較）。
+
+    python benchmarks/micro.py                 # baseline_micro.json と比べ、遅くなったものを報告（終了コード 1）
+    python benchmarks/micro.py --save          # 今の結果をベースラインとして保存
+    python benchmarks/micro.py --save -k parse # 変えた関数の分だけ保存し直す（他の行はそのまま残る）
+    python benchmarks/micro.py -k image        # 名前に image を含むものだけ
+
+1件あたりの時間は「min_time 秒以上まわした1回分の平均」を repeat 回とって最小値を使う。
+10µs 未満の軽い関数はプロセスごとの揺れ（同じコードで 1.2〜1.75µs など ±40%前後）が大きいので、
+repeat を FAST_REPEAT_FACTOR 倍にし、退行の判定も --fast-tolerance で緩める（2倍の退行は拾える）。
+5件以上比べたときは、比の中央値（マシン全体の遅さ）で割ってから判定する。しきい値を超えたものは
+別のプロセスで CONFIRM_PROCESSES 回測り直し（プロセスごとの揺れは同じプロセスで測り直しても消えない）、
+最も速い値でも遅いときだけ退行とする。
+ベースラインはマシン依存なので、比較は同じマシンで保存したものどうしで行うこと。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from image_pipeline import synthetic_photo  # noqa: E402
+
+from pe_analysis.core import (  # noqa: E402
+    build_pace_guide,
+    detect_at_alerts,
+    infer_profile,
+    mmss_to_sec,
+    parse_sheet,
+    pick_best_time_run,
+    safe_json_load,
+    sec_to_mmss,
+    splits_to_laps,
+)
+from pe_analysis.image import image_to_data_url, optimize_image_for_cost  # noqa: E402
+from pe_analysis.ranking import ClassIndex  # noqa: E402
+
+BASELINE = Path(__file__).with_name("baseline_micro.json")
+SEED = 20240401
+PHONE_SIZES = ((4032, 3024), (3024, 4032), (1920, 1440))
+CLASS_SHEETS = 2000  # 学年全体のインデックスを想定した枚数
+JPEG_QUALITIES = (50, 65, 80)
+FAST_ENTRY_SEC = 1e-5    # 1件あたりこれより速いものは揺れが大きい
+FAST_REPEAT_FACTOR = 3
+CONFIRM_PROCESSES = 2      # 退行に見えたものを測り直す別プロセスの数
+HOST_MIN_ENTRIES = 5       # 比の中央値でマシン全体の遅さを割り引くのは、これ以上比べたときだけ
+
+
+# ==========================================
+# 合成データ（固定シード）
+# ==========================================
+def synthetic_splits(rng, n):
+    t = 0.0
+    out = []
+    for _ in range(n):
+        t += rng.uniform(55, 90)
+        out.append(t)
+    return out
+
+
+def synthetic_records(rng):
+    return [
+        {
+            "attempt": a,
+            "splits_mmss": [sec_to_mmss(s) for s in synthetic_splits(rng, rng.randint(6, 14))],
+            "time_run_dist_m": rng.choice([0, rng.randint(2000, 4800)]),
+            "distance_race_m": rng.choice([3000, 2100, 0]),
+        }
+        for a in (1, 2, 3)
+    ]
+
+
+def model_outputs(rng, messy):
+    """モデル応答の文字列。messy は前置き・コードフェンス・後書きつき"""
+    out = []
+    for _ in range(200):
+        text = json.dumps({"name": "選手", "sheet_hints": "男子 15分", "records": synthetic_records(rng)}, ensure_ascii=False)
+        if messy:
+            text = f"以下が抽出結果です。\n```json\n{text}\n```\n不明な欄は空にしました。"
+        out.append(text)
+    return out
+
+
+def decoded_photo(width, height):
+    from PIL import Image
+
+    return Image.open(BytesIO(synthetic_photo(width, height, orientation=1, seed=SEED))).convert("RGB")
+
+
+# ==========================================
+# ベンチマーク定義：名前 → (本体, 1回で処理する件数)
+# ==========================================
+def bench_cases():
+    rng = random.Random(SEED)
+    mmss = [sec_to_mmss(rng.uniform(0, 1200)) for _ in range(1000)] + ["", "?", "1:0x", "12"] * 25
+    secs = [rng.uniform(0, 1200) for _ in range(1000)]
+    split_lists = [synthetic_splits(rng, rng.randint(0, 14)) for _ in range(300)]
+    lap_lists = [splits_to_laps(s) for s in split_lists]
+    pace_targets = [(rng.choice([3000, 2100]), rng.uniform(540, 1200)) for _ in range(300)]
+    sheets = [parse_sheet({"records": synthetic_records(rng), "sheet_hints": rng.choice(["男子 15分", "女子 12分", "", "3000m"])})
+              for _ in range(300)]
+    clean, messy = model_outputs(rng, False), model_outputs(rng, True)
+    raw_sheets = [json.loads(t) for t in clean]
+
+    cases = {
+        "core.mmss_to_sec": (lambda: [mmss_to_sec(s) for s in mmss], len(mmss)),
+        "core.sec_to_mmss": (lambda: [sec_to_mmss(s) for s in secs], len(secs)),
+        "core.splits_to_laps": (lambda: [splits_to_laps(s) for s in split_lists], len(split_lists)),
+        "core.detect_at_alerts": (lambda: [detect_at_alerts(laps) for laps in lap_lists], len(lap_lists)),
+        "core.build_pace_guide": (lambda: [build_pace_guide(m, t) for m, t in pace_targets], len(pace_targets)),
+        "core.pick_best_time_run": (lambda: [pick_best_time_run(s.records) for s in sheets], len(sheets)),
+        "core.infer_profile": (lambda: [infer_profile(s.records[0], s.sheet_hints) for s in sheets], len(sheets)),
+        "core.parse_sheet": (lambda: [parse_sheet(d) for d in raw_sheets], len(raw_sheets)),
+        "core.safe_json_load[clean]": (lambda: [safe_json_load(t) for t in clean], len(clean)),
+        "core.safe_json_load[messy]": (lambda: [safe_json_load(t) for t in messy], len(messy)),
+    }
+    for w, h in PHONE_SIZES:
+        cases[f"image.optimize_image_for_cost[{w}x{h}]"] = (lambda img=decoded_photo(w, h): optimize_image_for_cost(img), 1)
+    api_img = optimize_image_for_cost(decoded_photo(*PHONE_SIZES[0]))
+    for q in JPEG_QUALITIES:
+        cases[f"image.image_to_data_url[q{q}]"] = (lambda q=q: image_to_data_url(api_img, jpeg_quality=q), 1)
+
+    # クラス・学年の順位インデックス（既存ケースのデータを変えないよう別の乱数列で作る）
+    rng = random.Random(SEED + 1)
+    named = [(str(i), parse_sheet({"records": synthetic_records(rng), "sheet_hints": rng.choice(["男子 15分", "女子 12分"])}))
+             for i in range(CLASS_SHEETS)]
+    index = ClassIndex.from_sheets(named)
+    thresholds = [1.0 + 0.5 * k for k in range(14)]
+    dists = [rng.randint(2000, 4800) for _ in range(1000)]
+    n = CLASS_SHEETS
+    group = index.group_names[0]  # 時間走の距離・予測タイムは種目グループの中で並べる
+    cases[f"ranking.build[{n}]"] = (lambda: ClassIndex.from_sheets(named), 1)
+    cases[f"ranking.alert_counts[{n}]"] = (lambda: [index.alert_counts(t) for t in thresholds], len(thresholds))
+    cases[f"ranking.alerted_share[{n}]"] = (lambda: [index.alerted_share(t) for t in thresholds], len(thresholds))
+    cases[f"ranking.percentile[{n}]"] = (lambda: [index.percentile("time_run_dist_m", d, group) for d in dists], len(dists))
+    cases[f"ranking.top10[{n}]"] = (lambda: index.top("vo2max", 10), 1)
+    cases[f"ranking.histogram[{n}]"] = (lambda: index.histogram("target_time_pred_sec", 20, group), 1)
+    return cases
+
+
+def measure(fn, per_call, repeat, min_time):
+    """1件あたりの秒数（repeat 回のうち最小）"""
+    fn()  # ウォームアップ
+    best = float("inf")
+    for _ in range(repeat):
+        loops, t0 = 0, time.perf_counter()
+        while True:
+            fn()
+            loops += 1
+            elapsed = time.perf_counter() - t0
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / loops / per_call)
+    return best
+
+
+def measure_entry(fn, per_call, repeat, min_time):
+    sec = measure(fn, per_call, repeat, min_time)
+    if sec < FAST_ENTRY_SEC:
+        sec = min(sec, measure(fn, per_call, repeat * (FAST_REPEAT_FACTOR - 1), min_time))
+    return sec
+
+
+def measure_in_new_process(name, args):
+    """name の1件だけを別の Python プロセスで測る（--measure-one）"""
+    out = subprocess.run([sys.executable, __file__, "--measure-one", name, "--repeat", str(args.repeat),
+                          "--min-time", str(args.min_time)], capture_output=True, text=True, check=True)
+    return float(out.stdout)
+
+
+def fmt_time(sec):
+    if sec >= 1e-3:
+        return f"{sec * 1e3:9.2f} ms"
+    return f"{sec * 1e6:9.2f} µs"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--save", action="store_true", help="結果をベースラインとして保存する")
+    ap.add_argument("-k", default="", help="名前にこの文字列を含むものだけ実行")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--min-time", type=float, default=0.2, help="1回の計測で最低限まわす秒数")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="この割合を超えて遅くなったら退行とみなす")
+    ap.add_argument("--fast-tolerance", type=float, default=0.6, help="10µs 未満のものに使う --tolerance")
+    ap.add_argument("--baseline", default=str(BASELINE))
+    ap.add_argument("--measure-one", help=argparse.SUPPRESS)  # 測り直し用：この1件の秒数だけを出力
+    args = ap.parse_args()
+
+    if args.measure_one:
+        fn, per_call = bench_cases()[args.measure_one]
+        print(repr(measure_entry(fn, per_call, args.repeat, args.min_time)))
+        return 0
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+    base_results = baseline.get("results", {})
+    machine = {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+    if base_results and not args.save and baseline.get("machine") != machine:
+        print(f"注意: ベースラインは別環境で保存されています（{baseline.get('machine')}）", file=sys.stderr)
+
+    results, compared = {}, {}  # compared: 名前 → (比, 判定の上限)
+    for name, (fn, per_call) in bench_cases().items():
+        if args.k not in name:
+            continue
+        sec = measure_entry(fn, per_call, args.repeat, args.min_time)
+        if name in base_results:
+            fast = min(sec, base_results[name]) < FAST_ENTRY_SEC
+            compared[name] = (sec / base_results[name], 1 + (args.fast_tolerance if fast else args.tolerance))
+        results[name] = sec
+        line = f"{name:42s} {fmt_time(sec)}"
+        if name in compared:
+            line += f"   x{compared[name][0]:5.2f}"
+        print(line)
+
+    if args.save:
+        merged = {**base_results, **results}
+        baseline_path.write_text(json.dumps({"machine": machine, "seed": SEED, "results": merged}, indent=2) + "\n",
+                                 encoding="utf-8")
+        print(f"ベースラインを保存しました: {baseline_path}")
+        return 0
+    # マシン全体が遅いとき（他の処理と CPU を取り合っている等）は全部の比が揃って上がるので、
+    # 比の中央値（1 未満なら 1）で割ってから判定する。1つだけ遅くなった関数は中央値から浮いて見える
+    host = 1.0
+    if len(compared) >= HOST_MIN_ENTRIES:
+        host = max(1.0, statistics.median(r for r, _ in compared.values()))
+        if host > 1.0:
+            print(f"全体の比の中央値 x{host:.2f}（マシン全体の遅さとして割り引いて判定）")
+    regressions = []
+    for name, (ratio, limit) in compared.items():
+        if ratio / host <= limit:
+            continue
+        # 別のプロセスで測り直し、いちばん速い値で判定する
+        sec = min([results[name]] + [measure_in_new_process(name, args) for _ in range(CONFIRM_PROCESSES)])
+        compared[name] = (sec / base_results[name], limit)
+        print(f"再計測（別プロセス） {name:42s} {fmt_time(sec)}   x{compared[name][0] / host:5.2f}")
+        if compared[name][0] / host > limit:
+            regressions.append(name)
+    if regressions:
+        for name in regressions:
+            print(f"  ← 退行 {name} x{compared[name][0] / host:.2f}")
+        print(f"{len(regressions)}件が {args.tolerance:.0%}（10µs 未満は {args.fast_tolerance:.0%}）以上遅くなっています: "
+              f"{', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
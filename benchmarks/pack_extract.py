@@ -0,0 +1,177 @@
+"""
+まとめて抽出（複数枚を1回のリクエストで）と1枚ずつの抽出を、同じ用紙で比べる。
+まとめる枚数（既定 2/4/8）とまとめ方（images / mosaic）ごとに、
+スループット・1枚あたりのリクエスト数とトークン（費用）・1枚ずつの結果との一致率を出す。
+
+    python benchmarks/pack_extract.py                       # 代役サーバ＋合成画像 16枚
+    python benchmarks/pack_extract.py --photos ./sheets --backend openai   # 実物の用紙で本番 API
+
+一致率は「1枚ずつ抽出した結果」を正解とみなした項目ごとの一致割合（名前・ヒント・回ごとの通過タイム・距離・記録）。
+代役サーバは mosaic の中の1枚ずつを見分けられないので、代役サーバでの mosaic の一致率は出さない。
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from image_pipeline import synthetic_photo  # noqa: E402
+from load_test import start_standin  # noqa: E402
+
+from pe_analysis.backends import BACKENDS, make_backend  # noqa: E402
+from pe_analysis.extract import (  # noqa: E402
+    EXTRACT_PACK_LAYOUTS,
+    extract_cascade,
+    extract_packed,
+    prepare_extract_bytes,
+)
+
+# gpt-4.1-mini の料金（USD / 100万トークン）。モデルを変えたら --input-price / --output-price で渡す
+INPUT_PRICE = 0.40
+OUTPUT_PRICE = 1.60
+
+
+class CountingCall:
+    """extract_cascade / extract_packed の call に渡して、実際のリクエスト数を数える"""
+
+    def __init__(self):
+        self.n = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, fn):
+        with self._lock:
+            self.n += 1
+        return fn()
+
+
+def sheet_fields(sheet):
+    """一致率を見る項目（名前・ヒント・回ごとの値）"""
+    fields = {"name": sheet.name, "sheet_hints": sheet.sheet_hints}
+    for rec in sheet.records:
+        tag = f"{rec.attempt}:"
+        fields[tag + "splits"] = tuple(round(s) for s in rec.splits_sec)
+        fields[tag + "time_run_dist_m"] = int(rec.time_run_dist_m)
+        fields[tag + "distance_race_m"] = rec.distance_race_m
+        fields[tag + "distance_race_time_mmss"] = rec.distance_race_time_mmss
+    return fields
+
+
+def agreement(results, reference):
+    """reference（1枚ずつの結果）の項目のうち、同じ値だった割合"""
+    hit = total = 0
+    for (sheet, _, _), (ref, ref_err, _) in zip(results, reference):
+        if ref_err:
+            continue
+        got, want = sheet_fields(sheet), sheet_fields(ref)
+        total += len(want)
+        hit += sum(1 for k, v in want.items() if got.get(k) == v)
+    return hit / total if total else None
+
+
+def run_mode(client, url_lists, pack_size, layout, workers):
+    """pack_size=1 なら1枚ずつ（段階的解像度）、2以上ならまとめて抽出。結果は元の順"""
+    call = CountingCall()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if pack_size == 1:
+            results = list(pool.map(lambda urls: extract_cascade(client, urls, call=call), url_lists))
+        else:
+            packs = [url_lists[i:i + pack_size] for i in range(0, len(url_lists), pack_size)]
+            results = [r for rs in pool.map(lambda pack: extract_packed(client, pack, layout, call=call), packs)
+                       for r in rs]
+    return results, time.perf_counter() - t0, call.n
+
+
+def summarize(results, wall, requests, input_price, output_price):
+    n = len(results)
+    tokens_in = sum(a["input_tokens"] or 0 for _, _, m in results for a in m["attempts"])
+    tokens_out = sum(a["output_tokens"] or 0 for _, _, m in results for a in m["attempts"])
+    return {
+        "sheets_per_min": round(n / wall * 60, 1),
+        "requests_per_sheet": round(requests / n, 3),
+        "input_tokens_per_sheet": round(tokens_in / n),
+        "output_tokens_per_sheet": round(tokens_out / n),
+        "usd_per_1000_sheets": round((tokens_in * input_price + tokens_out * output_price) / n * 1000 / 1e6, 3),
+        "valid_rate": round(sum(1 for _, err, m in results if not err and not m["issues"]) / n, 3),
+        "fallback_rate": round(sum(1 for _, _, m in results if len(m["attempts"]) > 1) / n, 3),
+    }
+
+
+def load_photos(args):
+    if args.photos:
+        paths = sorted(p for p in Path(args.photos).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+        return [p.read_bytes() for p in paths]
+    return [synthetic_photo(args.width, args.height, seed=i) for i in range(args.n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--photos", default="", help="記録用紙の写真フォルダ（省略時は合成画像）")
+    ap.add_argument("--n", type=int, default=16, help="合成画像の枚数")
+    ap.add_argument("--width", type=int, default=2000)
+    ap.add_argument("--height", type=int, default=1500)
+    ap.add_argument("--sizes", default="2,4,8", help="まとめる枚数（カンマ区切り）")
+    ap.add_argument("--layouts", default=",".join(EXTRACT_PACK_LAYOUTS))
+    ap.add_argument("--workers", type=int, default=4, help="同時に投げるリクエスト数")
+    ap.add_argument("--backend", choices=BACKENDS, default="standin")
+    ap.add_argument("--base-url", default="", help="省略時（standin）は代役サーバをこちらで起動する")
+    ap.add_argument("--replay-dir", default="")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--latency-ms", type=float, default=800.0, help="代役サーバの抽出遅延")
+    ap.add_argument("--pack-sheet-ms", type=float, default=250.0, help="代役サーバで1枚増えるごとに足す遅延")
+    ap.add_argument("--input-price", type=float, default=INPUT_PRICE, help="入力 USD / 100万トークン")
+    ap.add_argument("--output-price", type=float, default=OUTPUT_PRICE, help="出力 USD / 100万トークン")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出す")
+    args = ap.parse_args()
+
+    # 前処理は全モード共通なので最初に1回だけ（測るのは API 側の差）。各モードで使い回すので全段階を作っておく
+    url_lists = [list(prepare_extract_bytes(raw)) for raw in load_photos(args)]
+    sizes = [int(x) for x in args.sizes.split(",")]
+    layouts = args.layouts.split(",")
+
+    proc = None
+    base_url = args.base_url
+    if args.backend == "standin" and not base_url:
+        proc = start_standin(args.port, args.latency_ms, 1500.0, 0.0, ["--pack-sheet-ms", str(args.pack_sheet_ms)])
+        base_url = f"http://127.0.0.1:{args.port}/v1"
+    client = make_backend(args.backend, os.environ.get("OPENAI_API_KEY", ""), base_url, args.replay_dir)
+
+    rows = []
+    try:
+        reference, wall, requests = run_mode(client, url_lists, 1, None, args.workers)
+        rows.append({"mode": "single", "pack": 1, **summarize(reference, wall, requests, args.input_price, args.output_price),
+                     "agreement": 1.0})
+        for layout in layouts:
+            for size in sizes:
+                results, wall, requests = run_mode(client, url_lists, size, layout, args.workers)
+                row = {"mode": layout, "pack": size,
+                       **summarize(results, wall, requests, args.input_price, args.output_price)}
+                measurable = not (args.backend == "standin" and layout == "mosaic")
+                row["agreement"] = round(agreement(results, reference), 3) if measurable else None
+                rows.append(row)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        print(json.dumps({"sheets": len(url_lists), "backend": args.backend, "results": rows}, ensure_ascii=False, indent=2))
+        return
+    print(f"{len(url_lists)}枚 / backend={args.backend}")
+    print(f"{'まとめ方':8s} {'枚数':>4s} {'枚/分':>7s} {'req/枚':>7s} {'入力tok/枚':>10s} {'出力tok/枚':>10s} "
+          f"{'$/1000枚':>9s} {'妥当':>6s} {'再読込':>6s} {'一致率':>6s}")
+    for r in rows:
+        agree = f"{r['agreement']:6.1%}" if r["agreement"] is not None else "     —"
+        print(f"{r['mode']:8s} {r['pack']:4d} {r['sheets_per_min']:7.1f} {r['requests_per_sheet']:7.3f} "
+              f"{r['input_tokens_per_sheet']:10d} {r['output_tokens_per_sheet']:10d} {r['usd_per_1000_sheets']:9.3f} "
+              f"{r['valid_rate']:6.1%} {r['fallback_rate']:6.1%} {agree}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+レポート用プロンプトの入力トークン数（固定シードの記録用紙で、全文AI用と④用）。
+1件あたりの平均トークンに加えて、全件で先頭が一致する長さ（API 側のプロンプトキャッシュに
+当たりうる分）を出す。キャッシュは先頭一致が PROMPT_CACHE_MIN_TOKENS 以上のときだけ効く。
+
+    python benchmarks/prompt_tokens.py                      # 今の pe_analysis
+    python benchmarks/prompt_tokens.py --root /tmp/old      # 別の版（git archive 等で展開したもの）と比べる
+
+トークン数は tiktoken（o200k_base）があればそれで数え、無ければ概算
+（数字は3桁ずつ・英単語は1語・それ以外は1文字を1トークン）で数える。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SEED = 20240401
+SHEETS = 200
+PROMPT_CACHE_MIN_TOKENS = 1024
+APPROX_TOKEN = re.compile(r"[0-9]{1,3}|[A-Za-z]+|\s+|[^\sA-Za-z0-9]")
+
+
+def token_counter():
+    """(数える関数, 名前)"""
+    try:
+        import tiktoken
+
+        enc = tiktoken.get_encoding("o200k_base")
+        return (lambda text: len(enc.encode(text))), "tiktoken o200k_base"
+    except Exception:
+        return (lambda text: len(APPROX_TOKEN.findall(text))), "概算（tiktoken なし）"
+
+
+def mmss(sec):
+    return f"{int(sec // 60)}:{int(sec % 60):02d}"
+
+
+def sample_sheets(rng):
+    """3回分の記録（通過タイムは1本55〜90秒）と種目のヒント"""
+    out = []
+    for i in range(SHEETS):
+        records = []
+        for a in (1, 2, 3):
+            t, splits = 0.0, []
+            for _ in range(rng.randint(6, 14)):
+                t += rng.randint(55, 90)
+                splits.append(mmss(t))
+            records.append({
+                "attempt": a,
+                "splits_mmss": splits,
+                "time_run_dist_m": rng.choice([0, rng.randint(2000, 4800)]),
+                "distance_race_m": rng.choice([3000, 2100, 0]),
+                "distance_race_time_mmss": rng.choice(["", mmss(rng.uniform(540, 1200))]),
+            })
+        out.append({"name": f"選手{i + 1}", "sheet_hints": rng.choice(["男子 15分", "女子 12分", "", "3000m"]),
+                    "records": records})
+    return out
+
+
+def common_prefix(texts):
+    return os.path.commonprefix(texts) if texts else ""
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--root", default=str(ROOT), help="pe_analysis のあるディレクトリ")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出す")
+    args = ap.parse_args()
+    sys.path.insert(0, str(Path(args.root).resolve()))
+    from pe_analysis.core import infer_profile, parse_sheet, pick_best_time_run
+    from pe_analysis.report import build_report_prompt, local_report
+
+    count, counter_name = token_counter()
+    prompts = {"report（全文AI）": [], "coach（④だけ）": []}
+    for raw in sample_sheets(random.Random(SEED)):
+        sheet = parse_sheet(raw)
+        best = pick_best_time_run(sheet.records)
+        profile = infer_profile(best, sheet.sheet_hints)
+        prompts["report（全文AI）"].append(build_report_prompt(sheet.name, profile, best, sheet.records))
+        prompts["coach（④だけ）"].append(local_report(sheet.name, profile, best, sheet.records)[1])
+
+    result = {"root": str(Path(args.root).resolve()), "tokenizer": counter_name, "sheets": SHEETS, "prompts": {}}
+    for kind, texts in prompts.items():
+        tokens = [count(t) for t in texts]
+        prefix = count(common_prefix(texts))
+        result["prompts"][kind] = {
+            "avg_tokens": round(statistics.mean(tokens), 1),
+            "avg_chars": round(statistics.mean(len(t) for t in texts), 1),
+            "shared_prefix_tokens": prefix,
+            "avg_suffix_tokens": round(statistics.mean(tokens) - prefix, 1),
+            "cacheable": prefix >= PROMPT_CACHE_MIN_TOKENS,
+        }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    print(f"{result['root']}（{SHEETS}枚・トークン: {counter_name}）")
+    for kind, r in result["prompts"].items():
+        cache = "キャッシュ対象" if r["cacheable"] else f"{PROMPT_CACHE_MIN_TOKENS}未満"
+        print(f"  {kind:14s} 平均 {r['avg_tokens']:7.1f}トークン（{r['avg_chars']:.0f}文字）  "
+              f"共通の前置き {r['shared_prefix_tokens']:5d}（{cache}）  1件ごとの部分 {r['avg_suffix_tokens']:6.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# 持久走データサイエンス：Streamlit 以外からも使える処理をまとめたパッケージ
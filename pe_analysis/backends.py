@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+# ==========================================
+# モデル呼び出しの差し替え口
+# ==========================================
+# 抽出・レポートは client.responses.create(...) だけを使うので、
+# 「.responses.create を持つもの」なら何でもバックエンドにできる。
+#   openai  : 本物の OpenAI（base_url を変えればローカルの代役サーバにも向けられる）
+#   record  : 本物を呼びつつ、リクエストと応答をディスクに保存
+#   replay  : 保存済みの応答だけを返す（ネットワーク不要・再現性あり）
+#   standin : ローカルの代役サーバ（python -m pe_analysis standin）へ接続
+
+BACKENDS = ("openai", "record", "replay", "standin")
+STANDIN_BASE_URL = "http://127.0.0.1:8765/v1"
+
+# HTTP 接続プール（プロセスで1つのクライアントを共有し、keep-alive で TLS 接続を使い回す）
+HTTP_MAX_CONNECTIONS = 64
+HTTP_MAX_KEEPALIVE = 32
+HTTP_KEEPALIVE_EXPIRY_SEC = 120
+HTTP_CONNECT_TIMEOUT_SEC = 5
+HTTP_TIMEOUT_SEC = 120
+
+
+def sdk_http_module(client_cls):
+    """
+    openai SDK の HTTP クライアント（DefaultHttpxClient）が継承しているライブラリのモジュール。
+    SDK の版によって httpx だったり httpx2 だったりするので、名前で当てずに SDK のクラスからたどる
+    （Limits / Timeout は SDK が実際に使っているものと同じライブラリのものを渡す）。
+    """
+    for cls in client_cls.__mro__:
+        top = cls.__module__.partition(".")[0]
+        if top != "openai" and top != "builtins":
+            return sys.modules[top]
+    raise RuntimeError(f"{client_cls.__name__} の HTTP ライブラリが見つかりません")
+
+
+def pooled_http_client():
+    """openai SDK に渡す、接続数・keep-alive・タイムアウトを調整した HTTP クライアント"""
+    from openai import DefaultHttpxClient
+
+    httpx = sdk_http_module(DefaultHttpxClient)
+    return DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SEC),
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SEC, connect=HTTP_CONNECT_TIMEOUT_SEC),
+    )
+
+
+def make_backend(kind="openai", api_key="", base_url="", replay_dir=""):
+    from openai import OpenAI
+
+    if kind == "openai":
+        return OpenAI(api_key=api_key or None, base_url=base_url or None, http_client=pooled_http_client())
+    if kind == "standin":
+        return OpenAI(api_key="standin", base_url=base_url or STANDIN_BASE_URL, http_client=pooled_http_client())
+    if kind == "record":
+        inner = OpenAI(api_key=api_key or None, base_url=base_url or None, http_client=pooled_http_client())
+        return RecordReplayBackend(replay_dir, inner=inner)
+    if kind == "replay":
+        return RecordReplayBackend(replay_dir)
+    raise ValueError(f"unknown backend: {kind}（{' / '.join(BACKENDS)}）")
+
+
+def without_sdk_retries(client):
+    """
+    batch.call_with_backoff で包んで呼ぶ用に、SDK 自身の再試行（既定 max_retries=2）を切ったクライアント。
+    両方で再試行すると1件の失敗が最大 (BATCH_MAX_RETRIES+1)×3 回になり、SDK 側の再試行はトークンバケットも通らない。
+    接続プールは元のクライアントと共有する。
+    """
+    if hasattr(client, "with_options"):
+        return client.with_options(max_retries=0)
+    if isinstance(client, RecordReplayBackend) and client.inner is not None:
+        return RecordReplayBackend(client.directory, inner=without_sdk_retries(client.inner),
+                                   chunk_chars=client.chunk_chars)
+    return client
+
+
+def request_key(kwargs):
+    """リクエスト内容（stream 指定を除く）から保存ファイル名を決める"""
+    body = {k: v for k, v in kwargs.items() if k != "stream"}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class RecordReplayBackend:
+    """
+    inner を渡すと record（呼んで保存）、渡さなければ replay（保存分だけ返す）。
+    保存形式は {key}.json に {"output_text", "usage"}。stream=True にも対応する。
+    """
+
+    def __init__(self, directory, inner=None, chunk_chars=16):
+        if not directory:
+            raise ValueError("record / replay には保存先ディレクトリが必要です")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.inner = inner
+        self.chunk_chars = chunk_chars
+        self.responses = SimpleNamespace(create=self.create)
+
+    def create(self, **kwargs):
+        path = self.directory / f"{request_key(kwargs)}.json"
+        if self.inner is None:
+            if not path.exists():
+                raise KeyError(f"replay: 保存された応答がありません（{path.name}）")
+            saved = json.loads(path.read_text(encoding="utf-8"))
+        else:
+            saved = self._record(kwargs, path)
+
+        usage = SimpleNamespace(**saved["usage"]) if saved.get("usage") else None
+        if kwargs.get("stream"):
+            return self._replay_stream(saved["output_text"], usage)
+        return SimpleNamespace(output_text=saved["output_text"], usage=usage)
+
+    def _record(self, kwargs, path):
+        body = {k: v for k, v in kwargs.items() if k != "stream"}
+        resp = self.inner.responses.create(**body)
+        usage = getattr(resp, "usage", None)
+        saved = {
+            "output_text": resp.output_text,
+            "usage": {"input_tokens": usage.input_tokens, "output_tokens": usage.output_tokens} if usage else None,
+        }
+        # 一時ファイルは書き込みごとに別名（同じリクエストを複数スレッドで同時に記録しても壊れない）
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{path.stem}-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(saved, ensure_ascii=False))
+            os.chmod(tmp, 0o644)  # mkstemp は 0600 で作る。保存した応答は他のユーザ・CI でも再生できるように
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return saved
+
+    def _replay_stream(self, text, usage):
+        for i in range(0, len(text), self.chunk_chars):
+            yield SimpleNamespace(type="response.output_text.delta", delta=text[i:i + self.chunk_chars])
+        yield SimpleNamespace(type="response.completed", response=SimpleNamespace(output_text=text, usage=usage))
@@ -0,0 +1,148 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+from .backends import without_sdk_retries
+from .core import empty_result, parse_sheet
+from .extract import extract_cache_key, extract_cascade, extract_packed, prepare_extract_bytes
+
+# ==========================================
+# クラス一括抽出（前処理・API ともスレッドプール）
+# ==========================================
+# 前処理（デコード・縮小・JPEG 化）は PIL が GIL を手放すのでスレッドで並列になる。
+# プロセスプール（spawn）は Streamlit では app.py を __main__ として子プロセスで読み直してしまうので使わない。
+BATCH_API_WORKERS = 8       # 同時に投げる API 呼び出し数の上限
+BATCH_RATE_PER_SEC = 4.0    # 平均リクエスト数/秒（トークンバケット）
+BATCH_BURST = 8             # バケット容量（最初にまとめて投げられる数）
+BATCH_MAX_RETRIES = 5
+BATCH_PACK_SIZE = 1         # 2以上なら、前処理の済んだ用紙をこの枚数ずつまとめて1回で抽出する
+BATCH_PACK_LAYOUT = "images"  # まとめ方（extract.EXTRACT_PACK_LAYOUTS）
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """rate 件/秒で補充され、capacity 件まで貯まるトークンバケット（スレッドセーフ）。"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait_sec = (1.0 - self._tokens) / self.rate
+            time.sleep(wait_sec)
+
+
+def is_retryable(e):
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return getattr(e, "status_code", None) in RETRY_STATUS
+
+
+def call_with_backoff(fn, bucket=None, max_retries=BATCH_MAX_RETRIES, base_delay=1.0, max_delay=30.0):
+    """429/5xx・接続エラーのときだけ指数バックオフ（ジッター付き）で再試行する。"""
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+            time.sleep(delay)
+            attempt += 1
+
+
+def _extract_job(client, urls, bucket, key, flight):
+    def run():
+        return extract_cascade(client, urls, lambda fn: call_with_backoff(fn, bucket))
+    return flight.do(key, run)[0] if flight is not None else run()
+
+
+def _extract_pack_job(client, url_lists, bucket, layout):
+    # まとめた1回がトークンバケット1つ分（リクエスト数で制限しているので）
+    return extract_packed(client, url_lists, layout, lambda fn: call_with_backoff(fn, bucket))
+
+
+def iter_batch_extract(client, files, cache=None, prep_workers=None,
+                       api_workers=BATCH_API_WORKERS, rate_per_sec=BATCH_RATE_PER_SEC, burst=BATCH_BURST,
+                       flight=None, pack_size=BATCH_PACK_SIZE, pack_layout=BATCH_PACK_LAYOUT):
+    """
+    files: [(ファイル名, バイト列), ...]
+    flight: SingleFlight を渡すと、同じ画像の抽出が（別セッション・同じ一括内で）同時に走らない。
+    pack_size: 2以上なら前処理の済んだ順に pack_size 枚ずつまとめて抽出する（最後は残りだけで）。
+      まとめた分は flight を通らない（同じ画像どうしの重複はキャッシュ側で吸収する）。
+    終わった順に (index, {"file", "data", "err", "meta", "cached"}) を yield する（data は Sheet）。
+    UI の更新は呼び出し側（メインスレッド）で行う。
+    """
+    client = without_sdk_retries(client)  # 再試行は call_with_backoff だけで行う
+    bucket = TokenBucket(rate_per_sec, burst)
+    prep_workers = prep_workers or min(4, os.cpu_count() or 1)
+
+    keys = [extract_cache_key(raw) for _, raw in files]
+    pending_prep = []
+    for i, (fname, _) in enumerate(files):
+        hit = cache.get(keys[i]) if cache is not None else None
+        if hit is not None:
+            yield i, {"file": fname, "data": parse_sheet(hit["data"]), "err": None, "meta": hit["meta"], "cached": True}
+        else:
+            pending_prep.append(i)
+    if not pending_prep:
+        return
+
+    with ThreadPoolExecutor(max_workers=prep_workers) as prep_pool, \
+            ThreadPoolExecutor(max_workers=api_workers) as api_pool:
+        futures = {}
+        for i in pending_prep:
+            futures[prep_pool.submit(prepare_extract_bytes, files[i][1])] = ("prep", [i])
+        ready = []  # 前処理が済んでまとめ待ちの (index, data URL のリスト)
+
+        def submit_packs(final):
+            while len(ready) >= pack_size or (final and ready):
+                pack, ready[:] = ready[:pack_size], ready[pack_size:]
+                fut = api_pool.submit(_extract_pack_job, client, [urls for _, urls in pack], bucket, pack_layout)
+                futures[fut] = ("pack", [i for i, _ in pack])
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, indices = futures.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    for i in indices:
+                        yield i, {"file": files[i][0], "data": parse_sheet(empty_result()), "err": f"{stage}: {e}",
+                                  "meta": None, "cached": False}
+                    continue
+
+                if stage == "prep":
+                    i = indices[0]
+                    if pack_size > 1:
+                        ready.append((i, result))
+                    else:
+                        api_fut = api_pool.submit(_extract_job, client, result, bucket, keys[i], flight)
+                        futures[api_fut] = ("api", [i])
+                    continue
+
+                for i, (sheet, err, meta) in zip(indices, result if stage == "pack" else [result]):
+                    if not err and cache is not None:
+                        cache.put(keys[i], {"data": sheet.to_dict(), "meta": meta})
+                    yield i, {"file": files[i][0], "data": sheet, "err": err, "meta": meta, "cached": False}
+            if pack_size > 1:
+                submit_packs(final=not any(stage == "prep" for stage, _ in futures.values()))
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# ==========================================
+# 抽出結果キャッシュ（画像バイト列＋前処理設定で引く）
+# ==========================================
+def cache_key(raw_bytes: bytes, **settings) -> str:
+    """
+    アップロード画像のバイト列と前処理設定（max_width / jpeg_quality / prompt_version 等）から
+    キャッシュキーを作る。設定が1つでも変われば別キーになる。
+    """
+    h = hashlib.sha256()
+    h.update(raw_bytes)
+    h.update(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """
+    2段構成のキャッシュ。
+    - メモリ：LRU（max_items 件）
+    - ディスク：SQLite（db_path 指定時のみ）。max_entries を超えた分は最終アクセスの古い順に削除
+    どちらの段も、作成から max_age_sec を過ぎたものは返さない（ディスクから読み戻した分は元の作成時刻のまま）。
+    同じ SQLite ファイルを table 名を変えて別用途（レポート等）にも使える。
+    """
+
+    def __init__(self, max_items=128, db_path=None, max_entries=5000, max_age_sec=30 * 24 * 3600,
+                 table="extract_cache"):
+        self.table = table
+        self.max_items = max_items
+        self.max_entries = max_entries
+        self.max_age_sec = max_age_sec
+        self._mem = OrderedDict()  # key → (作成時刻, 値)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_accessed ON {table}(accessed)")
+            self._db.commit()
+            self._evict_disk()
+
+    def get(self, key):
+        with self._lock:
+            now = time.time()
+            if key in self._mem:
+                created, value = self._mem[key]
+                if now - created <= self.max_age_sec:
+                    self._mem.move_to_end(key)
+                    return value
+                del self._mem[key]
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.max_age_sec:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            value = json.loads(row[0])
+            self._put_mem(key, value, row[1])
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            now = time.time()
+            self._put_mem(key, value, now)
+            if self._db is None:
+                return
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._db.commit()
+            self._evict_disk()
+
+    def _put_mem(self, key, value, created):
+        self._mem[key] = (created, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def _evict_disk(self):
+        # 期限切れ → 件数超過（最終アクセスが古い順）の順に削除
+        self._db.execute(f"DELETE FROM {self.table} WHERE created < ?", (time.time() - self.max_age_sec,))
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f" SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self._db.commit()
@@ -0,0 +1,475 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from pathlib import Path
+
+from .backends import BACKENDS, make_backend, without_sdk_retries
+from .batch import (
+    BATCH_API_WORKERS,
+    BATCH_PACK_LAYOUT,
+    BATCH_PACK_SIZE,
+    BATCH_RATE_PER_SEC,
+    call_with_backoff,
+    iter_batch_extract,
+)
+from .cache import ExtractionCache
+from .core import infer_profile, pick_best_time_run, record_metrics
+from .extract import EXTRACT_PACK_LAYOUTS, extract_cache_key, summarize_cascade
+from .history import HistoryStore
+from .metrics import METRICS, enable_json_log
+from .report import (
+    REPORT_MODES,
+    REPORT_WORKERS,
+    collect_report_batch,
+    iter_reports,
+    report_cache_key,
+    report_request,
+    sheet_report_requests,
+    submit_report_batch,
+)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+# ==========================================
+# 1枚の抽出結果 → 1回ごとの行
+# ==========================================
+# 出力の列と型（Parquet のスキーマ。CSV の見出しもこの順）
+RESULT_COLUMNS = (
+    ("file", "string"), ("name", "string"), ("sheet_hints", "string"), ("attempt", "int64"),
+    ("is_best", "bool"), ("gender", "string"), ("time_min", "int64"), ("target_m", "int64"),
+    ("profile_reason", "string"), ("time_run_dist_m", "int64"), ("distance_race_m", "int64"),
+    ("distance_race_time_mmss", "string"), ("splits_sec", "string"), ("laps_sec", "string"),
+    ("alert_count", "int64"), ("alert_laps", "string"), ("pace_sec_km", "double"),
+    ("target_time_pred_sec", "double"), ("vo2max", "double"), ("extract_width", "int64"),
+    ("extract_calls", "int64"),
+)
+RESULT_FIELDNAMES = [c for c, _ in RESULT_COLUMNS]
+
+def result_rows(fname, sheet, meta=None):
+    """
+    1回ごとに1行。記録が1つも無い用紙は、attempt 以降が空の行を1行だけ返す
+    （出力済みの印。--resume で同じ画像を抽出し直さない）。
+    """
+    if not sheet.records:
+        row = dict.fromkeys(RESULT_FIELDNAMES)
+        row.update(file=fname, name=sheet.name, sheet_hints=sheet.sheet_hints)
+        return [row]
+    best = pick_best_time_run(sheet.records)
+
+    rows = []
+    for rec in sheet.records:
+        profile = infer_profile(rec, sheet.sheet_hints)
+        m = record_metrics(rec, profile)
+        rows.append({
+            "file": fname,
+            "name": sheet.name,
+            "sheet_hints": sheet.sheet_hints,
+            "attempt": rec.attempt,
+            "is_best": rec is best,
+            "gender": profile["gender"],
+            "time_min": profile["time_min"],
+            "target_m": profile["target_m"],
+            "profile_reason": profile["reason"],
+            "time_run_dist_m": int(m["time_run_dist_m"]),
+            "distance_race_m": rec.distance_race_m,
+            "distance_race_time_mmss": rec.distance_race_time_mmss,
+            "splits_sec": json.dumps(m["splits_sec"]),
+            "laps_sec": json.dumps(m["laps_sec"]),
+            "alert_count": len(m["alerts"]),
+            "alert_laps": json.dumps([a[0] for a in m["alerts"]]),
+            "pace_sec_km": round(m["pace_sec_km"], 1),
+            "target_time_pred_sec": round(m["target_time_pred_sec"], 1),
+            "vo2max": m["vo2max"],
+            "extract_width": meta["attempts"][meta["tier"]]["width"] if meta else None,
+            "extract_calls": len(meta["attempts"]) if meta else None,
+        })
+    return rows
+
+# ==========================================
+# 出力（1行ずつ追記。既存ファイルがあれば続きから）
+# ==========================================
+# どの形式も flush() の時点までに書いた行は、途中でプロセスが落ちても残る（--resume で続きから）
+class CsvWriter:
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+        self._w = None
+
+    def done_files(self):
+        if not self.path.exists():
+            return set()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return {row["file"] for row in csv.DictReader(f)}
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self._f is None:
+            is_new = not self.path.exists() or self.path.stat().st_size == 0
+            if not is_new:
+                with open(self.path, newline="", encoding="utf-8") as f:
+                    header = next(csv.reader(f), [])
+                if header != RESULT_FIELDNAMES:
+                    raise SystemExit(f"{self.path} の列が今の出力と違うため追記できません"
+                                     "（別の --out を指定するか、古いファイルを移してください）")
+            self._f = open(self.path, "a", newline="", encoding="utf-8")
+            self._w = csv.DictWriter(self._f, fieldnames=RESULT_FIELDNAMES)
+            if is_new:
+                self._w.writeheader()
+        self._w.writerows(rows)
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def done_files(self):
+        if not self.path.exists():
+            return set()
+        with open(self.path, encoding="utf-8") as f:
+            return {json.loads(line)["file"] for line in f if line.strip()}
+
+    def write(self, rows):
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+        for row in rows:
+            self._f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+
+PARQUET_PART_ROWS = 500  # これだけ溜まったら flush を待たずに part ファイルにする
+
+class ParquetWriter:
+    """
+    Parquet は追記できないので、flush() ごとに溜まった行を <out>.parts/ の part ファイル
+    （1つずつ一時ファイル→差し替えで書くので、途中で落ちても壊れない）にしておき、
+    close() で既存の出力と part をまとめて <out> に差し替える。
+    close まで行かずに止まっても、次の実行は part の分も出力済みとして続きから始め、最後にまとめる。
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet 出力には pyarrow が必要です（pip install pyarrow）")
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self.parts_dir = path.with_name(path.name + ".parts")
+        self._rows = []
+        self.schema = pq.read_schema(path) if path.exists() else pa.schema(
+            [(c, pa.type_for_alias(t)) for c, t in RESULT_COLUMNS])
+
+    def _parts(self):
+        return sorted(self.parts_dir.glob("part-*.parquet")) if self.parts_dir.exists() else []
+
+    def done_files(self):
+        files = set()
+        for f in ([self.path] if self.path.exists() else []) + self._parts():
+            files.update(self._pq.read_table(f, columns=["file"]).column("file").to_pylist())
+        return files
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= PARQUET_PART_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        self.parts_dir.mkdir(exist_ok=True)
+        table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+        n = len(self._parts())
+        part = self.parts_dir / f"part-{n:06d}.parquet"
+        tmp = self.parts_dir / f".part-{n:06d}.tmp"
+        self._pq.write_table(table, tmp)
+        os.replace(tmp, part)
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        parts = self._parts()
+        if not parts:
+            return
+        tables = [self._pq.read_table(self.path)] if self.path.exists() else []
+        # 差し替えの直後に落ちて part が残っていた場合に備え、出力済みの画像の行は足さない
+        done = set(tables[0].column("file").to_pylist()) if tables else set()
+        for f in parts:
+            t = self._pq.read_table(f).cast(self.schema)
+            if done:
+                t = t.filter(self._pa.array([x not in done for x in t.column("file").to_pylist()]))
+            tables.append(t)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        self._pq.write_table(self._pa.concat_tables(tables), tmp)
+        os.replace(tmp, self.path)
+        for f in parts:
+            f.unlink()
+        self.parts_dir.rmdir()
+
+
+WRITERS = {".csv": CsvWriter, ".jsonl": JsonlWriter, ".parquet": ParquetWriter}
+
+# ==========================================
+# batch コマンド
+# ==========================================
+def cmd_batch(args):
+    if args.metrics_log:
+        enable_json_log()
+    out = Path(args.out)
+    writer_cls = WRITERS.get(out.suffix.lower())
+    if writer_cls is None:
+        raise SystemExit(f"出力形式が不明です: {out.suffix}（.csv / .jsonl / .parquet）")
+    writer = writer_cls(out)
+
+    done = writer.done_files()
+    paths = sorted(p for p in Path(args.photos).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    todo = [p for p in paths if p.name not in done]
+    print(f"{len(paths)}枚中 {len(paths) - len(todo)}枚は出力済みのためスキップ", file=sys.stderr)
+
+    # 画像は1枚ずつ読む（一度に全部をメモリに載せない）ため、チャンクごとに流す
+    client = make_backend(args.backend, os.environ.get("OPENAI_API_KEY", ""), args.base_url, args.replay_dir)
+    cache = ExtractionCache(db_path=args.cache_db) if args.cache_db else None
+    history = HistoryStore(args.history_db) if args.history_db else None
+    n_done = n_err = 0
+    metas = []
+    try:
+        for start in range(0, len(todo), args.chunk):
+            chunk = todo[start:start + args.chunk]
+            files = [(p.name, p.read_bytes()) for p in chunk]
+            for i, res in iter_batch_extract(client, files, cache=cache,
+                                             api_workers=args.workers, rate_per_sec=args.rate,
+                                             pack_size=args.pack_size, pack_layout=args.pack_layout):
+                n_done += 1
+                if res["err"]:
+                    n_err += 1
+                    print(f"[{n_done}/{len(todo)}] {res['file']}: {res['err']}", file=sys.stderr)
+                    continue
+                metas.append(res["meta"])
+                if history is not None:
+                    history.add_sheet(extract_cache_key(files[i][1]), res["data"], class_name=args.class_name, run_date=args.date)
+                rows = result_rows(res["file"], res["data"], res["meta"])
+                writer.write(rows)
+                n_rows = len(res["data"].records)
+                print(f"[{n_done}/{len(todo)}] {res['file']}: {f'{n_rows}行' if n_rows else '記録なし（印の行だけ）'}",
+                      file=sys.stderr)
+                if args.metrics_prom:
+                    METRICS.write_prometheus(args.metrics_prom)
+            writer.flush()  # チャンクごとに確定（落ちても次の --resume はここから）
+    finally:
+        writer.close()
+    summary = summarize_cascade(metas)
+    if summary:
+        print(f"段階的解像度: {json.dumps(summary, ensure_ascii=False)}", file=sys.stderr)
+    print(f"完了: {n_done - n_err}枚成功 / {n_err}枚失敗（失敗分は再実行で再試行されます）", file=sys.stderr)
+    return 1 if n_err else 0
+
+
+# ==========================================
+# reports コマンド（蓄積した記録からクラス全員分のレポート）
+# ==========================================
+def report_items(named_sheets, mode, all_attempts):
+    """[(名前, attempt, prefix, prompt), ...]。プロンプトは先に全部作っておく"""
+    items = []
+    for name, sheet in named_sheets:
+        if all_attempts:
+            reqs = sheet_report_requests(name, sheet.sheet_hints, sheet.records, mode)
+        else:
+            best = pick_best_time_run(sheet.records)
+            if best is None:
+                continue
+            reqs = [(best.attempt, *report_request(name, infer_profile(best, sheet.sheet_hints), best, sheet.records, mode))]
+        items += [(name, attempt, prefix, prompt) for attempt, prefix, prompt in reqs]
+    return items
+
+
+def collect_offline(client, manifest, cache):
+    """
+    バッチの結果を {キャッシュキー: 本文} で返す（まだ終わっていなければ None）。
+    終わったら（completed のほか failed / expired / cancelled でも）マニフェストを消す。
+    受け取れた分は report_cache にも入れておき、足りない分は呼び出し側がその場で作る。
+    """
+    m = json.loads(manifest.read_text(encoding="utf-8"))
+    status, results, errors = collect_report_batch(client, m["batch_id"])
+    if results is None:
+        print(f"バッチ {m['batch_id']} はまだ終わっていません（{status}）。しばらくしてから再実行してください",
+              file=sys.stderr)
+        return None
+    texts = {m["keys"][k]: text for k, text in results.items()}
+    if cache is not None:
+        for key, text in texts.items():
+            cache.put(key, text)
+    manifest.unlink()
+    print(f"バッチ {m['batch_id']}（{status}）: {len(texts)}/{len(m['keys'])}件を受け取りました", file=sys.stderr)
+    if errors:
+        print(f"  {len(errors)}件はエラーでした（例: {next(iter(errors.values()))}）", file=sys.stderr)
+    if len(texts) < len(m["keys"]):
+        print(f"  残り{len(m['keys']) - len(texts)}件はこのままその場で作ります", file=sys.stderr)
+    return texts
+
+
+def cmd_reports(args):
+    if args.metrics_log:
+        enable_json_log()
+    out = Path(args.out)
+    items = report_items(HistoryStore(args.history_db).load_sheets(args.class_name, args.date), args.mode, args.all_attempts)
+    if not items:
+        raise SystemExit("レポートを作れる記録がありません（--history-db / --class-name / --date を確認）")
+    client = make_backend(args.backend, os.environ.get("OPENAI_API_KEY", ""), args.base_url, args.replay_dir)
+    cache = ExtractionCache(db_path=args.cache_db, table="report_cache") if args.cache_db else None
+
+    # 生成が要る分（local_only は prefix が全文）。同じプロンプトは1回だけ
+    keys = {}
+    for _, _, _, prompt in items:
+        if prompt is not None:
+            keys.setdefault(report_cache_key(prompt), prompt)
+    texts = {}
+    if cache is not None:
+        texts = {key: text for key in keys if (text := cache.get(key)) is not None}
+
+    if args.offline:
+        # 1回目は投入してマニフェストを残すだけ。同じコマンドをもう一度実行すると結果を取りに行く
+        manifest = out.with_name(out.name + ".batch.json")
+        if manifest.exists():
+            done = collect_offline(client, manifest, cache)
+            if done is None:
+                return 2
+            texts.update(done)
+        else:
+            pending = [key for key in keys if key not in texts]
+            if pending:
+                batch_id = submit_report_batch(client, [keys[key] for key in pending])
+                manifest.write_text(json.dumps({"batch_id": batch_id, "keys": pending}), encoding="utf-8")
+                print(f"{len(pending)}件をバッチ {batch_id} として投入しました（{len(texts)}件はキャッシュ済み）。"
+                      "終わった頃に同じコマンドを再実行すると書き出します", file=sys.stderr)
+                return 2
+
+    # 残り（オンライン実行、またはバッチで失敗した分）は同時数を抑えてその場で作る
+    pending = [key for key in keys if key not in texts]
+    prompts = [keys[key] for key in pending]
+    failed = {}
+    client = without_sdk_retries(client)  # 再試行は call_with_backoff だけで行う
+    for n, (k, text, _, err) in enumerate(iter_reports(client, prompts, cache=cache, workers=args.workers,
+                                                        call=call_with_backoff), 1):
+        if err is not None:
+            failed[pending[k]] = err
+            print(f"[{n}/{len(pending)}] 失敗しました: {err}", file=sys.stderr)
+            continue
+        texts[pending[k]] = text
+        print(f"[{n}/{len(pending)}] 生成しました", file=sys.stderr)
+
+    with open(out, "w", encoding="utf-8") as f:
+        for name, attempt, prefix, prompt in items:
+            row = {"name": name, "attempt": attempt, "mode": args.mode}
+            key = report_cache_key(prompt) if prompt is not None else None
+            if key in failed:
+                row.update(report=None, error=failed[key])
+            else:
+                row["report"] = prefix + (texts[key] if key is not None else "")
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    if args.metrics_prom:
+        METRICS.write_prometheus(args.metrics_prom)
+    if failed:
+        print(f"完了: {len(items)}件を {out} に書き出しました（うち{len(failed)}種類のプロンプトが失敗。"
+              "もう一度実行するとその分だけ作り直します）", file=sys.stderr)
+        return 1
+    print(f"完了: {len(items)}件を {out} に書き出しました", file=sys.stderr)
+    return 0
+
+
+# ==========================================
+# standin コマンド（Responses API の代役サーバ）
+# ==========================================
+def cmd_standin(args):
+    from .standin import StandinConfig, serve
+
+    config = StandinConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           report_latency_ms=args.report_latency_ms, fail_rate=args.fail_rate,
+                           pack_sheet_ms=args.pack_sheet_ms, seed=args.seed)
+    server = serve(args.host, args.port, config)
+    print(f"standin: http://{args.host}:{args.port}/v1 で待ち受け中（Ctrl+C で終了）", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m pe_analysis", description="持久走データサイエンス（ブラウザなし）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("batch", help="フォルダ内の記録用紙を一括で抽出・解析する")
+    p.add_argument("photos", help="記録用紙の写真が入ったフォルダ")
+    p.add_argument("--out", required=True, help="出力ファイル（.csv / .jsonl / .parquet）")
+    p.add_argument("--cache-db", default="", help="抽出キャッシュの SQLite ファイル")
+    p.add_argument("--workers", type=int, default=BATCH_API_WORKERS, help="API の同時実行数")
+    p.add_argument("--rate", type=float, default=BATCH_RATE_PER_SEC, help="API の平均リクエスト数/秒")
+    p.add_argument("--chunk", type=int, default=64, help="一度にメモリへ読み込む枚数")
+    p.add_argument("--pack-size", type=int, default=BATCH_PACK_SIZE, help="何枚ずつまとめて1回で抽出するか（1ならまとめない）")
+    p.add_argument("--pack-layout", choices=EXTRACT_PACK_LAYOUTS, default=BATCH_PACK_LAYOUT,
+                   help="まとめ方（images: 画像を並べて送る / mosaic: 1枚の画像に並べる）")
+    p.add_argument("--metrics-log", action="store_true", help="段階ごとの処理時間を JSON 1行ログで stderr へ出す")
+    p.add_argument("--metrics-prom", default="", help="Prometheus テキスト形式の計測ファイル")
+    p.add_argument("--history-db", default="", help="選手ごとの記録を貯める SQLite ファイル")
+    p.add_argument("--class-name", default="", help="記録を貯めるときのクラス名")
+    p.add_argument("--date", default=None, help="記録日（YYYY-MM-DD、既定は今日）")
+    p.add_argument("--backend", choices=BACKENDS, default="openai", help="モデルの呼び出し先")
+    p.add_argument("--base-url", default="", help="API の接続先（standin / 互換サーバ向け）")
+    p.add_argument("--replay-dir", default="", help="record / replay の保存先ディレクトリ")
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("reports", help="蓄積した記録からクラス全員分のレポートをまとめて作る")
+    p.add_argument("--history-db", required=True, help="batch --history-db で貯めた SQLite ファイル")
+    p.add_argument("--class-name", default="", help="クラス名")
+    p.add_argument("--date", default=None, help="記録日（YYYY-MM-DD、既定は1人につき最新の1枚）")
+    p.add_argument("--out", required=True, help="出力ファイル（.jsonl、1件1行）")
+    p.add_argument("--mode", choices=REPORT_MODES, default="local", help="レポートの作り方")
+    p.add_argument("--all-attempts", action="store_true", help="ベスト回だけでなく全部の回のレポートを作る")
+    p.add_argument("--workers", type=int, default=REPORT_WORKERS, help="同時に生成する数")
+    p.add_argument("--offline", action="store_true",
+                   help="バッチ API に投入する（結果は最大24時間後。同じコマンドの再実行で受け取る）")
+    p.add_argument("--cache-db", default="", help="レポートキャッシュの SQLite ファイル（アプリの EXTRACT_CACHE_DB と共用可）")
+    p.add_argument("--metrics-log", action="store_true", help="処理時間を JSON 1行ログで stderr へ出す")
+    p.add_argument("--metrics-prom", default="", help="Prometheus テキスト形式の計測ファイル")
+    p.add_argument("--backend", choices=BACKENDS, default="openai", help="モデルの呼び出し先")
+    p.add_argument("--base-url", default="", help="API の接続先（standin / 互換サーバ向け）")
+    p.add_argument("--replay-dir", default="", help="record / replay の保存先ディレクトリ")
+    p.set_defaults(func=cmd_reports)
+
+    p = sub.add_parser("standin", help="Responses API の代役サーバを起動する（オフライン試験用）")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency-ms", type=float, default=800.0, help="抽出1回の応答遅延")
+    p.add_argument("--report-latency-ms", type=float, default=1500.0, help="レポート1回の応答遅延")
+    p.add_argument("--jitter-ms", type=float, default=200.0, help="遅延のばらつき（±）")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="429/500/503 を返す割合")
+    p.add_argument("--pack-sheet-ms", type=float, default=250.0, help="まとめて抽出で1枚増えるごとに足す遅延")
+    p.add_argument("--seed", type=int, default=0, help="応答内容・遅延・失敗の乱数シード")
+    p.set_defaults(func=cmd_standin)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,289 @@
+import json
+import math
+from array import array
+from dataclasses import dataclass, field
+
+# ==========================================
+# 学校仕様
+# ==========================================
+LAP_M = 300  # 1周=300m
+
+# ==========================================
+# utils
+# ==========================================
+def safe_json_load(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start = text.find("{")
+        end = text.rfind("}")
+        if start != -1 and end != -1 and end > start:
+            try:
+                return json.loads(text[start:end+1])
+            except:
+                pass
+    return None
+
+def empty_result():
+    return {"name": "選手", "sheet_hints": "", "records": []}
+
+def mmss_to_sec(s: str) -> float:
+    if s is None:
+        return 0.0
+    s = str(s).strip().replace(" ", "")
+    if ":" not in s:
+        try:
+            return float(s)
+        except:
+            return 0.0
+    parts = s.split(":")
+    if len(parts) != 2:
+        return 0.0
+    try:
+        m = int(parts[0])
+        sec = int(parts[1])
+        return float(m * 60 + sec)
+    except:
+        return 0.0
+
+def sec_to_mmss(sec: float) -> str:
+    if sec <= 0:
+        return "0:00"
+    m = int(sec // 60)
+    s = int(round(sec - m * 60))
+    if s == 60:
+        m += 1
+        s = 0
+    return f"{m}:{s:02d}"
+
+def splits_to_laps(splits_sec):
+    laps = []
+    prev = 0.0
+    for s in splits_sec:
+        s = float(s)
+        laps.append(max(0.0, s - prev))
+        prev = s
+    return laps
+
+AT_ALERT_THRESHOLD = 3.0  # 前の本よりこの秒数以上遅くなったら失速アラート
+
+def detect_at_alerts(laps_sec, threshold=AT_ALERT_THRESHOLD):
+    alerts = []
+    for i in range(1, len(laps_sec)):
+        prev = float(laps_sec[i-1])
+        cur = float(laps_sec[i])
+        diff = cur - prev
+        if diff >= threshold:
+            alerts.append((i+1, prev, cur, diff))
+    return alerts
+
+def pace_per_km(dist_m, time_sec):
+    if dist_m <= 0 or time_sec <= 0:
+        return 0.0
+    return time_sec / (dist_m / 1000)
+
+def predict_time_by_same_speed(dist_m, time_sec, target_m):
+    if dist_m <= 0 or time_sec <= 0:
+        return 0.0
+    v = dist_m / time_sec
+    return target_m / v
+
+def estimate_vo2max_by_speed(v_m_per_min):
+    if v_m_per_min <= 0:
+        return 0.0
+    return round(0.2 * v_m_per_min + 3.5, 1)
+
+PACE_PLANS = (("維持", 1.03), ("目標", 1.00), ("突破", 0.97))
+
+def build_pace_guide(target_m, target_time_sec):
+    if target_m <= 0 or target_time_sec <= 0:
+        return []
+    plans = PACE_PLANS
+    full_laps = target_m // LAP_M
+    rem = target_m % LAP_M
+
+    out = []
+    for label, mult in plans:
+        t = target_time_sec * mult
+        per_m = t / target_m
+        lap_sec = per_m * LAP_M
+        rem_sec = per_m * rem if rem else 0
+        detail = f"{LAP_M}m:{sec_to_mmss(lap_sec)} × {full_laps}"
+        if rem:
+            detail += f" + {rem}m:{sec_to_mmss(rem_sec)}"
+        out.append({"プラン": label, "想定タイム": sec_to_mmss(t), "目標ラップ": detail})
+    return out
+
+# ==========================================
+# 抽出結果の型（境界で1回だけ読み取り・正規化し、以降は型どおりに使う）
+# ==========================================
+RACE_DISTANCES = (3000, 2100)
+
+def _number(x):
+    """空欄は 0、数値にできなければ None"""
+    if x is None or (isinstance(x, str) and not x.strip()):
+        return 0.0
+    try:
+        x = float(x)
+    except (TypeError, ValueError):
+        return None
+    return x if math.isfinite(x) else None
+
+@dataclass(slots=True)
+class Record:
+    """1回分（①②③のどれか）。splits_sec は 0 より大きい通過タイム（秒）を昇順に並べたもの。"""
+    attempt: int
+    lap_m: int = LAP_M
+    splits_sec: array = field(default_factory=lambda: array("d"))
+    time_run_dist_m: float = 0.0
+    distance_race_m: int = 0
+    distance_race_time_mmss: str = ""
+    issues: tuple = ()  # 読み取り時に見つかった問題（妥当性チェック用）
+
+    def to_dict(self):
+        # キャッシュ・出力用（正規化済みの形。parse_record でそのまま読み戻せる）
+        return {
+            "attempt": self.attempt,
+            "lap_m": self.lap_m,
+            "splits_sec": self.splits_sec.tolist(),
+            "time_run_dist_m": self.time_run_dist_m,
+            "distance_race_m": self.distance_race_m,
+            "distance_race_time_mmss": self.distance_race_time_mmss,
+        }
+
+@dataclass(slots=True)
+class Sheet:
+    name: str
+    sheet_hints: str
+    records: list
+
+    def to_dict(self):
+        return {"name": self.name, "sheet_hints": self.sheet_hints, "records": [r.to_dict() for r in self.records]}
+
+def parse_record(raw, index=0):
+    """
+    モデル出力（splits_mmss）またはキャッシュ（splits_sec）の1回分を Record にする。
+    読めない値は 0 / 空にして、その旨を issues に残す（例外にはしない）。
+    """
+    raw = raw if isinstance(raw, dict) else {}
+    attempt = _number(raw.get("attempt"))
+    attempt = int(attempt) if attempt else index + 1
+    tag = f"{attempt}回目"
+    issues = []
+
+    if "splits_sec" in raw:
+        splits = [float(s) for s in raw["splits_sec"] or []]
+    else:
+        splits = [mmss_to_sec(x) for x in raw.get("splits_mmss", []) or [] if str(x).strip()]
+        if any(s <= 0 for s in splits):
+            issues.append(f"{tag}: 読めない通過タイムがある")
+        readable = [s for s in splits if s > 0]
+        if any(b <= a for a, b in zip(readable, readable[1:])):
+            issues.append(f"{tag}: 通過タイムが増加していない")
+
+    dist = _number(raw.get("time_run_dist_m"))
+    race_m = _number(raw.get("distance_race_m"))
+    if dist is None or race_m is None:
+        issues.append(f"{tag}: 距離が数値でない")
+        dist = race_m = 0.0
+    race_m = int(race_m)
+    if race_m not in (0,) + RACE_DISTANCES:
+        issues.append(f"{tag}: distance_race_m={race_m}")
+
+    lap_m = _number(raw.get("lap_m"))
+    return Record(
+        attempt=attempt,
+        lap_m=int(lap_m) if lap_m else LAP_M,
+        splits_sec=array("d", sorted(s for s in splits if s > 0)),
+        time_run_dist_m=dist,
+        distance_race_m=race_m,
+        distance_race_time_mmss=str(raw.get("distance_race_time_mmss", "") or "").strip(),
+        issues=tuple(issues),
+    )
+
+def parse_sheet(data):
+    """抽出結果（dict）→ Sheet。以降の計算・表示・レポートはすべて Sheet を使う。"""
+    data = data if isinstance(data, dict) else {}
+    records = data.get("records", []) or []
+    return Sheet(
+        name=str(data.get("name") or "選手"),
+        sheet_hints=str(data.get("sheet_hints", "") or ""),
+        records=[parse_record(r, i) for i, r in enumerate(records if isinstance(records, list) else [])],
+    )
+
+# ==========================================
+# records から「ベスト回」を選ぶ（最重要）
+# ==========================================
+def pick_best_time_run(records):
+    """
+    時間走の3回（①②③）がある前提で、time_run_dist_m が最大の回をベストとして返す。
+    取れない場合は records[0] を返す。
+    """
+    if not records:
+        return None
+    best = None
+    best_dist = -1
+    for r in records:
+        d = r.time_run_dist_m
+        if d > best_dist:
+            best_dist = d
+            best = r
+    return best if best else records[0]
+
+# ==========================================
+# 推理（男子/女子）
+# ==========================================
+def infer_profile(rec, sheet_hints: str):
+    hints = (sheet_hints or "").replace("　", " ").lower()
+
+    dist_race_m = rec.distance_race_m
+    if dist_race_m == 3000:
+        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "distance_race_m=3000"}
+    if dist_race_m == 2100:
+        return {"gender": "female", "time_min": 12, "target_m": 2100, "reason": "distance_race_m=2100"}
+
+    if any(k in hints for k in ["男子", "15分", "3000", "3000m", "15"]):
+        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": f"keyword:{sheet_hints}"}
+    if any(k in hints for k in ["女子", "12分", "2100", "2100m", "12"]):
+        return {"gender": "female", "time_min": 12, "target_m": 2100, "reason": f"keyword:{sheet_hints}"}
+
+    total_time = rec.splits_sec[-1] if rec.splits_sec else 0.0
+    if total_time > 12.5 * 60:
+        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "time>12:30"}
+
+    time_dist = rec.time_run_dist_m
+    if time_dist >= 3200:
+        return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "time_run_dist>=3200"}
+    if time_dist > 0 and time_dist < 2600:
+        return {"gender": "female", "time_min": 12, "target_m": 2100, "reason": "time_run_dist<2600"}
+
+    return {"gender": "male", "time_min": 15, "target_m": 3000, "reason": "fallback"}
+
+# ==========================================
+# 1回分（record）の指標まとめ
+# ==========================================
+def record_metrics(rec, profile, threshold=AT_ALERT_THRESHOLD):
+    time_min = profile["time_min"]
+    time_sec = time_min * 60
+    target_m = profile["target_m"]
+    time_run_dist_m = rec.time_run_dist_m
+
+    splits_sec = rec.splits_sec.tolist()
+    laps_sec = splits_to_laps(splits_sec) if len(splits_sec) >= 2 else []
+    alerts = detect_at_alerts(laps_sec, threshold=threshold)
+
+    pace_sec_km = pace_per_km(time_run_dist_m, time_sec) if time_run_dist_m > 0 else 0.0
+    target_time_pred_sec = predict_time_by_same_speed(time_run_dist_m, time_sec, target_m) if time_run_dist_m > 0 else 0.0
+    v_m_per_min = (time_run_dist_m / time_min) if (time_run_dist_m > 0 and time_min > 0) else 0.0
+
+    return {
+        "time_run_dist_m": time_run_dist_m,
+        "splits_sec": splits_sec,
+        "laps_sec": laps_sec,
+        "alerts": alerts,
+        "alert_threshold": threshold,  # 表示・プロンプトにはこの値を出す
+        "pace_sec_km": pace_sec_km,
+        "target_time_pred_sec": target_time_pred_sec,
+        "vo2max": estimate_vo2max_by_speed(v_m_per_min),
+        "pace_guide": build_pace_guide(target_m, target_time_pred_sec),
+    }
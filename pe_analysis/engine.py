@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+from .core import AT_ALERT_THRESHOLD, LAP_M, PACE_PLANS
+
+# ==========================================
+# 一括計算エンジン（クラス・シーズン分の records をまとめて計算）
+# ==========================================
+# スプリットは「可変長配列」をフラット配列 values ＋ 区切り offsets（長さ n+1）で持つ。
+# record i のスプリットは values[offsets[i]:offsets[i+1]]。
+# 結果は core の1件ずつの関数（record_metrics 等）と一致する。
+
+def round1(x):
+    """
+    Python の round(x, 1) と同じ結果になる丸め（np.round は 47.45 → 47.4 になりずれる）。
+    x*20 を誤差なしで (s + e) に分解し、真の中点 (2k+1)/20 と比較する。
+    """
+    x = np.asarray(x, dtype=float)
+    k = np.floor(x * 10)
+    a, b = x * 16, x * 4             # 2のべき倍なので誤差なし
+    s = a + b
+    bb = s - a
+    e = (a - (s - bb)) + (b - bb)    # TwoSum の誤差項
+    diff = (s - (2 * k + 1)) + e
+    up = (diff > 0) | ((diff == 0) & (k % 2 == 1))
+    return (k + up) / 10
+
+
+def _mmss_codes(sec):
+    """sec_to_mmss と同じ丸めで「分*60+秒」の整数にする（0以下は -1）"""
+    sec = np.asarray(sec, dtype=float)
+    m = np.floor(sec / 60)
+    s = np.rint(sec - m * 60)     # np.rint も Python の round も偶数丸め
+    return np.where(sec <= 0, -1, (m * 60 + s).astype(np.int64))
+
+
+def _format_codes(codes, fmt):
+    # 文字列化は種類ごとに1回だけ（表に載せるときは Categorical のまま使う）
+    uniq, inv = np.unique(codes, return_inverse=True)
+    return pd.Categorical.from_codes(inv.reshape(-1), [fmt(u) for u in uniq.tolist()])
+
+
+def _mmss_label(code):
+    return "0:00" if code < 0 else f"{code // 60}:{code % 60:02d}"
+
+
+def ragged_splits(records):
+    """
+    Record の列 → (values, offsets)。Record.splits_sec は正の値の昇順に正規化済みなので、
+    つなげるだけでよい（文字列の解析・並べ替えは parse_record で1回だけ済んでいる）。
+    """
+    counts = np.fromiter((len(r.splits_sec) for r in records), dtype=np.int64, count=len(records))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    values = np.frombuffer(b"".join(r.splits_sec for r in records), dtype=float)
+    return values, offsets
+
+
+def ragged_laps(values, offsets):
+    """
+    splits_to_laps のベクトル版（スプリット2本以上の record のみ）。
+    戻り値: laps, lap_offsets, lap_rid, lap_no（1始まり）
+    """
+    n = len(offsets) - 1
+    counts = np.diff(offsets)
+    counts = np.where(counts >= 2, counts, 0)
+    rid = np.repeat(np.arange(n), counts)
+    starts = offsets[:-1]
+    idx = np.arange(len(rid)) - np.repeat(np.cumsum(counts) - counts, counts)   # record 内の位置
+    pos = np.repeat(starts, counts) + idx
+    prev = np.where(idx == 0, 0.0, values[np.maximum(pos - 1, 0)])
+    laps = np.maximum(0.0, values[pos] - prev)
+    lap_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=lap_offsets[1:])
+    return laps, lap_offsets, rid, idx + 1
+
+
+def lap_diffs(laps, lap_no):
+    """前の本との差（各 record の1本目は NaN）"""
+    diff = np.full(len(laps), np.nan)
+    if len(laps):
+        diff[1:] = laps[1:] - laps[:-1]
+        diff[lap_no == 1] = np.nan
+    return diff
+
+
+def alert_mask(diffs, threshold=AT_ALERT_THRESHOLD):
+    """detect_at_alerts のベクトル版。しきい値を変えても差分の再計算は不要。"""
+    return np.nan_to_num(diffs, nan=-np.inf) >= threshold
+
+
+def pace_guide_table(target_m, target_time_sec):
+    """build_pace_guide のベクトル版（record × 3プランの長い表）"""
+    target_m = np.asarray(target_m, dtype=np.int64)
+    t0 = np.asarray(target_time_sec, dtype=float)
+    ok = (target_m > 0) & (t0 > 0)
+    rid = np.repeat(np.nonzero(ok)[0], len(PACE_PLANS))
+    mult = np.tile([m for _, m in PACE_PLANS], ok.sum())
+
+    tm = target_m[rid]
+    t = t0[rid] * mult
+    per_m = t / tm
+    rem = tm % LAP_M
+    # 目標ラップ文字列は (ラップ, 周回数, 端数m, 端数タイム) の組ごとに1回だけ作る
+    keys = np.stack([_mmss_codes(per_m * LAP_M), tm // LAP_M, rem, _mmss_codes(per_m * rem)], axis=1)
+    uniq, inv = np.unique(keys, axis=0, return_inverse=True)
+    details = []
+    for lap_code, full_laps, rem_m, rem_code in uniq.tolist():
+        detail = f"{LAP_M}m:{_mmss_label(lap_code)} × {full_laps}"
+        if rem_m:
+            detail += f" + {rem_m}m:{_mmss_label(rem_code)}"
+        details.append(detail)
+
+    return pd.DataFrame({
+        "record": rid,
+        "プラン": pd.Categorical.from_codes(np.tile(np.arange(len(PACE_PLANS)), ok.sum()), [l for l, _ in PACE_PLANS]),
+        "想定タイム": _format_codes(_mmss_codes(t), _mmss_label),
+        "目標ラップ": pd.Categorical.from_codes(inv.reshape(-1), details),
+    })
+
+
+def compute_batch(records, profiles, threshold=AT_ALERT_THRESHOLD):
+    """
+    records（Record の列）と、それぞれの infer_profile の結果から全指標をまとめて計算する。
+    戻り値: {"records": record ごとの表, "laps": 1本ごとの表, "pace_guide": ペース表}
+    """
+    n = len(records)
+    time_min = np.fromiter((p["time_min"] for p in profiles), dtype=float, count=n)
+    target_m = np.fromiter((p["target_m"] for p in profiles), dtype=np.int64, count=n)
+    dist = np.fromiter((r.time_run_dist_m for r in records), dtype=float, count=n)
+    time_sec = time_min * 60
+
+    values, offsets = ragged_splits(records)
+    laps, lap_offsets, lap_rid, lap_no = ragged_laps(values, offsets)
+    diffs = lap_diffs(laps, lap_no)
+    alerts = alert_mask(diffs, threshold)
+
+    ok = (dist > 0) & (time_sec > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pace = np.where(ok, time_sec / (dist / 1000), 0.0)
+        pred = np.where(ok, target_m / (dist / time_sec), 0.0)
+        v = np.where((dist > 0) & (time_min > 0), dist / time_min, 0.0)
+    vo2 = np.where(v > 0, round1(0.2 * v + 3.5), 0.0)
+
+    rec_df = pd.DataFrame({
+        "time_run_dist_m": dist,
+        "n_splits": np.diff(offsets),
+        "n_laps": np.diff(lap_offsets),
+        "alert_count": np.bincount(lap_rid[alerts], minlength=n),
+        "pace_sec_km": pace,
+        "target_m": target_m,
+        "target_time_pred_sec": pred,
+        "vo2max": vo2,
+    })
+    lap_df = pd.DataFrame({
+        "record": lap_rid,
+        "lap_no": lap_no,
+        "split_sec": values[np.repeat(offsets[:-1], np.diff(lap_offsets)) + lap_no - 1],
+        "lap_sec": laps,
+        "diff_sec": diffs,
+        "alert": alerts,
+    })
+    return {"records": rec_df, "laps": lap_df, "pace_guide": pace_guide_table(target_m, pred)}
@@ -0,0 +1,338 @@
+import time
+
+from .cache import cache_key
+from .core import LAP_M, RACE_DISTANCES, empty_result, infer_profile, parse_sheet, safe_json_load
+from .image import data_url_to_image, image_to_data_url, prepare_upload, resize_enhance, tile_mosaic
+from .metrics import METRICS, timer
+
+# 抽出の前処理設定（変更したら抽出キャッシュも自動で別キーになる）
+EXTRACT_MODEL = "gpt-4.1-mini"
+EXTRACT_MAX_WIDTH = 768
+EXTRACT_JPEG_QUALITY = 65
+EXTRACT_DETECT_GRID = True  # 表の枠を自動検出して切り抜く（False なら固定割合カット）
+
+# 段階的解像度：小さい画像で読んでみて、妥当性チェックに落ちたときだけ次の段階へ
+EXTRACT_CASCADE = True
+EXTRACT_CASCADE_TIERS = ((512, 50), (768, 65), (1024, 80))  # (幅, JPEG品質) 小さい順
+EXTRACT_TIERS = EXTRACT_CASCADE_TIERS if EXTRACT_CASCADE else ((EXTRACT_MAX_WIDTH, EXTRACT_JPEG_QUALITY),)
+EXTRACT_PROMPT_VERSION = 2  # 抽出プロンプト・出力スキーマを変えたら上げる
+
+# ==========================================
+# 抽出（画像→JSON）
+# ==========================================
+EXTRACT_PROMPT = f"""
+あなたは帳票読取の専門家です。記録用紙から必要情報を抽出し、必ずJSONのみを出力してください。
+説明文や```は禁止です。
+
+【重要】
+- 手書きのメモ（欄外・余白・枠の外）は一切無視すること。
+- 読み取るのは表の枠内（記入欄）のみ。
+
+【最優先で抽出するもの】
+1) 300mごとの通過タイム（スプリットタイム）
+- 形式は "m:ss" の配列（例 "2:02"）
+- 見える範囲で全て抽出
+- ①②③の列がある場合は records に複数入れる
+
+2) 時間走（15分/12分）の最下段「走行距離（m）」→ time_run_dist_m
+- ①②③がある場合はそれぞれ入れる
+
+3) 距離走（3000m/2100m）の最下段「記録（分:秒）」→ distance_race_time_mmss
+- あわせて distance_race_m を 3000 or 2100 にする
+
+【JSON形式】
+{{
+  "name": "選手名",
+  "sheet_hints": "用紙内で読み取れたキーワード（男子/女子/15分/12分/3000/2100 等）を短く列挙。無ければ空文字",
+  "records": [
+    {{
+      "attempt": 1,
+      "lap_m": {LAP_M},
+      "splits_mmss": ["0:58","2:02","3:08"],
+      "time_run_dist_m": 4100,
+      "distance_race_m": 3000,
+      "distance_race_time_mmss": "11:12"
+    }}
+  ]
+}}
+
+【ルール】
+- 不明は推測せず 0/空配列/空文字
+"""
+
+# 構造化出力（JSON Schema, strict）。形の崩れた JSON・余計な前置きが返らなくなる
+EXTRACT_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["name", "sheet_hints", "records"],
+    "properties": {
+        "name": {"type": "string"},
+        "sheet_hints": {"type": "string"},
+        "records": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["attempt", "lap_m", "splits_mmss", "time_run_dist_m",
+                             "distance_race_m", "distance_race_time_mmss"],
+                "properties": {
+                    "attempt": {"type": "integer"},
+                    "lap_m": {"type": "integer"},
+                    "splits_mmss": {"type": "array", "items": {"type": "string"}},
+                    "time_run_dist_m": {"type": "integer"},
+                    "distance_race_m": {"type": "integer", "enum": [0, *RACE_DISTANCES]},
+                    "distance_race_time_mmss": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+EXTRACT_TEXT_FORMAT = {"format": {"type": "json_schema", "name": "record_sheet", "strict": True, "schema": EXTRACT_SCHEMA}}
+
+# まとめて抽出：複数枚を1回のリクエストで読み、{"sheets": [...]} を1枚ずつに分け直す
+# images: 1枚ずつ input_image で並べる / mosaic: 番号つきで1枚の画像にタイル状に並べる
+EXTRACT_PACK_LAYOUTS = ("images", "mosaic")
+EXTRACT_PACK_PROMPT = EXTRACT_PROMPT + """
+【複数枚のとき】
+- 記録用紙が複数枚あり、1枚が1人分です。
+- 出力は {"sheets": [...]} とし、用紙の順に1枚ずつ上の JSON 形式で入れること。
+- 読めない用紙も省略せず name は空文字・records は空配列で入れ、要素数を用紙の枚数と同じにすること。
+"""
+EXTRACT_PACK_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["sheets"],
+    "properties": {"sheets": {"type": "array", "items": EXTRACT_SCHEMA}},
+}
+EXTRACT_PACK_TEXT_FORMAT = {"format": {"type": "json_schema", "name": "record_sheets", "strict": True,
+                                       "schema": EXTRACT_PACK_SCHEMA}}
+
+# ==========================================
+# 抽出結果の妥当性チェック（段階的解像度の「次へ進むか」判定）
+# ==========================================
+PLAUSIBLE_SPEED_M_PER_MIN = (120, 400)   # 時間走の平均速度として自然な範囲
+PLAUSIBLE_LAP_RATIO = (0.7, 1.4)         # 平均ラップ ÷ 時間走の距離から見たラップ
+
+def validate_extraction(sheet):
+    """問題点のリストを返す（空なら合格）。読み取り時の問題は Record.issues に入っている"""
+    if not sheet.records:
+        return ["records が空"]
+    issues = []
+    for rec in sheet.records:
+        issues.extend(rec.issues)
+        tag = f"{rec.attempt}回目"
+        dist, splits = rec.time_run_dist_m, rec.splits_sec
+        time_min = infer_profile(rec, sheet.sheet_hints)["time_min"]
+        lo, hi = PLAUSIBLE_SPEED_M_PER_MIN
+        if dist > 0 and not (lo * time_min <= dist <= hi * time_min):
+            issues.append(f"{tag}: {time_min}分間走で {int(dist)}m は不自然")
+        elif dist > 0 and len(splits) >= 2:
+            expected_lap = LAP_M / (dist / (time_min * 60))
+            ratio = (splits[-1] / len(splits)) / expected_lap
+            if not (PLAUSIBLE_LAP_RATIO[0] <= ratio <= PLAUSIBLE_LAP_RATIO[1]):
+                issues.append(f"{tag}: ラップと距離が合わない")
+    return issues
+
+# ==========================================
+# 前処理（1回のデコードで段階ごとの送信用画像を作る）
+# ==========================================
+def prepare_extract_source(raw_bytes):
+    """(元画像プレビュー, 表の画像, box)。段階ごとの送信用画像は tier_image で必要な分だけ作る"""
+    return prepare_upload(raw_bytes, max_width=max(w for w, _ in EXTRACT_TIERS), detect_grid=EXTRACT_DETECT_GRID)
+
+def tier_image(source, box, tier):
+    return resize_enhance(source, box, EXTRACT_TIERS[tier][0])
+
+def tier_data_urls(source, box):
+    """段階ごとの data URL（必要になった段階だけ縮小・JPEG 化する）"""
+    for i, (_, quality) in enumerate(EXTRACT_TIERS):
+        yield image_to_data_url(tier_image(source, box, i), jpeg_quality=quality)
+
+def prepare_extract_bytes(raw_bytes):
+    """
+    アップロードされたバイト列から段階ごとの data URL のイテレータを作る。
+    デコード・表の検出はここで済ませ、縮小・JPEG 化は実際に送る段階まで遅らせる（tier_data_urls）。
+    """
+    _, source, box = prepare_extract_source(raw_bytes)
+    return tier_data_urls(source, box)
+
+# ==========================================
+# API 呼び出し
+# ==========================================
+def extract_from_data_url(client, url, usage=None):
+    """(Sheet, err) を返す。usage に dict を渡すと input_tokens / output_tokens を書き込む"""
+    with timer("extract_api", bytes=len(url)):
+        resp = client.responses.create(
+            model=EXTRACT_MODEL,
+            input=[{
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": EXTRACT_PROMPT},
+                    {"type": "input_image", "image_url": url},
+                ]
+            }],
+            temperature=0.2,
+            text=EXTRACT_TEXT_FORMAT,
+        )
+    METRICS.add_usage("extract", getattr(resp, "usage", None))
+    if usage is not None and getattr(resp, "usage", None) is not None:
+        usage["input_tokens"] = resp.usage.input_tokens
+        usage["output_tokens"] = resp.usage.output_tokens
+
+    # 構造化出力なら json.loads で一発。スキーマ非対応のバックエンド向けに safe_json_load を残す
+    with timer("json_parse"):
+        data = safe_json_load(resp.output_text.strip())
+        sheet = parse_sheet(data if data else empty_result())
+    if not data:
+        return sheet, "JSON解析に失敗しました（抽出）"
+    return sheet, None
+
+def extract_cascade(client, urls, call=None, first_tier=0):
+    """
+    小さい画像から順に抽出し、妥当性チェックに通った段階で止める。
+    全段階で不合格なら、問題点が一番少ない結果（同数なら高解像度側）を返す。
+    call: API 呼び出しを包む関数（バックオフ等）。call(fn) の形で呼ぶ。
+    first_tier: urls の先頭が何段階目か（途中の段階から読み直すとき）
+    戻り値: sheet, err, meta（meta["tier"] が採用した段階）
+    """
+    call = call or (lambda fn: fn())
+    meta = {"tier": None, "attempts": []}
+    best = None
+    for i, url in enumerate(urls, start=first_tier):
+        width, quality = EXTRACT_TIERS[i]
+        usage = {}
+        t0 = time.perf_counter()
+        sheet, err = call(lambda url=url, usage=usage: extract_from_data_url(client, url, usage=usage))
+        issues = [err] if err else validate_extraction(sheet)
+        meta["attempts"].append({
+            "width": width,
+            "quality": quality,
+            "bytes": len(url),
+            "latency_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+            "issues": issues,
+        })
+        if best is None or len(issues) <= len(best[3]):
+            best = (i, sheet, err, issues)
+        if not issues:
+            break
+    meta["tier"], sheet, err, meta["issues"] = best
+    return sheet, err, meta
+
+def pack_order_text(n, layout):
+    """画像の後ろに付ける短い指示（枚数と並び順）。長い抽出プロンプトは枚数によらず同じ文面にしておく"""
+    if layout == "mosaic":
+        return f"用紙は{n}枚で、1枚の画像に番号つきで並べてあります（左から右、上から下の番号順）。"
+    return f"用紙は{n}枚で、画像の順に1〜{n}枚目です。"
+
+def split_pack_response(data, n):
+    """{"sheets": [...]} を n 枚分の (Sheet, err) に分ける。足りない分・形の崩れた分はその用紙だけエラー"""
+    sheets = data.get("sheets") if isinstance(data, dict) else None
+    if not isinstance(sheets, list):
+        return [(parse_sheet(empty_result()), "JSON解析に失敗しました（まとめて抽出）") for _ in range(n)]
+    out = []
+    for i in range(n):
+        if i < len(sheets) and isinstance(sheets[i], dict):
+            out.append((parse_sheet(sheets[i]), None))
+        else:
+            out.append((parse_sheet(empty_result()), "まとめて抽出の応答にこの用紙の分がありません"))
+    return out
+
+def extract_pack(client, urls, layout="images", quality=EXTRACT_TIERS[0][1], usage=None):
+    """
+    urls（1枚に1つ、同じ段階の data URL）を1回のリクエストで抽出し、枚数分の (Sheet, err) を返す。
+    layout="mosaic" なら1枚の画像に並べ直して送る（quality はそのときの JPEG 品質）。
+    """
+    n = len(urls)
+    if layout == "mosaic":
+        urls = [image_to_data_url(tile_mosaic([data_url_to_image(u) for u in urls]), jpeg_quality=quality)]
+    with timer("extract_pack_api", sheets=n, layout=layout, bytes=sum(len(u) for u in urls)):
+        resp = client.responses.create(
+            model=EXTRACT_MODEL,
+            input=[{
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": EXTRACT_PACK_PROMPT},
+                    *({"type": "input_image", "image_url": u} for u in urls),
+                    {"type": "input_text", "text": pack_order_text(n, layout)},
+                ]
+            }],
+            temperature=0.2,
+            text=EXTRACT_PACK_TEXT_FORMAT,
+        )
+    METRICS.add_usage("extract_pack", getattr(resp, "usage", None))
+    if usage is not None and getattr(resp, "usage", None) is not None:
+        usage["input_tokens"] = resp.usage.input_tokens
+        usage["output_tokens"] = resp.usage.output_tokens
+
+    with timer("json_parse"):
+        return split_pack_response(safe_json_load(resp.output_text.strip()), n)
+
+def extract_packed(client, url_lists, layout="images", call=None):
+    """
+    url_lists: 1枚ごとの段階別 data URL（tier_data_urls / prepare_extract_bytes の結果）。
+    最初の段階は全員分をまとめて1回で読み、妥当性チェックに落ちた用紙だけ次の段階から1枚ずつ読み直す。
+    戻り値: 1枚ごとの (sheet, err, meta)。meta は extract_cascade と同じ形で、
+    まとめて読んだ回は attempts の先頭（packed に枚数、トークンは枚数で割った1枚分）。
+    """
+    call = call or (lambda fn: fn())
+    url_lists = [iter(urls) for urls in url_lists]
+    firsts = [next(urls) for urls in url_lists]
+    n = len(firsts)
+    width, quality = EXTRACT_TIERS[0]
+    usage = {}
+    t0 = time.perf_counter()
+    results = call(lambda: extract_pack(client, firsts, layout, quality, usage=usage))
+    latency_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    out = []
+    for urls, first, (sheet, err) in zip(url_lists, firsts, results):
+        issues = [err] if err else validate_extraction(sheet)
+        attempt = {
+            "width": width,
+            "quality": quality,
+            "bytes": len(first),
+            "latency_ms": latency_ms,
+            "input_tokens": round(usage["input_tokens"] / n) if "input_tokens" in usage else None,
+            "output_tokens": round(usage["output_tokens"] / n) if "output_tokens" in usage else None,
+            "issues": issues,
+            "packed": n,
+        }
+        if not issues or len(EXTRACT_TIERS) == 1:
+            out.append((sheet, err, {"tier": 0, "attempts": [attempt], "issues": issues}))
+            continue
+        # 落ちた用紙は次の段階から1枚ずつ（まとめて読んだ方が問題が少なければそちらを採る）
+        retry_sheet, retry_err, meta = extract_cascade(client, urls, call=call, first_tier=1)
+        meta["attempts"].insert(0, attempt)
+        if len(issues) < len(meta["issues"]):
+            meta["tier"], meta["issues"] = 0, issues
+        else:
+            sheet, err = retry_sheet, retry_err
+        out.append((sheet, err, meta))
+    return out
+
+def extract_cache_key(raw_bytes):
+    # 前処理設定・プロンプト版が変わればキーも変わる
+    return cache_key(
+        raw_bytes,
+        model=EXTRACT_MODEL,
+        tiers=EXTRACT_TIERS,
+        detect_grid=EXTRACT_DETECT_GRID,
+        prompt_version=EXTRACT_PROMPT_VERSION,
+    )
+
+def summarize_cascade(metas):
+    """段階ごとの採用数と、1枚あたりの平均トークン・平均待ち時間"""
+    metas = [m for m in metas if m and m.get("attempts")]
+    if not metas:
+        return {}
+    tokens = [sum(a["input_tokens"] or 0 for a in m["attempts"]) for m in metas]
+    latency = [sum(a["latency_ms"] for a in m["attempts"]) for m in metas]
+    return {
+        "sheets": len(metas),
+        "tier_counts": {f"{w}px": sum(1 for m in metas if m["tier"] == i) for i, (w, _) in enumerate(EXTRACT_TIERS)},
+        "avg_calls": sum(len(m["attempts"]) for m in metas) / len(metas),
+        "avg_input_tokens": sum(tokens) / len(metas),
+        "avg_latency_ms": sum(latency) / len(metas),
+    }
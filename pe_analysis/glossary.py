@@ -0,0 +1,77 @@
+# ==========================================
+# 用語解説（固定文）
+# ==========================================
+# 画面に出すのは HTML にした GLOSSARY_HTML。import 時に1回だけ作る（描き直しのたびに組み立てない）。
+from .core import AT_ALERT_THRESHOLD
+
+GLOSSARY_TEXT = f"""
+## 🔍 用語解説：VO₂Max（最大酸素摂取量）とは？
+**VO₂Max（最大酸素摂取量）**は、運動中に体が取り込んで使える**酸素の最大量**のことです。  
+簡単に言うと、**心肺のエンジンの大きさ**を表す数値です。
+
+### ✅ どんな能力を表す？
+VO₂Maxが高い人は…
+- 心臓や肺が強く、体に酸素をたくさん送れる  
+- 筋肉が酸素を使ってエネルギーを作りやすい  
+- **長い時間、速いペースを維持しやすい**  
+
+つまり、持久走に必要な「**基礎体力（持久力の土台）**」が大きいです。
+
+### ✅ どう活きてくる？
+VO₂Maxが高いと…
+- **後半でもペースが落ちにくい**
+- 3000m / 2100mで「粘れる」
+- 練習を積むほど記録が伸びやすい（伸びしろが大きい）
+
+> ※このアプリのVO₂Maxは、時間走の結果から計算した**推定値（目安）**です。実験室で測る本来の測定とは違います。
+
+---
+
+## 🔍 用語解説：AT（無酸素性作業閾値）とは？
+**AT（Anaerobic Threshold：無酸素性作業閾値）**は、運動強度が上がっていく中で、  
+体が「**酸素だけでは足りなくなり始める境目**」のことです。
+
+イメージで言うと…
+- ここまでは「まだ余裕がある」
+- ここを超えると「急に苦しくなって、ペースが落ちやすくなる」
+
+という **限界ライン**です。
+
+### ✅ どんな能力を表す？
+ATが高い（強い）人は…
+- 苦しくなる境目が遅い  
+- つまり、**速いペースで長く走れる**
+
+これはVO₂Max（エンジンの大きさ）とは少し違って、  
+レースでの「**粘り・実戦力**」に直結します。
+
+### ✅ どう活きてくる？
+ATが強いと…
+- 中盤で失速しにくい（タレにくい）
+- 苦しい区間でもスピードを維持できる
+- 3000m / 2100mで自己ベストを狙いやすい
+
+---
+
+## 🧠 このアプリでのATの見方（授業用の簡易判定）
+このアプリでは、300mごとのラップの変化から  
+「ATのサイン（失速の始まり）」を見つけます。
+
+### ⚠️ 失速アラート（ATサイン）
+前の300mより **+{AT_ALERT_THRESHOLD:g}秒以上遅くなった**場合、  
+「ここで苦しくなってペースが落ち始めた可能性がある」と判定します。
+
+> ※本当のATは専門的な測定が必要ですが、授業では「失速が始まる地点＝ATのサイン」として理解すると分かりやすいです。
+
+---
+
+## ✅ VO₂MaxとATの関係（まとめ）
+- **VO₂Max＝エンジンの大きさ（基礎体力）**
+- **AT＝そのエンジンをレースで使い切る力（粘り）**
+
+つまり…
+- VO₂Maxが高い → 伸びる土台がある  
+- ATが高い → レースで崩れにくい  
+"""
+
+GLOSSARY_HTML = f'<div class="glossary-box">{GLOSSARY_TEXT.replace(chr(10), "<br>")}</div>'
@@ -0,0 +1,116 @@
+import numpy as np
+from PIL import Image
+
+# ==========================================
+# 記録表（罫線の枠）の自動検出
+# ==========================================
+# 縮小したグレー画像で
+#   1) 黒帽子変換で罫線・文字（周りより暗い細いもの）を取り出す
+#   2) 小さな角度で傾けてみて（インクの座標をずらして数える）、行方向の投影が一番「尖る」角度を傾きとする
+#   3) 行・列ごとのインク率が高いところ＝罫線として、外側の罫線で囲まれた範囲を表とする
+# 罫線が足りない・範囲が小さすぎるときは None（呼び出し側で固定割合カットに戻す）
+
+GRID_WORK_WIDTH = 480          # 検出に使う縮小幅
+GRID_CLOSE_SIZE = 5            # クロージングの窓（縮小後の罫線の太さより大きく）
+GRID_INK_CONTRAST = 40         # 周りよりこれだけ暗ければインク
+GRID_MAX_SKEW_DEG = 5.0
+GRID_SKEW_STEP_DEG = 0.5
+GRID_MIN_H_LINE = 0.30         # 行のインク率がこれ以上なら横罫線
+GRID_MIN_V_LINE = 0.25         # 列のインク率がこれ以上なら縦罫線
+GRID_MIN_H_LINES = 3
+GRID_MIN_V_LINES = 2
+GRID_MIN_AREA = 0.15           # 画像に対する表の面積の下限
+GRID_PAD = 0.01                # 検出した枠の外側に残す余白（割合）
+
+
+def _rank_filter(a, size, op):
+    """size×size の窓の最大・最小（op は np.maximum / np.minimum）。縦・横に分けて1次元ずつ（端は端の値で延長）"""
+    r = size // 2
+    p = np.pad(a, r, mode="edge")
+    h, w = a.shape
+    rows = p[:, 0:w].copy()
+    for k in range(1, size):
+        op(rows, p[:, k:k + w], out=rows)
+    out = rows[0:h].copy()
+    for k in range(1, size):
+        op(out, rows[k:k + h], out=out)
+    return out
+
+
+def ink_mask(gray_image):
+    """
+    黒帽子変換（クロージング − 元画像）で「周りより暗い細い線・文字」だけを取り出す。
+    机などの大きく暗い領域や紙の縁（段差）は残らない。
+    """
+    gray = np.asarray(gray_image, dtype=np.int16)
+    closed = _rank_filter(_rank_filter(gray, GRID_CLOSE_SIZE, np.maximum), GRID_CLOSE_SIZE, np.minimum)
+    return (closed - gray) >= GRID_INK_CONTRAST
+
+
+def _line_centers(profile, min_frac):
+    """投影のうち min_frac 以上が連続する区間を1本の線としてまとめ、中心位置を返す"""
+    on = np.concatenate([[False], profile >= min_frac, [False]])
+    edges = np.flatnonzero(on[1:] != on[:-1])
+    starts, ends = edges[::2], edges[1::2]
+    return (starts + ends - 1) / 2
+
+
+def _skew_score(ys, xs, angle):
+    """angle 度だけ回したときの行方向の投影の二乗和（ずらし（シアー）で近似。罫線が水平に揃うほど大きい）"""
+    rows = np.rint(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+    counts = np.bincount(rows - rows.min())
+    return float(np.dot(counts, counts))
+
+
+def estimate_skew(ink):
+    """
+    行方向の投影が一番尖る回転角（度、PIL の rotate にそのまま渡せる向き）。
+    マスク全体を回す代わりにインクの座標をずらして数え、1度刻みで当たりを付けてから
+    前後を GRID_SKEW_STEP_DEG 刻みで詰める。
+    """
+    ys, xs = np.nonzero(ink)
+    if not len(ys):
+        return 0.0
+    xs = xs - ink.shape[1] / 2
+
+    def best(angles):
+        return max(angles, key=lambda a: (_skew_score(ys, xs, a), -abs(a)))
+
+    coarse = best(np.arange(-GRID_MAX_SKEW_DEG, GRID_MAX_SKEW_DEG + 1e-9, 1.0).tolist())
+    fine = [a for a in (coarse - GRID_SKEW_STEP_DEG, coarse, coarse + GRID_SKEW_STEP_DEG)
+            if abs(a) <= GRID_MAX_SKEW_DEG + 1e-9]
+    return float(best(fine))
+
+
+def detect_table_box(image):
+    """
+    向き補正済み RGB 画像から記録表を探す。
+    見つかれば (傾き補正角, (left, top, right, bottom)) を返す。box は補正角で回した後の座標。
+    """
+    w, h = image.size
+    scale = GRID_WORK_WIDTH / w if w > GRID_WORK_WIDTH else 1.0
+    small = image.convert("L").resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.BILINEAR)
+    ink = ink_mask(small)
+
+    angle = estimate_skew(ink)
+    if angle:
+        ink = np.asarray(Image.fromarray(ink.astype(np.uint8) * 255).rotate(angle, resample=Image.NEAREST)) > 0
+
+    sh, sw = ink.shape
+    rows = _line_centers(ink.mean(axis=1), GRID_MIN_H_LINE)
+    cols = _line_centers(ink.mean(axis=0), GRID_MIN_V_LINE)
+    if len(rows) < GRID_MIN_H_LINES or len(cols) < GRID_MIN_V_LINES:
+        return None
+
+    left, right = cols[0] / sw, cols[-1] / sw
+    top, bottom = rows[0] / sh, rows[-1] / sh
+    if (right - left) * (bottom - top) < GRID_MIN_AREA:
+        return None
+
+    box = (
+        int(max(0.0, left - GRID_PAD) * w),
+        int(max(0.0, top - GRID_PAD) * h),
+        int(min(1.0, right + GRID_PAD) * w),
+        int(min(1.0, bottom + GRID_PAD) * h),
+    )
+    return angle, box
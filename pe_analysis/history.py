@@ -0,0 +1,192 @@
+import datetime as dt
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from .core import infer_profile, parse_sheet, pick_best_time_run, record_metrics
+
+# ==========================================
+# 選手ごとの記録の蓄積（シーズンを通した推移・自己ベスト）
+# ==========================================
+# 1枚の記録用紙 = sheets の1行（ベスト回基準の集計つき）、1回分 = records の1行。
+# 集計は保存時に1回だけ計算しておき、推移・自己ベストは索引つきの SELECT だけで返す。
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (
+    id INTEGER PRIMARY KEY,
+    sheet_key TEXT NOT NULL UNIQUE,
+    athlete TEXT NOT NULL,
+    name TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    time_min INTEGER NOT NULL,
+    target_m INTEGER NOT NULL,
+    n_records INTEGER NOT NULL,
+    best_dist_m INTEGER NOT NULL,
+    avg_dist_m INTEGER NOT NULL,
+    worst_dist_m INTEGER NOT NULL,
+    vo2max REAL NOT NULL,
+    alert_count INTEGER NOT NULL,
+    target_time_pred_sec REAL NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sheets_athlete_date ON sheets(class_name, athlete, run_date);
+CREATE INDEX IF NOT EXISTS idx_sheets_date ON sheets(run_date);
+CREATE TABLE IF NOT EXISTS records (
+    sheet_id INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE,
+    attempt INTEGER NOT NULL,
+    time_run_dist_m INTEGER NOT NULL,
+    vo2max REAL NOT NULL,
+    alert_count INTEGER NOT NULL,
+    pace_sec_km REAL NOT NULL,
+    target_time_pred_sec REAL NOT NULL,
+    PRIMARY KEY (sheet_id, attempt)
+);
+"""
+
+SHEET_COLUMNS = ("run_date", "name", "class_name", "gender", "time_min", "target_m", "n_records",
+                 "best_dist_m", "avg_dist_m", "worst_dist_m", "vo2max", "alert_count", "target_time_pred_sec")
+
+
+def athlete_key(name):
+    """表記ゆれ（全角/半角・空白）を吸収した選手名キー"""
+    return "".join(unicodedata.normalize("NFKC", name or "").split())
+
+
+def sheet_summary(sheet):
+    """
+    1枚分の集計（ベスト回基準）と、回ごとの行。
+    戻り値: (summary dict, [(attempt, dist, vo2max, alert_count, pace_sec_km, target_time_pred_sec), ...])
+    """
+    best = pick_best_time_run(sheet.records)
+    if best is None:
+        return None, []
+    profile = infer_profile(best, sheet.sheet_hints)
+    rows, best_metrics = [], None
+    for rec in sheet.records:
+        m = record_metrics(rec, infer_profile(rec, sheet.sheet_hints))
+        rows.append((rec.attempt, int(rec.time_run_dist_m), m["vo2max"], len(m["alerts"]),
+                     m["pace_sec_km"], m["target_time_pred_sec"]))
+        if rec is best:
+            best_metrics = m
+    dists = [r[1] for r in rows if r[1] > 0] or [0]
+    return {
+        "gender": profile["gender"],
+        "time_min": profile["time_min"],
+        "target_m": profile["target_m"],
+        "n_records": len(rows),
+        "best_dist_m": max(dists),
+        "avg_dist_m": int(round(sum(dists) / len(dists))),
+        "worst_dist_m": min(dists),
+        "vo2max": best_metrics["vo2max"],
+        "alert_count": len(best_metrics["alerts"]),
+        "target_time_pred_sec": best_metrics["target_time_pred_sec"],
+    }, rows
+
+
+class HistoryStore:
+    """
+    SQLite に記録用紙ごとの集計を貯める。sheet_key（抽出キャッシュのキー等）が同じなら上書き。
+    Streamlit の複数セッションから使えるよう、接続は1本をロックで共有する。
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def add_sheet(self, sheet_key, sheet, class_name="", run_date=None):
+        """保存して sheets.id を返す（records が空なら保存せず None）"""
+        summary, rows = sheet_summary(sheet)
+        if summary is None:
+            return None
+        run_date = run_date or dt.date.today()
+        run_date = run_date if isinstance(run_date, str) else run_date.isoformat()
+        values = {
+            "sheet_key": sheet_key,
+            "athlete": athlete_key(sheet.name),
+            "name": sheet.name,
+            "class_name": class_name or "",
+            "run_date": run_date,
+            **summary,
+            "data": json.dumps(sheet.to_dict(), ensure_ascii=False),
+            "created": time.time(),
+        }
+        cols = ", ".join(values)
+        marks = ", ".join("?" for _ in values)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sheets WHERE sheet_key = ?", (sheet_key,))
+            sheet_id = self._db.execute(f"INSERT INTO sheets ({cols}) VALUES ({marks})", tuple(values.values())).lastrowid
+            self._db.executemany(
+                "INSERT OR REPLACE INTO records (sheet_id, attempt, time_run_dist_m, vo2max, alert_count,"
+                " pace_sec_km, target_time_pred_sec) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(sheet_id, *r) for r in rows],
+            )
+        return sheet_id
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, params).fetchall()]
+
+    def trend(self, name, class_name="", since=None, until=None):
+        """選手の記録を日付順に（1枚1行）"""
+        sql = f"SELECT {', '.join(SHEET_COLUMNS)} FROM sheets WHERE class_name = ? AND athlete = ?"
+        params = [class_name or "", athlete_key(name)]
+        if since:
+            sql += " AND run_date >= ?"
+            params.append(str(since))
+        if until:
+            sql += " AND run_date <= ?"
+            params.append(str(until))
+        return self._query(sql + " ORDER BY run_date, id", params)
+
+    def personal_best(self, name, class_name=""):
+        """時間走のベスト距離が最大の1枚（なければ None）"""
+        rows = self._query(
+            f"SELECT {', '.join(SHEET_COLUMNS)} FROM sheets WHERE class_name = ? AND athlete = ?"
+            " ORDER BY best_dist_m DESC, run_date LIMIT 1",
+            (class_name or "", athlete_key(name)),
+        )
+        return rows[0] if rows else None
+
+    def class_bests(self, class_name="", since=None, until=None):
+        """クラス全員の期間内ベスト（1人1行、ベスト距離の降順）"""
+        sql = ("SELECT MIN(name) AS name, COUNT(*) AS sheets, MAX(best_dist_m) AS best_dist_m,"
+               " MAX(vo2max) AS vo2max, MAX(run_date) AS last_date FROM sheets WHERE class_name = ?")
+        params = [class_name or ""]
+        if since:
+            sql += " AND run_date >= ?"
+            params.append(str(since))
+        if until:
+            sql += " AND run_date <= ?"
+            params.append(str(until))
+        return self._query(sql + " GROUP BY athlete ORDER BY best_dist_m DESC", params)
+
+    def load_sheets(self, class_name="", run_date=None):
+        """
+        クラスの記録用紙を [(名前, Sheet), ...]（名前順）で。
+        run_date を指定するとその日の分、省略すると1人につき最新の1枚。
+        """
+        sql = "SELECT name, data FROM sheets s WHERE class_name = ?"
+        params = [class_name or ""]
+        if run_date:
+            sql += " AND run_date = ?"
+            params.append(str(run_date))
+        else:
+            sql += (" AND id = (SELECT id FROM sheets WHERE class_name = s.class_name AND athlete = s.athlete"
+                    " ORDER BY run_date DESC, id DESC LIMIT 1)")
+        return [(r["name"], parse_sheet(json.loads(r["data"])))
+                for r in self._query(sql + " ORDER BY name, id", params)]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,153 @@
+import base64
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont, ImageOps
+
+from .grid import detect_table_box
+from .metrics import timer
+
+# ==========================================
+# ★方法A：欄外トリミング（表の枠が見つからないときの予備）
+# ==========================================
+MARGIN_BOX = (0.06, 0.03, 0.96, 0.98)  # left, top, right, bottom（割合）
+
+def margin_box(size):
+    w, h = size
+    left, top, right, bottom = MARGIN_BOX
+    return (int(w * left), int(h * top), int(w * right), int(h * bottom))
+
+def table_source(image, detect_grid=True):
+    """
+    記録表の枠を自動検出して (画像, box) を返す。傾いていれば回してから box を返す。
+    枠が見つからない（または detect_grid=False）なら固定割合（MARGIN_BOX）でカットする。
+    """
+    with timer("grid_detect"):
+        found = detect_table_box(image) if detect_grid else None
+    if found is None:
+        return image, margin_box(image.size)
+    angle, box = found
+    if angle:
+        with timer("deskew"):
+            image = image.rotate(angle, resample=Image.BILINEAR, fillcolor=(255, 255, 255))
+    return image, box
+
+def resize_enhance(image, box, max_width=768):
+    """box の切り抜き＋縮小（1回の resize で）＋コントラスト"""
+    with timer("crop_resize_enhance", width=max_width):
+        w, h = box[2] - box[0], box[3] - box[1]
+        if w > max_width:
+            image = image.resize((max_width, int(h * (max_width / w))), box=box)
+        else:
+            image = image.crop(box)
+        return ImageEnhance.Contrast(image).enhance(1.15)
+
+def crop_resize_enhance(image, max_width=768, detect_grid=True):
+    """向き補正済み RGB 画像 → 表の切り抜き＋縮小＋コントラスト"""
+    image, box = table_source(image, detect_grid=detect_grid)
+    return resize_enhance(image, box, max_width)
+
+def optimize_image_for_cost(image, max_width=768, detect_grid=True):
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    return crop_resize_enhance(image, max_width, detect_grid=detect_grid)
+
+def data_url_to_image(url):
+    """image_to_data_url の逆（RGB 画像に戻す）"""
+    return Image.open(BytesIO(base64.b64decode(url.split(",", 1)[1]))).convert("RGB")
+
+def image_to_data_url(image, jpeg_quality=65):
+    with timer("jpeg_base64", width=image.width, quality=jpeg_quality):
+        buf = BytesIO()
+        image.save(buf, format="JPEG", quality=jpeg_quality, optimize=True)
+        b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+        return f"data:image/jpeg;base64,{b64}"
+
+# ==========================================
+# アップロード画像の読み込み（必要な解像度まで落としてからデコード）
+# ==========================================
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)  # EXIF で縦横が入れ替わる向き
+
+def open_reduced(raw_bytes, min_width):
+    """
+    向き補正後の横幅が min_width 以上になる範囲で、できるだけ小さくデコードする。
+    JPEG は draft（DCT 段階で 1/2・1/4・1/8 縮小）、それ以外は reduce を使う。
+    戻り値は向き補正済みの RGB 画像。
+    """
+    with timer("decode", bytes=len(raw_bytes)):
+        image = Image.open(BytesIO(raw_bytes))
+        swapped = image.getexif().get(0x0112, 1) in ROTATED_ORIENTATIONS
+        stored_w = image.height if swapped else image.width
+
+        if image.format == "JPEG":
+            image.draft("RGB", (1, min_width) if swapped else (min_width, 1))
+            image.load()
+        else:
+            factor = stored_w // min_width
+            if factor >= 2:
+                image = image.reduce(factor)
+
+    with timer("exif_convert"):
+        return ImageOps.exif_transpose(image).convert("RGB")
+
+def scale_box(box, from_size, to_size):
+    """from_size の画像上の box を to_size の画像上の座標に直す（はみ出しは切る）"""
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    left, top, right, bottom = box
+    return (int(left * sx), int(top * sy), min(to_size[0], int(right * sx + 0.999)), min(to_size[1], int(bottom * sy + 0.999)))
+
+def prepare_upload(raw_bytes, max_width=768, preview_width=640, detect_grid=True):
+    """
+    1回のデコードで「元画像のプレビュー」と「送信用画像の元（表の画像と box）」を作る。
+    - 欄外カット（MARGIN_BOX）後に max_width 以上残る解像度でデコードし、表の検出も1回だけ
+    - 見つかった枠がそれより狭くて max_width に届かない写真だけ、枠の幅から解像度を決めてデコードし直す
+    - 送信用画像は resize_enhance(source, box, 幅) で必要な幅の分だけ作る
+    - プレビューは同じ中間画像から preview_width に縮小（ブラウザへ原寸を送らない）
+    戻り値: preview, source, box
+    """
+    crop_w = MARGIN_BOX[2] - MARGIN_BOX[0]
+    image = open_reduced(raw_bytes, int(max_width / crop_w) + 1)
+    with timer("grid_detect"):
+        found = detect_table_box(image) if detect_grid else None
+    angle, box = found if found is not None else (0, margin_box(image.size))
+
+    need = -(-max_width * image.width // max(1, box[2] - box[0]))  # 枠の幅が max_width になる全体の幅（切り上げ）
+    if image.width < need:
+        larger = open_reduced(raw_bytes, need)
+        box = scale_box(box, image.size, larger.size)
+        image = larger
+    source = image
+    if angle:
+        with timer("deskew"):
+            source = image.rotate(angle, resample=Image.BILINEAR, fillcolor=(255, 255, 255))
+
+    preview = image
+    if image.width > preview_width:
+        preview = image.resize((preview_width, int(image.height * preview_width / image.width)))
+    return preview, source, box
+
+# ==========================================
+# 複数枚を1枚の画像に並べる（まとめて抽出の mosaic 用）
+# ==========================================
+MOSAIC_GAP = 24        # タイルの間の余白（px）
+MOSAIC_LABEL_SIZE = 48  # 左上に入れる番号の文字の大きさ（px）
+
+def tile_mosaic(images, cols=None, gap=MOSAIC_GAP):
+    """
+    images を左から右・上から下へ格子状に並べ、各タイルの左上に 1, 2, 3… の番号を入れる。
+    cols を省略すると、なるべく正方形に近くなる列数にする。
+    """
+    with timer("tile_mosaic", tiles=len(images)):
+        cols = cols or max(1, int(len(images) ** 0.5 + 0.999))
+        rows = -(-len(images) // cols)
+        cell_w = max(im.width for im in images)
+        cell_h = max(im.height for im in images)
+        mosaic = Image.new("RGB", (cols * cell_w + (cols - 1) * gap, rows * cell_h + (rows - 1) * gap), "white")
+        draw = ImageDraw.Draw(mosaic)
+        try:
+            font = ImageFont.load_default(size=MOSAIC_LABEL_SIZE)
+        except TypeError:  # Pillow 10.1 より前
+            font = ImageFont.load_default()
+        for i, im in enumerate(images):
+            x, y = (i % cols) * (cell_w + gap), (i // cols) * (cell_h + gap)
+            mosaic.paste(im, (x, y))
+            draw.rectangle((x, y, x + MOSAIC_LABEL_SIZE * 1.4, y + MOSAIC_LABEL_SIZE * 1.2), fill="black")
+            draw.text((x + 8, y + 4), str(i + 1), fill="white", font=font)
+        return mosaic
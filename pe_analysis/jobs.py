@@ -0,0 +1,240 @@
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .metrics import METRICS
+
+# ==========================================
+# バックグラウンドのジョブ実行（抽出・レポートで画面を止めない）
+# ==========================================
+# 画面側は submit() してすぐ戻り、get() で状態を見に来る（自動更新で数秒おき）。
+# ワーカーは優先度の小さい順（同じなら投入順）に取り出すので、
+# 1枚ずつのアップロード（INTERACTIVE）は一括解析（BATCH）より先に処理される。
+# 状態・結果（JSON）は db_path を渡すと SQLite に残る。画像など JSON にできないものは
+# job.artifacts（メモリのみ）に置く。
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+JOB_WORKERS = 4
+JOB_KEEP_IN_MEMORY = 200  # 終わったジョブをメモリに残す件数（古い順に捨てる。結果は DB に残る）
+FINISHED = ("done", "error")
+
+log = logging.getLogger(__name__)
+
+
+class Job:
+    __slots__ = ("id", "kind", "priority", "key", "status", "payload", "progress", "result", "error",
+                 "artifacts", "created", "started", "finished")
+
+    def __init__(self, kind, payload, priority, key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.priority = priority
+        self.key = key
+        self.status = "queued"
+        self.payload = payload
+        self.progress = None  # 途中経過（ストリーミング中のレポート本文、一括解析の途中結果など）
+        self.result = None
+        self.error = None
+        self.artifacts = {}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def snapshot(self):
+        return {
+            "id": self.id, "kind": self.kind, "status": self.status, "progress": self.progress,
+            "result": self.result, "error": self.error, "artifacts": self.artifacts,
+            "created": self.created, "started": self.started, "finished": self.finished,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, db_path=None, keep=JOB_KEEP_IN_MEMORY):
+        self.keep = keep
+        self._handlers = {}
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._closed = False
+        self._db_lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, kind TEXT NOT NULL, priority INTEGER NOT NULL, status TEXT NOT NULL,"
+                " key TEXT, created REAL NOT NULL, started REAL, finished REAL, result TEXT, error TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created)")
+            # 前回のプロセスで終わらなかったジョブは入力（メモリ上）が失われているので失敗扱い
+            self._db.execute("UPDATE jobs SET status = 'error', error = '中断されました（再起動）'"
+                             " WHERE status IN ('queued', 'running')")
+            self._db.commit()
+        self._threads = [threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def register(self, kind, fn):
+        """fn(payload, job) -> JSON にできる結果。job.progress / job.artifacts は途中で書いてよい"""
+        self._handlers[kind] = fn
+
+    def submit(self, kind, payload, priority=PRIORITY_INTERACTIVE, key=None):
+        """
+        ジョブを積んで id を返す。key が同じジョブが待ち・実行中なら、新しく積まずにその id を返す。
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"unknown job kind: {kind}")
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("JobQueue は shutdown 済みです")
+            if key is not None and key in self._by_key:
+                existing = self._jobs.get(self._by_key[key])
+                if existing is not None and existing.status not in FINISHED:
+                    return existing.id
+            job = Job(kind, payload, priority, key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._by_key[key] = job.id
+            heapq.heappush(self._heap, (priority, next(self._seq), job.id))
+            self._cv.notify()
+        self._persist(job)
+        return job.id
+
+    def get(self, job_id):
+        """ジョブの状態（メモリに無ければ DB の記録。どちらにも無ければ None）"""
+        with self._cv:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.snapshot()
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT id, kind, status, result, error, created, started, finished FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0], "kind": row[1], "status": row[2], "progress": None,
+            "result": json.loads(row[3]) if row[3] else None, "error": row[4], "artifacts": {},
+            "created": row[5], "started": row[6], "finished": row[7],
+        }
+
+    def counts(self):
+        """状態ごとの件数（メモリ上のジョブ）"""
+        out = {"queued": 0, "running": 0, "done": 0, "error": 0}
+        with self._cv:
+            for job in self._jobs.values():
+                out[job.status] += 1
+        return out
+
+    def shutdown(self, timeout=None):
+        """
+        新しいジョブを受け付けなくし、実行中のジョブが終わるのを待ってワーカーを止める。
+        待ちのジョブは実行しない（DB には queued のまま残り、次に開いたときに中断扱いになる）。
+        """
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._heap and not self._closed:
+                    self._cv.wait()
+                if self._closed:
+                    return
+                _, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs[job_id]
+                job.status = "running"
+                job.started = time.time()
+            # ここから先の失敗（DB のロック・JSON にできない結果など）でワーカーを止めない
+            try:
+                self._run(job)
+            except Exception as e:
+                log.exception("job %s (%s) failed outside its handler", job.id, job.kind)
+                self._finish(job, None, "error", f"{type(e).__name__}: {e}")
+
+    def _run(self, job):
+        self._try_persist(job)
+        self._observe("job_wait", (job.started - job.created) * 1000, kind=job.kind)
+
+        try:
+            result = self._handlers[job.kind](job.payload, job)
+            status, error = "done", None
+        except Exception as e:
+            result, status, error = None, "error", f"{type(e).__name__}: {e}"
+
+        result_json = None
+        if result is not None and self._db is not None:
+            # JSON にできない結果は残せないので、終わったことにする前に失敗として扱う
+            try:
+                result_json = json.dumps(result, ensure_ascii=False)
+            except (TypeError, ValueError) as e:
+                result, status, error = None, "error", f"結果を保存できませんでした（{type(e).__name__}: {e}）"
+        self._finish(job, result, status, error)
+        self._try_persist(job, result_json)
+        self._observe("job_run", (job.finished - job.started) * 1000, kind=job.kind, status=job.status)
+
+    def _finish(self, job, result, status, error):
+        with self._cv:
+            job.result, job.error = result, error
+            job.status = status
+            job.finished = time.time()
+            job.payload = None  # 画像バイト列などはここで手放す
+            self._evict()
+
+    def _try_persist(self, job, result_json=None):
+        try:
+            self._persist(job, result_json)
+            return True
+        except Exception:
+            log.exception("job %s: could not persist state %s", job.id, job.status)
+            return False
+
+    def _observe(self, name, ms, **labels):
+        try:
+            METRICS.observe(name, ms, **labels)
+        except Exception:
+            log.exception("job metrics %s failed", name)
+
+    def _evict(self):
+        finished = [j.id for j in self._jobs.values() if j.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            job = self._jobs.pop(job_id)
+            if job.key is not None and self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
+
+    def _persist(self, job, result_json=None):
+        """状態を DB に書く（result_json は結果を JSON にしたもの。DB のロック等の失敗は例外のまま返す）"""
+        with self._db_lock:
+            if self._db is None:  # shutdown 済み
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO jobs (id, kind, priority, status, key, created, started, finished, result, error)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.kind, job.priority, job.status, job.key, job.created, job.started, job.finished,
+                     result_json, job.error),
+                )
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# ==========================================
+# 処理時間・トークン数の計測（プロセス全体で共有）
+# ==========================================
+# - timer("stage") で囲んだ区間の時間を記録し、JSON 1行ログを出す
+# - add_usage("extract", resp.usage) で API のトークン数を積算
+# - summary() で直近 WINDOW 件の p50 / p95、prometheus_text() で Prometheus 形式
+
+WINDOW = 1000
+QUANTILES = (0.5, 0.95)
+
+log = logging.getLogger("pe_analysis.metrics")
+log.addHandler(logging.NullHandler())
+
+
+class Metrics:
+    def __init__(self, window=WINDOW):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._count = defaultdict(int)
+        self._sum = defaultdict(float)
+        self._tokens = defaultdict(int)
+
+    def observe(self, stage, ms, **labels):
+        with self._lock:
+            self._samples[stage].append(ms)
+            self._count[stage] += 1
+            self._sum[stage] += ms
+        if log.isEnabledFor(logging.INFO):
+            log.info(json.dumps({"ts": round(time.time(), 3), "stage": stage, "ms": round(ms, 2), **labels},
+                                ensure_ascii=False))
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - t0) * 1000, **labels)
+
+    def add_usage(self, kind, usage):
+        """
+        resp.usage（input_tokens / output_tokens）を積算する。usage が無ければ何もしない。
+        cached は input のうち API 側のプロンプトキャッシュに当たった分（内数）。
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "input_tokens_details", None)
+        cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", 0)
+        tokens = {"input": getattr(usage, "input_tokens", 0) or 0, "output": getattr(usage, "output_tokens", 0) or 0,
+                  "cached": cached or 0}
+        with self._lock:
+            for direction, n in tokens.items():
+                self._tokens[(kind, direction)] += n
+        if log.isEnabledFor(logging.INFO):
+            log.info(json.dumps({"ts": round(time.time(), 3), "tokens": kind, **tokens}))
+
+    def summary(self):
+        """stage ごとの件数・p50・p95・直近値（ms）"""
+        with self._lock:
+            snap = {k: sorted(v) for k, v in self._samples.items()}
+            counts = dict(self._count)
+        out = []
+        for stage, xs in sorted(snap.items()):
+            if not xs:
+                continue
+            out.append({
+                "stage": stage,
+                "count": counts[stage],
+                "p50_ms": _quantile(xs, 0.5),
+                "p95_ms": _quantile(xs, 0.95),
+                "last_ms": self._samples[stage][-1],
+            })
+        return out
+
+    def tokens(self):
+        with self._lock:
+            return dict(self._tokens)
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP pe_stage_duration_ms Stage duration in milliseconds (rolling window quantiles).",
+            "# TYPE pe_stage_duration_ms summary",
+        ]
+        with self._lock:
+            snap = {k: sorted(v) for k, v in self._samples.items()}
+            counts, sums, tokens = dict(self._count), dict(self._sum), dict(self._tokens)
+        for stage, xs in sorted(snap.items()):
+            for q in QUANTILES:
+                if xs:
+                    lines.append(f'pe_stage_duration_ms{{stage="{stage}",quantile="{q}"}} {_quantile(xs, q):.3f}')
+            lines.append(f'pe_stage_duration_ms_sum{{stage="{stage}"}} {sums[stage]:.3f}')
+            lines.append(f'pe_stage_duration_ms_count{{stage="{stage}"}} {counts[stage]}')
+        lines += [
+            "# HELP pe_api_tokens_total Tokens reported by the model API.",
+            "# TYPE pe_api_tokens_total counter",
+        ]
+        for (kind, direction), n in sorted(tokens.items()):
+            lines.append(f'pe_api_tokens_total{{call="{kind}",direction="{direction}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        node_exporter の textfile collector 向け（書きかけを読まれないよう置き換えで書く）。
+        一時ファイルは書き込みごとに別名なので、複数のスレッド・プロセスから同時に呼んでもよい（最後の1つが残る）。
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".metrics-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.chmod(tmp, 0o644)  # mkstemp は 0600 で作るので、collector から読めるようにする
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def _quantile(sorted_xs, q):
+    idx = min(len(sorted_xs) - 1, max(0, int(round(q * (len(sorted_xs) - 1)))))
+    return sorted_xs[idx]
+
+
+def enable_json_log(stream=None):
+    """計測の JSON 1行ログを stream（既定は stderr）へ出す（何度呼んでも1つだけ）"""
+    if any(isinstance(h, logging.StreamHandler) for h in log.handlers):
+        return
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+METRICS = Metrics()
+timer = METRICS.timer
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+from .core import AT_ALERT_THRESHOLD, infer_profile, pick_best_time_run
+from .engine import alert_mask, compute_batch
+
+# ==========================================
+# クラス・学年全体の順位・パーセンタイル（列指向のインデックス）
+# ==========================================
+# 記録ごとの指標を列（numpy 配列）で持ち、種目グループ（性別×時間走の分数）ごとに
+# 指標の昇順に並べた値と行番号を作っておく。パーセンタイル・順位・ヒストグラムは
+# searchsorted（二分探索）だけで答え、上位N件は並べ済みの配列を切り出すだけ。
+# 失速アラートのしきい値を変えたときは、1本ごとのラップ差を比べ直すだけで全員分を付け直す。
+
+RANK_METRICS = {  # 指標 → 大きいほど良いか
+    "time_run_dist_m": True,
+    "vo2max": True,
+    "target_time_pred_sec": False,
+}
+RANK_METRIC_LABELS = {
+    "time_run_dist_m": "時間走の距離(m)",
+    "vo2max": "推定VO2Max",
+    "target_time_pred_sec": "予測タイム(秒)",
+}
+# 種目（12分/15分・2100m/3000m）で意味が変わる指標。グループが2つ以上あるときは「全体」で混ぜて並べない
+EVENT_METRICS = ("time_run_dist_m", "target_time_pred_sec")
+ALL = "全体"
+
+
+def group_label(profile):
+    """種目グループ名（例: 男子15分）"""
+    return f"{'男子' if profile['gender'] == 'male' else '女子'}{profile['time_min']}分"
+
+
+class ClassIndex:
+    """
+    records と、それぞれの infer_profile の結果から作る。labels は表示用の名前（選手名など）。
+    指標が 0（未取得）の記録は、その指標の順位・パーセンタイルには入れない。
+    種目が混ざるとき、EVENT_METRICS は ALL では0件扱い（順位・分布は種目グループごとに見る）。
+    """
+
+    def __init__(self, records, profiles, labels=None):
+        n = len(records)
+        out = compute_batch(records, profiles)
+        self.labels = list(labels) if labels is not None else [str(i + 1) for i in range(n)]
+        self.columns = {m: out["records"][m].to_numpy() for m in RANK_METRICS}
+        self.groups = np.array([group_label(p) for p in profiles], dtype=object)
+        self.group_names = sorted(set(self.groups.tolist()))
+
+        # 1本ごとのラップ差（record 順に並んでいる）と、記録ごとの最大差
+        laps = out["laps"]
+        self._lap_rid = laps["record"].to_numpy()
+        self._diffs = laps["diff_sec"].to_numpy()
+        diffs = np.nan_to_num(self._diffs, nan=-np.inf)
+        counts = np.bincount(self._lap_rid, minlength=n)
+        has_laps = counts > 0
+        self._max_diff = np.full(n, -np.inf)
+        if has_laps.any():
+            starts = np.cumsum(counts) - counts
+            self._max_diff[has_laps] = np.maximum.reduceat(diffs, starts[has_laps])
+
+        self._rows = {ALL: np.arange(n)}
+        self._rows.update({g: np.nonzero(self.groups == g)[0] for g in self.group_names})
+        self._sorted = {}
+        for g, rows in self._rows.items():
+            for m, col in self.columns.items():
+                rows_m = rows if self.comparable(m, g) else rows[:0]
+                rows_v = rows_m[col[rows_m] > 0]
+                order = np.argsort(col[rows_v], kind="stable")
+                self._sorted[g, m] = (col[rows_v][order], rows_v[order])
+            # アラートが1つでもある ⇔ 最大差 ≥ しきい値 なので、最大差を並べておけば割合は二分探索で出る
+            self._sorted[g, "max_diff"] = np.sort(self._max_diff[rows])
+
+    @classmethod
+    def from_sheets(cls, named_sheets):
+        """[(名前, Sheet), ...] から1人1件（ベスト回）で作る。records が空の用紙は飛ばす"""
+        records, profiles, labels = [], [], []
+        for name, sheet in named_sheets:
+            best = pick_best_time_run(sheet.records)
+            if best is None:
+                continue
+            records.append(best)
+            profiles.append(infer_profile(best, sheet.sheet_hints))
+            labels.append(name)
+        return cls(records, profiles, labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def comparable(self, metric, group=ALL):
+        """group の中で metric を並べてよいか（ALL で種目が混ざるときの EVENT_METRICS は不可）"""
+        return group != ALL or metric not in EVENT_METRICS or len(self.group_names) <= 1
+
+    def metrics(self, group=ALL):
+        """group で順位・分布を出せる指標"""
+        return [m for m in RANK_METRICS if self.comparable(m, group)]
+
+    def count(self, metric, group=ALL):
+        """順位に入っている件数（指標が取れている記録の数）"""
+        return len(self._sorted[group, metric][0])
+
+    def percentile(self, metric, value, group=ALL):
+        """
+        value がグループ内で何パーセンタイルか（0〜100、100 に近いほど良い。同じ値は半分ずつ数える）。
+        value は配列でもよい。グループに1件も無ければ None。
+        """
+        vals, _ = self._sorted[group, metric]
+        if not len(vals):
+            return None
+        lo = np.searchsorted(vals, value, "left")
+        hi = np.searchsorted(vals, value, "right")
+        worse = lo if RANK_METRICS[metric] else len(vals) - hi
+        return 100.0 * (worse + (hi - lo) / 2) / len(vals)
+
+    def rank(self, metric, value, group=ALL):
+        """何位か（1始まり、同じ値は同順位）。グループに1件も無ければ None"""
+        vals, _ = self._sorted[group, metric]
+        if not len(vals):
+            return None
+        if RANK_METRICS[metric]:
+            return int(len(vals) - np.searchsorted(vals, value, "right")) + 1
+        return int(np.searchsorted(vals, value, "left")) + 1
+
+    def top(self, metric, n=10, group=ALL):
+        """上位 n 件の [(名前, 値), ...]（良い順）"""
+        vals, rows = self._sorted[group, metric]
+        if RANK_METRICS[metric]:
+            vals, rows = vals[::-1], rows[::-1]
+        return [(self.labels[r], float(v)) for r, v in zip(rows[:n].tolist(), vals[:n].tolist())]
+
+    def histogram(self, metric, bins=10, group=ALL):
+        """(件数, 区切り)。np.histogram と同じ数え方（最後の区間だけ右端を含む）"""
+        vals, _ = self._sorted[group, metric]
+        if not len(vals):
+            return np.zeros(bins, dtype=np.int64), np.linspace(0.0, 1.0, bins + 1)
+        lo, hi = float(vals[0]), float(vals[-1])
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        edges = np.linspace(lo, hi, bins + 1)
+        pos = np.searchsorted(vals, edges, "left")
+        pos[-1] = len(vals)
+        return np.diff(pos), edges
+
+    def alert_counts(self, threshold=AT_ALERT_THRESHOLD):
+        """しきい値を変えて全員分の失速アラート数を付け直す（記録の順）"""
+        return np.bincount(self._lap_rid[alert_mask(self._diffs, threshold)], minlength=len(self))
+
+    def alerted_share(self, threshold=AT_ALERT_THRESHOLD, group=ALL):
+        """失速アラートが1つ以上ある記録の割合（0〜1）"""
+        max_diff = self._sorted[group, "max_diff"]
+        if not len(max_diff):
+            return 0.0
+        return float(len(max_diff) - np.searchsorted(max_diff, threshold, "left")) / len(max_diff)
+
+    def table(self, threshold=AT_ALERT_THRESHOLD, group=ALL):
+        """1件1行の一覧（指標・種目グループ内のパーセンタイル・指定しきい値でのアラート数）"""
+        rows = self._rows[group]
+        df = pd.DataFrame({"名前": np.asarray(self.labels, dtype=object)[rows], "種目": self.groups[rows]})
+        for m, col in self.columns.items():
+            df[RANK_METRIC_LABELS[m]] = col[rows]
+            pct = np.full(len(rows), np.nan)
+            for g in self.group_names:
+                in_g = (self.groups[rows] == g) & (col[rows] > 0)
+                if in_g.any():
+                    pct[in_g] = self.percentile(m, col[rows][in_g], g)
+            df[RANK_METRIC_LABELS[m] + " pct"] = pct.round(1)
+        df["失速アラート数"] = self.alert_counts(threshold)[rows]
+        return df
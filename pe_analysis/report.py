@@ -0,0 +1,389 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+
+from .cache import cache_key
+from .core import LAP_M, infer_profile, record_metrics, sec_to_mmss
+from .metrics import METRICS, timer
+
+REPORT_MODEL = "gpt-4.1-mini"
+REPORT_TEMPERATURE = 0.4
+REPORT_MODES = ("local", "local_only", "llm")  # ①〜③ローカル＋④AI / すべてローカル（④なし）/ 全文AI
+REPORT_SECTIONS = (
+    "① 科学的ポテンシャル診断 (RESULT / Best)",
+    "② ラップ推移 & 失速地点（ATサイン）",
+    "③ 目標ラップ表 (Pace Guide)",
+    "④ COACH'S EYE (専門的アドバイス)",
+)
+
+# ==========================================
+# 文章レポート（画像なし）
+# ==========================================
+def report_facts(name, profile, rec, all_records):
+    """レポートに載せる数値と、その文章化（プロンプトでもローカル版でも同じものを使う）"""
+    # ベスト/平均/ワースト（時間走距離）
+    dists = [int(r.time_run_dist_m) for r in all_records]
+    dists = [d for d in dists if d > 0]
+    best_dist = max(dists) if dists else int(rec.time_run_dist_m)
+    worst_dist = min(dists) if dists else int(rec.time_run_dist_m)
+    avg_dist = int(round(sum(dists) / len(dists))) if dists else int(rec.time_run_dist_m)
+
+    m = record_metrics(rec, profile)
+    pace_guide = m["pace_guide"]
+    alerts = m["alerts"]
+
+    pace_guide_text = "\n".join([f"- {r['プラン']}: {r['想定タイム']} / {r['目標ラップ']}" for r in pace_guide]) if pace_guide else "- 作成できませんでした"
+
+    alert_lines = "\n".join(
+        [f"- {idx}本目（{idx*LAP_M}m）: {prev:.1f}→{cur:.1f}（+{diff:.1f}秒）" for idx, prev, cur, diff in alerts]
+    ) if alerts else "- 目立った失速アラートなし"
+
+    dist_race_m = rec.distance_race_m
+    dist_race_time_mmss = rec.distance_race_time_mmss
+
+    if dist_race_m in (3000, 2100) and dist_race_time_mmss:
+        dist_race = f"{dist_race_m}m {dist_race_time_mmss}"
+        dist_race_line = f"- 距離走の記録：{dist_race_m}m **{dist_race_time_mmss}**（用紙記載）"
+    else:
+        dist_race = ""
+        dist_race_line = "- 距離走の記録：用紙から読み取れませんでした"
+
+    return {
+        "name": name,
+        "profile": profile,
+        "attempt": rec.attempt,
+        "time_min": profile["time_min"],
+        "target_m": profile["target_m"],
+        "gender_jp": "男子" if profile["gender"] == "male" else "女子",
+        "best_dist": best_dist,
+        "avg_dist": avg_dist,
+        "worst_dist": worst_dist,
+        "metrics": m,
+        "pace_guide_text": pace_guide_text,
+        "alert_lines": alert_lines,
+        "dist_race": dist_race,
+        "dist_race_line": dist_race_line,
+    }
+
+# ==========================================
+# プロンプト（固定の前置き＋1人分の短いデータ）
+# ==========================================
+# 指示・出力形式・用語のルールは毎回バイト単位で同じ前置きにまとめ、選手ごとの数値は最後に1行1項目で付ける。
+# API 側のプロンプトキャッシュは先頭一致（1024トークン以上から）なので、前置きを指示で伸ばしたときも
+# 選手ごとの部分だけが毎回の入力になる。数値は丸めてカンマ区切りにし、1件ごとの部分を短く保つ。
+# 前置きには import 時に決まる値しか入れないこと（選手ごとの値が混ざると先頭が一致しなくなる）。
+REPORT_PROMPT_PREFIX = f"""あなたは陸上長距離のトップコーチ兼データ分析官です。
+最後の【データ】の数値だけを根拠に、指定の①〜④構成で「文章レポート」を作成してください。
+
+【絶対条件】
+- 日本語（中学生に伝わる）
+- 必ず数字を根拠として入れる
+- 推定は「推定」と明記（VO2Max、換算参考記録）
+- 見出し①〜④をそのまま使う
+- ②は失速地点を必ず言及（何本目/何m地点）
+- ③は維持/目標/突破の3段階（{LAP_M}mラップ）
+- ④は熱く前向きに140文字程度
+- 距離走の記録が用紙にあれば必ず拾って言及する
+- 「何を評価しているか」が分かるように、冒頭で評価軸を一言で示す
+- 時間走は3回（①②③）の結果がある前提で、**ベスト（最大距離）**も必ず示す
+
+【用語とデータの書き方】
+- VO2Max＝心肺のエンジンの大きさ（基礎体力）、AT＝それをレースで使い切る力（粘り）。最初の失速地点は「ATのサイン（目安）」
+- 1行1項目。通過s・ラップs は{LAP_M}mごとの通過タイムとその差分（秒）。失速は「何本目(地点) 前の本→その本 +差」
+
+【出力フォーマット（この順番で必ず）】
+{chr(10).join(REPORT_SECTIONS)}
+
+【データ】
+"""
+
+COACH_PROMPT_MARKER = f"「{REPORT_SECTIONS[3]}」の本文だけ"  # ④だけのプロンプトの目印（standin もこれで見分ける）
+COACH_PROMPT_PREFIX = f"""あなたは陸上長距離のトップコーチです。最後の【データ】の数値を根拠に、中学生の選手へ向けた
+{COACH_PROMPT_MARKER}を日本語で書いてください（見出し・前置き不要、熱く前向きに140文字程度、数字を必ず入れる）。
+
+【データ】
+"""
+
+def fmt_num(x):
+    """プロンプト用の短い数値（小数は1桁まで、整数なら .0 を付けない）"""
+    return f"{round(float(x), 1):g}"
+
+def prompt_data(f, detail=True):
+    """
+    1人分の数値（REPORT_PROMPT_PREFIX の「データの書き方」どおり）。detail=False は④用の要点だけ
+    （種目の判定理由・距離走・通過/ラップ・換算記録を省く）。
+    """
+    m = f["metrics"]
+    alerts = "; ".join(f"{i}本目({i * LAP_M}m) {fmt_num(prev)}→{fmt_num(cur)} +{fmt_num(diff)}"
+                       for i, prev, cur, diff in m["alerts"])
+    guide = "; ".join(f"{g['プラン']} {g['想定タイム']} {g['目標ラップ']}" for g in m["pace_guide"])
+    lines = [f"選手: {f['name']}",
+             f"種目(推定): {f['gender_jp']} {f['time_min']}分間走 / {f['target_m']}m"]
+    if detail:
+        lines.append(f"判定理由: {f['profile']['reason']}")
+    lines.append(f"時間走m: ベスト {f['best_dist']} / 平均 {f['avg_dist']} / ワースト {f['worst_dist']}"
+                 f" / 今回 {int(m['time_run_dist_m'])}（{f['attempt']}回目）")
+    if detail:
+        lines += [
+            f"距離走: {f['dist_race'] or '読み取れず'}",
+            f"通過s: {','.join(fmt_num(x) for x in m['splits_sec']) or 'なし'}",
+            f"ラップs: {','.join(fmt_num(x) for x in m['laps_sec']) or 'なし'}",
+        ]
+    lines += [f"平均ペース: {sec_to_mmss(m['pace_sec_km'])}/km", f"VO2Max(推定): {fmt_num(m['vo2max'])}"]
+    if detail:
+        lines.append(f"換算(推定): {f['target_m']}m {sec_to_mmss(m['target_time_pred_sec'])}")
+    lines += [f"失速(+{m['alert_threshold']:g}秒以上): {alerts or 'なし'}", f"目標ラップ: {guide or '作成できず'}"]
+    return "\n".join(lines) + "\n"
+
+def build_report_prompt(name, profile, rec, all_records):
+    """全文AI用（固定の前置き＋データ）"""
+    return REPORT_PROMPT_PREFIX + prompt_data(report_facts(name, profile, rec, all_records))
+
+# ==========================================
+# ローカル版レポート（①〜③はテンプレートで即時、④だけモデル or 省略）
+# ==========================================
+
+def render_local_report(f):
+    """report_facts の結果から①〜③を組み立てる（モデル呼び出しなし）"""
+    m = f["metrics"]
+    dist = int(m["time_run_dist_m"])
+    laps = m["laps_sec"]
+
+    lines = [REPORT_SECTIONS[0],
+             f"評価軸：{f['time_min']}分間走で走れた距離と、そこから推定した持久力（VO2Max）。",
+             f"- ベスト距離：**{f['best_dist']}m**（平均 {f['avg_dist']}m / ワースト {f['worst_dist']}m）"]
+    if dist:
+        lines += [
+            f"- 今回（{f['attempt']}回目）：{dist}m、平均ペース {sec_to_mmss(m['pace_sec_km'])} /km",
+            f"- 推定VO2Max：{m['vo2max']} ml/kg/min（推定：時間走の平均速度から）",
+            f"- {f['target_m']}m 換算参考記録：{sec_to_mmss(m['target_time_pred_sec'])}（推定：同じ速さで走った場合）",
+        ]
+    else:
+        lines.append(f"- 今回（{f['attempt']}回目）：時間走の距離が読み取れませんでした")
+    lines += [f["dist_race_line"], ""]
+
+    lines.append(REPORT_SECTIONS[1])
+    if laps:
+        fastest = min(range(len(laps)), key=laps.__getitem__)
+        slowest = max(range(len(laps)), key=laps.__getitem__)
+        half = len(laps) // 2
+        lines.append("- ラップ（秒）：" + " → ".join(f"{x:.0f}" for x in laps))
+        lines.append(f"- 最速は{fastest + 1}本目（{laps[fastest]:.0f}秒）、最も遅いのは{slowest + 1}本目（{laps[slowest]:.0f}秒）")
+        if half:
+            first, second = sum(laps[:half]) / half, sum(laps[half:]) / (len(laps) - half)
+            lines.append(f"- 前半平均 {first:.1f}秒 / 後半平均 {second:.1f}秒（{second - first:+.1f}秒）")
+        if m["alerts"]:
+            idx = m["alerts"][0][0]
+            lines.append(f"- 最初の失速（ATサインの目安）は {idx}本目・{idx * LAP_M}m地点。前の本より+{m['alert_threshold']:g}秒以上遅くなった本：")
+        lines.append(f["alert_lines"])
+    else:
+        lines.append("- 通過タイムが2本以上読み取れなかったため、ラップは計算できませんでした")
+    lines.append("")
+
+    lines += [REPORT_SECTIONS[2], f"{f['target_m']}m を {LAP_M}m ごとのラップで刻む目安：", f["pace_guide_text"]]
+    return "\n".join(lines)
+
+def build_coach_prompt(f):
+    """④だけを書かせる短いプロンプト（固定の前置き＋要点だけのデータ。出力は140文字程度）"""
+    return COACH_PROMPT_PREFIX + prompt_data(f, detail=False)
+
+def local_report(name, profile, rec, all_records):
+    """(①〜③の本文, ④用プロンプト)"""
+    with timer("report_local"):
+        f = report_facts(name, profile, rec, all_records)
+        return render_local_report(f), build_coach_prompt(f)
+
+def report_request(name, profile, rec, all_records, mode="local"):
+    """
+    (prefix, prompt)。表示するのは prefix の後ろに生成結果をつないだもの。
+    prompt が None なら生成は要らない（local_only：prefix が全文）。
+    """
+    if mode == "llm":
+        return "", build_report_prompt(name, profile, rec, all_records)
+    # ①〜③は手元の数値から即時に作る。④だけモデルに書かせる（local_only なら省略）
+    body, coach_prompt = local_report(name, profile, rec, all_records)
+    if mode == "local_only":
+        return body, None
+    return f"{body}\n\n{REPORT_SECTIONS[3]}\n", coach_prompt
+
+def sheet_report_requests(name, sheet_hints, records, mode="local"):
+    """1枚の全部の回の [(attempt, prefix, prompt), ...]（種目推定は回ごと）"""
+    return [(rec.attempt, *report_request(name, infer_profile(rec, sheet_hints), rec, records, mode))
+            for rec in records]
+
+def _field(obj, name):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+def response_problem(resp):
+    """
+    応答（SDK のオブジェクトでもバッチ出力の dict でもよい）が正常に終わっていなければその理由。
+    failed / incomplete のとき文字列、問題なければ None。
+    """
+    status = _field(resp, "status") or "completed"
+    if status == "failed":
+        return f"生成に失敗しました（{_field(_field(resp, 'error') or {}, 'message') or status}）"
+    if status == "incomplete":
+        return f"途中で打ち切られました（{_field(_field(resp, 'incomplete_details') or {}, 'reason') or status}）"
+    return None
+
+def complete_text_report(client, prompt):
+    """1件分をストリーミングなしで生成する（失敗・打ち切り・空の応答は例外。キャッシュに入れさせない）"""
+    with timer("report_api"):
+        resp = client.responses.create(
+            model=REPORT_MODEL,
+            input=prompt,
+            temperature=REPORT_TEMPERATURE,
+        )
+    METRICS.add_usage("report", getattr(resp, "usage", None))
+    problem = response_problem(resp)
+    if problem:
+        raise RuntimeError(f"レポート: {problem}")
+    text = resp.output_text.strip()
+    if not text:
+        raise RuntimeError("レポート: 空の応答が返りました")
+    return text
+
+def generate_text_report(client, name, profile, rec, all_records):
+    with timer("report_prompt"):
+        prompt = build_report_prompt(name, profile, rec, all_records)
+    return complete_text_report(client, prompt)
+
+# ==========================================
+# ストリーミング生成（届いた分から表示）＋完成品のキャッシュ
+# ==========================================
+def report_cache_key(prompt):
+    # プロンプトが同じなら同じレポートとみなす（モデル・温度も含める）
+    return cache_key(prompt.encode("utf-8"), model=REPORT_MODEL, temperature=REPORT_TEMPERATURE)
+
+def stream_text_report(client, prompt):
+    """
+    文章レポートを少しずつ yield する。最初の文字が届くまでを report_ttft、
+    全体を report_api として記録する。
+    response.failed / response.incomplete / error が来たとき、completed の前に途切れたときは例外
+    （途中までの本文を完成品として扱わせない）。
+    """
+    t0 = time.perf_counter()
+    first, completed = True, False
+    stream = client.responses.create(
+        model=REPORT_MODEL,
+        input=prompt,
+        temperature=REPORT_TEMPERATURE,
+        stream=True,
+    )
+    for event in stream:
+        if event.type == "response.output_text.delta":
+            if first:
+                METRICS.observe("report_ttft", (time.perf_counter() - t0) * 1000)
+                first = False
+            yield event.delta
+        elif event.type == "response.completed":
+            METRICS.add_usage("report", getattr(event.response, "usage", None))
+            completed = True
+        elif event.type in ("response.failed", "response.incomplete"):
+            METRICS.add_usage("report", getattr(event.response, "usage", None))
+            raise RuntimeError(f"レポート: {response_problem(event.response) or event.type}")
+        elif event.type == "error":
+            raise RuntimeError(f"レポート: エラー（{getattr(event, 'message', None) or getattr(event, 'code', None)}）")
+    METRICS.observe("report_api", (time.perf_counter() - t0) * 1000, stream=True)
+    if not completed:
+        raise RuntimeError("レポート: 完了の前に応答が途切れました")
+
+# ==========================================
+# まとめて生成（全部の回・クラス全員分）
+# ==========================================
+REPORT_WORKERS = 4  # 同時に生成するレポート数の上限
+
+def iter_reports(client, prompts, cache=None, workers=REPORT_WORKERS, call=None):
+    """
+    prompts を同時に最大 workers 件ずつ生成し、終わった順に (index, text, cached, err) を yield する。
+    キャッシュにある分（プロンプトが変わっていないもの）は API を呼ばずに先に返す。
+    1件の失敗は他を止めない（その件だけ text が None、err にエラー内容。キャッシュもしない）。
+    call: API 呼び出しを包む関数（バックオフ等）。call(fn) の形で呼ぶ。
+    """
+    call = call or (lambda fn: fn())
+    todo = []
+    for i, prompt in enumerate(prompts):
+        text = cache.get(report_cache_key(prompt)) if cache is not None else None
+        if text is not None:
+            yield i, text, True, None
+        else:
+            todo.append(i)
+    if not todo:
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(call, lambda p=prompts[i]: complete_text_report(client, p)): i for i in todo}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                text = fut.result()
+            except Exception as e:
+                yield i, None, False, f"{type(e).__name__}: {e}"
+                continue
+            if cache is not None:
+                cache.put(report_cache_key(prompts[i]), text)
+            yield i, text, False, None
+
+# 大人数はバッチ API（非同期・最大24時間・単価が安い）へ。JSONL 1行が1件で、custom_id で結果を対応づける
+REPORT_BATCH_WINDOW = "24h"
+REPORT_BATCH_FINAL = ("completed", "expired", "cancelled", "failed")  # これ以上待っても変わらない状態
+
+def report_batch_lines(prompts):
+    """バッチ API の入力ファイル（JSONL）の中身"""
+    return "".join(
+        json.dumps({
+            "custom_id": f"report-{i}",
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": {"model": REPORT_MODEL, "input": prompt, "temperature": REPORT_TEMPERATURE},
+        }, ensure_ascii=False) + "\n"
+        for i, prompt in enumerate(prompts)
+    )
+
+def submit_report_batch(client, prompts):
+    """バッチを投入して batch id を返す（結果は collect_report_batch で後から取りに行く）"""
+    data = report_batch_lines(prompts).encode("utf-8")
+    upload = client.files.create(file=("reports.jsonl", data, "application/jsonl"), purpose="batch")
+    batch = client.batches.create(input_file_id=upload.id, endpoint="/v1/responses", completion_window=REPORT_BATCH_WINDOW)
+    return batch.id
+
+def _batch_index(row):
+    return int(row["custom_id"].rsplit("-", 1)[1])
+
+def _batch_rows(client, file_id):
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+def _output_text(body):
+    return "".join(part.get("text", "")
+                   for item in body.get("output", []) if item.get("type") == "message"
+                   for part in item.get("content", []) if part.get("type") == "output_text").strip()
+
+def collect_report_batch(client, batch_id):
+    """
+    (status, {index: text}, {index: エラー内容})。まだ終わっていなければ (status, None, None)。
+    終わった状態（REPORT_BATCH_FINAL）なら出力ファイルにある分を返す。expired・cancelled は途中まで、
+    failed（入力の検証で落ちた等）は空。結果に無い件は呼び出し側で1件ずつ作り直す。
+    """
+    batch = client.batches.retrieve(batch_id)
+    if batch.status not in REPORT_BATCH_FINAL:
+        return batch.status, None, None
+    results, errors = {}, {}
+    for row in _batch_rows(client, batch.output_file_id) + _batch_rows(client, batch.error_file_id):
+        resp = row.get("response") or {}
+        body = resp.get("body") or {}
+        if resp.get("status_code") == 200:
+            usage = body.get("usage")
+            METRICS.add_usage("report_batch", SimpleNamespace(**usage) if usage else None)
+            # 200 でも打ち切り（incomplete）や空の本文は結果にしない（作り直しの対象にする）
+            problem = response_problem(body)
+            text = _output_text(body)
+            if problem or not text:
+                errors[_batch_index(row)] = problem or "空の応答"
+            else:
+                results[_batch_index(row)] = text
+        else:
+            error = row.get("error") or body.get("error") or {}
+            errors[_batch_index(row)] = error.get("message") or error.get("code") or f"status {resp.get('status_code')}"
+    return batch.status, results, errors
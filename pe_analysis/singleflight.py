@@ -0,0 +1,67 @@
+import threading
+import time
+
+from .metrics import METRICS
+
+# ==========================================
+# 同じ仕事の同時実行をまとめる（single-flight）
+# ==========================================
+# 同じ key（画像ハッシュ＋設定、レポートのプロンプトハッシュ等）の呼び出しが実行中なら、
+# 後から来た側は API を呼ばずに、先に走っている1回の結果を待って受け取る。
+# 先行側が Streamlit の再実行などで中断された（Exception 以外で抜けた）ときは、待っていた側が引き継ぐ。
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "abandoned")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class SingleFlight:
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """fn() の結果と、他の呼び出しの結果を共有したかどうか (result, shared) を返す"""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                return self._lead(key, call, fn), False
+
+            t0 = time.perf_counter()
+            call.done.wait()
+            if call.abandoned:
+                continue
+            METRICS.observe(f"{self.name}_wait", (time.perf_counter() - t0) * 1000, shared=True)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+    def _lead(self, key, call, fn):
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,341 @@
+import base64
+import email
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .core import LAP_M, sec_to_mmss
+from .report import COACH_PROMPT_MARKER, REPORT_SECTIONS
+
+# ==========================================
+# Responses API の代役サーバ（オフライン開発・負荷試験用）
+# ==========================================
+#   python -m pe_analysis standin --port 8765 --latency-ms 800 --fail-rate 0.05
+# POST /v1/responses だけを実装する。画像つきなら抽出、画像なしならレポートとして、
+# それらしい応答を決まった乱数で返す（同じ順で同じリクエストを送れば同じ結果・同じ遅延）。
+# 抽出の中身は画像ごとに決まるので、1枚ずつでも まとめて抽出（images）でも同じ画像なら同じ結果になる。
+# バッチ API（POST /v1/files・/v1/batches、GET /v1/batches/{id}・/v1/files/{id}/content）も最小限だけ持つ。
+# バッチは投入から report_latency_ms 経つと完了する。
+
+
+class StandinConfig:
+    def __init__(self, latency_ms=800.0, jitter_ms=200.0, report_latency_ms=1500.0, fail_rate=0.0,
+                 fail_statuses=(429, 500, 503), stream_chunk_chars=8, stream_chunk_ms=15.0, pack_sheet_ms=250.0,
+                 seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.report_latency_ms = report_latency_ms
+        self.fail_rate = fail_rate
+        self.fail_statuses = tuple(fail_statuses)
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chunk_ms = stream_chunk_ms
+        self.pack_sheet_ms = pack_sheet_ms  # まとめて抽出で1枚増えるごとに足す遅延（出力が長くなる分）
+        self.seed = seed
+
+
+def _images(body):
+    items = body.get("input")
+    if not isinstance(items, list):
+        return []
+    return [part.get("image_url", "")
+            for item in items if isinstance(item, dict)
+            for part in item.get("content", [])
+            if isinstance(part, dict) and part.get("type") == "input_image"]
+
+
+def _image_tokens(url):
+    """画像1枚の入力トークン（high detail の概算：2048px 四方→短辺 768px に収めて 512px タイル数を数える）"""
+    try:
+        from PIL import Image
+
+        w, h = Image.open(BytesIO(base64.b64decode(url.split(",", 1)[1]))).size
+    except Exception:
+        return 765
+    scale = min(1.0, 2048 / max(w, h))
+    w, h = w * scale, h * scale
+    scale = min(1.0, 768 / min(w, h))
+    w, h = w * scale, h * scale
+    return 85 + 170 * (-(-int(w) // 512)) * (-(-int(h) // 512))
+
+
+def _pack_count(body, n_images):
+    """まとめて抽出なら用紙の枚数、1枚ずつなら None"""
+    fmt = (body.get("text") or {}).get("format") or {}
+    if fmt.get("name") != "record_sheets":
+        return None
+    for item in body.get("input") or []:
+        for part in item.get("content", []) if isinstance(item, dict) else []:
+            m = re.search(r"用紙は(\d+)枚", part.get("text", "") or "")
+            if m:
+                return int(m.group(1))
+    return n_images
+
+
+def _text_len(body):
+    items = body.get("input")
+    if isinstance(items, str):
+        return len(items)
+    n = 0
+    for item in items or []:
+        for part in item.get("content", []):
+            n += len(part.get("text", "") or "")
+    return n
+
+
+def fake_sheet(rng):
+    """それらしい記録用紙1枚分（妥当性チェックに通る値）"""
+    male = rng.random() < 0.5
+    time_min, race_m = (15, 3000) if male else (12, 2100)
+    records = []
+    for attempt in (1, 2, 3):
+        dist = rng.randint(230, 300) * time_min // 10 * 10
+        lap = LAP_M / (dist / (time_min * 60))
+        t, splits = 0.0, []
+        while t + lap <= time_min * 60 and len(splits) < 14:
+            t += lap * rng.uniform(0.95, 1.08)
+            splits.append(sec_to_mmss(t))
+        records.append({
+            "attempt": attempt,
+            "lap_m": LAP_M,
+            "splits_mmss": splits,
+            "time_run_dist_m": dist,
+            "distance_race_m": race_m,
+            "distance_race_time_mmss": sec_to_mmss(race_m / dist * time_min * 60 * rng.uniform(0.95, 1.02)),
+        })
+    return {"name": f"選手{rng.randint(1, 999)}", "sheet_hints": "男子 15分" if male else "女子 12分", "records": records}
+
+
+def fake_coach_eye(rng):
+    return "前半を抑えて後半に粘る力をつければ、まだまだ記録は伸びます！" + "一本一本のラップを大切に。" * rng.randint(1, 3)
+
+
+def fake_report(rng):
+    lines = [
+        REPORT_SECTIONS[0],
+        "評価軸：時間走のベスト距離と推定VO2Max。" + "安定した走りができています。" * rng.randint(2, 4),
+        REPORT_SECTIONS[1],
+        "中盤でラップが落ち始めています。" * rng.randint(2, 4),
+        REPORT_SECTIONS[2],
+        "維持・目標・突破の3段階で300mごとのラップを意識しましょう。",
+        REPORT_SECTIONS[3],
+        "前半を抑えて後半に粘る力をつければ、まだまだ記録は伸びます！",
+    ]
+    return "\n".join(lines)
+
+
+def response_json(text, input_tokens, model):
+    return {
+        "id": f"resp_{hashlib.sha1(text.encode('utf-8')).hexdigest()[:24]}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": model,
+        "output": [{
+            "type": "message",
+            "id": "msg_standin",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(text) // 2,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + len(text) // 2,
+        },
+    }
+
+
+def answer(body, seed, content_rng):
+    """リクエスト本文に対する (応答テキスト, 入力トークン)"""
+    images = _images(body)
+    if images:
+        n_sheets = _pack_count(body, len(images))
+        # 中身は画像ごとの乱数で決める（mosaic は1枚の画像の中の何枚目か）
+        seeds = [hashlib.sha256(url.encode("utf-8")).hexdigest() for url in images]
+        if n_sheets is not None and len(images) == 1 and n_sheets > 1:
+            seeds = [f"{seeds[0]}:{k}" for k in range(n_sheets)]
+        sheets = [fake_sheet(random.Random(f"{seed}:{d}")) for d in seeds]
+        payload = {"sheets": sheets} if n_sheets is not None else sheets[0]
+        return json.dumps(payload, ensure_ascii=False), _text_len(body) // 2 + sum(_image_tokens(url) for url in images)
+    prompt = body.get("input") if isinstance(body.get("input"), str) else ""
+    text = fake_coach_eye(content_rng) if COACH_PROMPT_MARKER in prompt else fake_report(content_rng)
+    return text, _text_len(body) // 2
+
+
+def run_batch(input_jsonl, seed):
+    """バッチ入力（JSONL）の全行に答えた出力（JSONL）"""
+    out = []
+    for line in input_jsonl.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        body = row.get("body", {})
+        digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+        text, input_tokens = answer(body, seed, random.Random(f"{seed}:{digest}"))
+        out.append(json.dumps({
+            "id": f"batch_req_{digest[:24]}",
+            "custom_id": row.get("custom_id"),
+            "response": {"status_code": 200, "request_id": digest[:16],
+                         "body": response_json(text, input_tokens, body.get("model", "standin"))},
+            "error": None,
+        }, ensure_ascii=False))
+    return ("\n".join(out) + "\n").encode("utf-8")
+
+
+def parse_multipart(content_type, data):
+    """multipart/form-data → {名前: (ファイル名, バイト列)}"""
+    msg = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + data)
+    return {part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+            for part in msg.get_payload()}
+
+
+def make_handler(config):
+    lock = threading.Lock()
+    attempts = {}
+    files = {}    # id → (ファイル名, バイト列)
+    batches = {}  # id → バッチの JSON
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _not_found(self):
+            return self._json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            m = re.search(r"/batches/([\w-]+)$", path)
+            if m and m.group(1) in batches:
+                return self._json(200, self._batch_status(m.group(1)))
+            m = re.search(r"/files/([\w-]+)/content$", path)
+            if m and m.group(1) in files:
+                data = files[m.group(1)][1]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return None
+            return self._not_found()
+
+        def _batch_status(self, batch_id):
+            with lock:
+                batch = batches[batch_id]
+                if batch["status"] != "completed" and time.time() - batch["created_at"] >= config.report_latency_ms / 1000:
+                    output = run_batch(files[batch["input_file_id"]][1], config.seed)
+                    file_id = f"file-{uuid.uuid4().hex[:24]}"
+                    files[file_id] = ("output.jsonl", output)
+                    n = output.count(b"\n")
+                    batch.update(status="completed", output_file_id=file_id, completed_at=int(time.time()),
+                                 request_counts={"total": n, "completed": n, "failed": 0})
+                return dict(batch)
+
+        def _post_file(self, data):
+            fields = parse_multipart(self.headers.get("Content-Type", ""), data)
+            filename, content = fields.get("file", ("upload.jsonl", b""))
+            purpose = (fields.get("purpose") or (None, b"batch"))[1].decode("utf-8")
+            file_id = f"file-{uuid.uuid4().hex[:24]}"
+            with lock:
+                files[file_id] = (filename, content)
+            return self._json(200, {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                                    "filename": filename, "purpose": purpose, "status": "processed"})
+
+        def _post_batch(self, body):
+            if body.get("input_file_id") not in files:
+                return self._not_found()
+            batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+            with lock:
+                batches[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": body.get("endpoint", "/v1/responses"),
+                    "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+                    "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                    "error_file_id": None, "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                }
+            return self._json(200, self._batch_status(batch_id))
+
+        def do_POST(self):
+            path = self.path.rstrip("/")
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if path.endswith("/files"):
+                return self._post_file(data)
+            if path.endswith("/batches"):
+                return self._post_batch(json.loads(data or b"{}"))
+            if not path.endswith("/responses"):
+                return self._not_found()
+            body = json.loads(data or b"{}")
+            stream = bool(body.pop("stream", False))
+            digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+            with lock:
+                n = attempts.get(digest, 0)
+                attempts[digest] = n + 1
+            rng = random.Random(f"{config.seed}:{digest}:{n}")
+            content_rng = random.Random(f"{config.seed}:{digest}")
+
+            images = _images(body)
+            is_extract = bool(images)
+            n_sheets = _pack_count(body, len(images)) if is_extract else None
+            base = config.latency_ms if is_extract else config.report_latency_ms
+            base += config.pack_sheet_ms * max(0, (n_sheets or 1) - 1)
+            time.sleep(max(0.0, base + rng.uniform(-config.jitter_ms, config.jitter_ms)) / 1000)
+
+            if rng.random() < config.fail_rate:
+                status = rng.choice(config.fail_statuses)
+                return self._json(status, {"error": {"message": f"standin injected {status}", "type": "server_error"}})
+
+            text, input_tokens = answer(body, config.seed, content_rng)
+            resp = response_json(text, input_tokens, body.get("model", "standin"))
+            if stream:
+                return self._stream(resp, text)
+            return self._json(200, resp)
+
+        def _json(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, resp, text):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            seq = 0
+
+            def send(event):
+                nonlocal seq
+                event["sequence_number"] = seq
+                seq += 1
+                self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            send({"type": "response.created", "response": {**resp, "status": "in_progress", "output": []}})
+            step = config.stream_chunk_chars
+            for i in range(0, len(text), step):
+                send({"type": "response.output_text.delta", "item_id": "msg_standin", "output_index": 0,
+                      "content_index": 0, "delta": text[i:i + step], "logprobs": []})
+                time.sleep(config.stream_chunk_ms / 1000)
+            send({"type": "response.completed", "response": resp})
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8765, config=None):
+    server = ThreadingHTTPServer((host, port), make_handler(config or StandinConfig()))
+    server.daemon_threads = True
+    return server
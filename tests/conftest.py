@@ -0,0 +1,23 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def standin_client():
+    """遅延なしの代役サーバ（空きポート）につないだクライアント"""
+    from pe_analysis.backends import make_backend
+    from pe_analysis.standin import StandinConfig, serve
+
+    server = serve("127.0.0.1", 0, StandinConfig(latency_ms=0, jitter_ms=0, report_latency_ms=0, stream_chunk_ms=0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield make_backend("standin", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,38 @@
+"""backends.RecordReplayBackend（同じリクエストを同時に記録しても壊れない）"""
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from pe_analysis.backends import RecordReplayBackend
+
+
+def test_concurrent_record_of_same_request(tmp_path):
+    inner = SimpleNamespace(responses=SimpleNamespace(
+        create=lambda **kw: SimpleNamespace(output_text="ok", usage=SimpleNamespace(input_tokens=3, output_tokens=1))))
+    recorder = RecordReplayBackend(tmp_path, inner=inner)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        outs = list(pool.map(lambda _: recorder.responses.create(model="m", input="same").output_text, range(200)))
+    assert outs == ["ok"] * 200
+    assert [p.suffix for p in tmp_path.iterdir()] == [".json"]  # 一時ファイルが残っていない
+    assert RecordReplayBackend(tmp_path).responses.create(model="m", input="same").output_text == "ok"
+
+
+def test_sdk_http_module_follows_the_sdk_base_class():
+    import json
+
+    from pe_analysis.backends import sdk_http_module
+
+    base = type("Client", (), {"__module__": "json.decoder"})
+    sdk = type("_DefaultHttpxClient", (base,), {"__module__": "openai._base_client"})
+    assert sdk_http_module(sdk) is json
+
+
+def test_without_sdk_retries_leaves_retrying_to_call_with_backoff(tmp_path):
+    from openai import OpenAI
+
+    from pe_analysis.backends import without_sdk_retries
+
+    client = OpenAI(api_key="x", base_url="http://127.0.0.1:9/v1")
+    assert client.max_retries == 2 and without_sdk_retries(client).max_retries == 0
+    recorder = without_sdk_retries(RecordReplayBackend(tmp_path, inner=client))
+    assert recorder.inner.max_retries == 0
+    assert client.max_retries == 2  # 元のクライアント（ストリーミング等）はそのまま
@@ -0,0 +1,78 @@
+"""cache.ExtractionCache（メモリは LRU、SQLite は期限と件数で削除、どちらの段も期限切れは返さない）と cache_key"""
+from types import SimpleNamespace
+
+import pytest
+
+from pe_analysis.cache import ExtractionCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """cache モジュールの time.time() を手で進める時計にする"""
+    now = [1000.0]
+    monkeypatch.setattr("pe_analysis.cache.time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_cache_key_changes_with_bytes_and_settings():
+    base = cache_key(b"img", max_width=768, prompt_version=1)
+    assert cache_key(b"img", prompt_version=1, max_width=768) == base  # 引数の順は関係ない
+    assert cache_key(b"img", max_width=1024, prompt_version=1) != base
+    assert cache_key(b"img", max_width=768, prompt_version=2) != base
+    assert cache_key(b"img", max_width=768) != base
+    assert cache_key(b"img2", max_width=768, prompt_version=1) != base
+
+
+def test_memory_lru_drops_least_recently_used():
+    cache = ExtractionCache(max_items=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a を新しくする
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_memory_entries_expire(clock):
+    cache = ExtractionCache(max_age_sec=10)
+    cache.put("a", 1)
+    clock[0] += 10
+    assert cache.get("a") == 1
+    clock[0] += 1
+    assert cache.get("a") is None
+
+
+def test_memory_copy_of_disk_entry_keeps_its_creation_time(clock, tmp_path):
+    db = tmp_path / "cache.db"
+    ExtractionCache(db_path=db, max_age_sec=10).put("a", {"x": 1})
+    clock[0] += 8
+    cache = ExtractionCache(db_path=db, max_age_sec=10)
+    assert cache.get("a") == {"x": 1}  # ディスクからメモリへ
+    clock[0] += 3
+    assert cache.get("a") is None
+
+
+def test_disk_entries_expire_and_are_deleted(clock, tmp_path):
+    db = tmp_path / "cache.db"
+    cache = ExtractionCache(max_items=0, db_path=db, max_age_sec=10)
+    cache.put("old", 1)
+    clock[0] += 5
+    cache.put("new", 2)
+    clock[0] += 6
+    assert cache.get("old") is None
+    assert cache.get("new") == 2
+    clock[0] += 5
+    reopened = ExtractionCache(max_items=0, db_path=db, max_age_sec=10)  # 開いたときにも期限切れを消す
+    assert reopened._db.execute("SELECT COUNT(*) FROM extract_cache").fetchone()[0] == 0
+
+
+def test_disk_size_limit_evicts_least_recently_accessed(clock, tmp_path):
+    cache = ExtractionCache(max_items=0, db_path=tmp_path / "cache.db", max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, key)
+        clock[0] += 1
+    assert cache.get("a") == "a"  # a の最終アクセスを b より新しくする
+    clock[0] += 1
+    cache.put("c", "c")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("a", "c")
@@ -0,0 +1,57 @@
+"""cli の出力（記録の無い用紙も印の行を残す・CSV の列の確認・Parquet は flush ごとに確定）"""
+import pytest
+
+from pe_analysis.cli import RESULT_FIELDNAMES, CsvWriter, JsonlWriter, ParquetWriter, result_rows
+from pe_analysis.core import parse_sheet
+
+SHEET = {"name": "A", "sheet_hints": "男子", "records": [
+    {"attempt": 1, "splits_mmss": ["1:20", "2:42", "4:05"], "time_run_dist_m": 900, "distance_race_m": 0}]}
+
+
+def test_empty_sheet_writes_one_marker_row():
+    rows = result_rows("empty.jpg", parse_sheet({"name": "B", "records": []}))
+    assert len(rows) == 1
+    assert rows[0]["file"] == "empty.jpg" and rows[0]["attempt"] is None
+    assert list(rows[0]) == RESULT_FIELDNAMES
+    assert list(result_rows("a.jpg", parse_sheet(SHEET))[0]) == RESULT_FIELDNAMES
+
+
+@pytest.mark.parametrize("writer_cls, name", [(CsvWriter, "out.csv"), (JsonlWriter, "out.jsonl"),
+                                              (ParquetWriter, "out.parquet")])
+def test_flushed_rows_count_as_done_even_without_close(writer_cls, name, tmp_path):
+    if writer_cls is ParquetWriter:
+        pytest.importorskip("pyarrow")
+    path = tmp_path / name
+    w = writer_cls(path)
+    w.write(result_rows("a.jpg", parse_sheet(SHEET)))
+    w.write(result_rows("empty.jpg", parse_sheet({})))
+    w.flush()  # ここで落ちたことにする（close しない）
+    assert writer_cls(path).done_files() == {"a.jpg", "empty.jpg"}
+
+
+def test_parquet_close_merges_parts_into_existing_output(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    path = tmp_path / "out.parquet"
+    w = ParquetWriter(path)
+    w.write(result_rows("a.jpg", parse_sheet(SHEET)))
+    w.close()
+    w = ParquetWriter(path)
+    w.write(result_rows("b.jpg", parse_sheet(SHEET)))
+    w.flush()
+    w.write(result_rows("c.jpg", parse_sheet({})))
+    w.close()
+    assert pq.read_table(path).column("file").to_pylist() == ["a.jpg", "b.jpg", "c.jpg"]
+    assert not w.parts_dir.exists()
+    assert [p.name for p in tmp_path.iterdir()] == ["out.parquet"]
+
+
+def test_csv_append_rejects_a_different_header(tmp_path):
+    path = tmp_path / "out.csv"
+    path.write_text("file,name,old_column\nx.jpg,X,1\n", encoding="utf-8")
+    w = CsvWriter(path)
+    with pytest.raises(SystemExit):
+        w.write(result_rows("a.jpg", parse_sheet(SHEET)))
+    w.close()
+    assert path.read_text(encoding="utf-8") == "file,name,old_column\nx.jpg,X,1\n"
@@ -0,0 +1,71 @@
+"""core.parse_record / parse_sheet（読めない値は例外にせず issues に残す）と extract.validate_extraction"""
+import pytest
+
+from pe_analysis.core import parse_record, parse_sheet
+from pe_analysis.extract import validate_extraction
+
+
+def record(**kw):
+    raw = {"attempt": 1, "splits_mmss": ["1:20", "2:42", "4:05"], "time_run_dist_m": 3000, "distance_race_m": 0}
+    raw.update(kw)
+    return raw
+
+
+def test_clean_record_has_no_issues():
+    rec = parse_record(record())
+    assert rec.issues == ()
+    assert rec.splits_sec.tolist() == [80.0, 162.0, 245.0]
+
+
+def test_unreadable_split_is_dropped_and_reported():
+    rec = parse_record(record(splits_mmss=["1:20", "1:0x", "4:05"]))
+    assert rec.splits_sec.tolist() == [80.0, 245.0]
+    assert rec.issues == ("1回目: 読めない通過タイムがある",)
+
+
+def test_non_increasing_splits_are_reported():
+    rec = parse_record(record(splits_mmss=["1:20", "2:42", "2:30"]))
+    assert rec.splits_sec.tolist() == [80.0, 150.0, 162.0]  # 並べ替えはするが、問題として残す
+    assert rec.issues == ("1回目: 通過タイムが増加していない",)
+
+
+@pytest.mark.parametrize("field", ["time_run_dist_m", "distance_race_m"])
+@pytest.mark.parametrize("value", ["約3000", "nan", [3000]])
+def test_non_numeric_distance_becomes_zero(field, value):
+    rec = parse_record(record(**{field: value}))
+    assert rec.time_run_dist_m == 0 and rec.distance_race_m == 0
+    assert rec.issues == ("1回目: 距離が数値でない",)
+
+
+def test_missing_distance_is_zero_without_issue():
+    rec = parse_record(record(time_run_dist_m=None, distance_race_m=""))
+    assert (rec.time_run_dist_m, rec.distance_race_m, rec.issues) == (0, 0, ())
+
+
+def test_unknown_race_distance_is_reported():
+    rec = parse_record(record(distance_race_m=1500))
+    assert rec.distance_race_m == 1500
+    assert rec.issues == ("1回目: distance_race_m=1500",)
+
+
+def test_to_dict_round_trips_through_splits_sec():
+    sheet = parse_sheet({"name": "A", "sheet_hints": "男子", "records": [
+        record(), record(attempt=2, splits_mmss=["1:18", "2:40"], distance_race_m=3000, distance_race_time_mmss="11:02")]})
+    again = parse_sheet(sheet.to_dict())
+    assert again == sheet
+    assert again.records[0].splits_sec.tolist() == [80.0, 162.0, 245.0]
+
+
+def test_parse_sheet_tolerates_broken_input():
+    assert parse_sheet(None).records == []
+    sheet = parse_sheet({"name": None, "records": "壊れた値"})
+    assert (sheet.name, sheet.records) == ("選手", [])
+    assert [r.attempt for r in parse_sheet({"records": [{}, "x"]}).records] == [1, 2]
+
+
+def test_validate_extraction_collects_record_issues_and_plausibility():
+    assert validate_extraction(parse_sheet({"records": []})) == ["records が空"]
+    assert validate_extraction(parse_sheet({"sheet_hints": "男子 15分", "records": [record(time_run_dist_m=4000)]})) == []
+    issues = validate_extraction(parse_sheet({"sheet_hints": "男子 15分", "records": [
+        record(splits_mmss=["1:20", "?"], time_run_dist_m=9000)]}))
+    assert issues == ["1回目: 読めない通過タイムがある", "1回目: 15分間走で 9000m は不自然"]
@@ -0,0 +1,26 @@
+"""image.prepare_upload（デコードの解像度は見つかった枠の幅から決める）"""
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from pe_analysis.image import prepare_upload, resize_enhance
+
+
+def narrow_table_jpeg():
+    """3024x4032 の写真の真ん中に、横幅の半分ほどしかない表"""
+    im = Image.new("RGB", (3024, 4032), (235, 235, 230))
+    d = ImageDraw.Draw(im)
+    x0, x1, y0, y1 = 1000, 2560, 500, 3600
+    for y in range(y0, y1 + 1, 155):
+        d.line((x0, y, x1, y), fill=0, width=8)
+    for x in range(x0, x1 + 1, 390):
+        d.line((x, y0, x, y1), fill=0, width=8)
+    buf = BytesIO()
+    im.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def test_narrow_table_still_fills_widest_tier():
+    _, source, box = prepare_upload(narrow_table_jpeg(), max_width=1024)
+    assert box[2] - box[0] >= 1024
+    assert resize_enhance(source, box, 1024).width == 1024
@@ -0,0 +1,107 @@
+"""jobs.JobQueue（優先度の小さい順・同じなら投入順。key が同じ待ちジョブは1つにまとめる。ワーカーは止まらない）"""
+import threading
+import time
+
+import pytest
+
+from pe_analysis.jobs import FINISHED, PRIORITY_BATCH, PRIORITY_INTERACTIVE, JobQueue
+
+TIMEOUT = 10
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(**kw):
+        queues.append(JobQueue(**kw))
+        return queues[-1]
+
+    yield make
+    for q in queues:
+        q.shutdown(TIMEOUT)
+        assert not any(t.is_alive() for t in q._threads)
+
+
+def wait_finished(q, job_id):
+    deadline = time.monotonic() + TIMEOUT  # 状態が終わりになるのはハンドラが戻った後
+    while q.get(job_id)["status"] not in FINISHED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return q.get(job_id)
+
+
+def blocked_queue(make_queue, **kw):
+    """ワーカー1つのキュー。最初のジョブ（gate）でワーカーを止めておき、後から積んだ分の取り出し順を見る"""
+    q = make_queue(workers=1, **kw)
+    gate_started, release = threading.Event(), threading.Event()
+    order = []
+    done = threading.Semaphore(0)
+
+    def gate(payload, job):
+        gate_started.set()
+        assert release.wait(TIMEOUT)
+
+    def record(payload, job):
+        order.append(payload)
+        done.release()
+        return payload
+
+    q.register("gate", gate)
+    q.register("record", record)
+    q.submit("gate", None)
+    assert gate_started.wait(TIMEOUT)
+    return q, release, order, done
+
+
+def test_interactive_jobs_run_before_batch_jobs(make_queue):
+    q, release, order, done = blocked_queue(make_queue)
+    for name, priority in [("b1", PRIORITY_BATCH), ("i1", PRIORITY_INTERACTIVE), ("b2", PRIORITY_BATCH),
+                           ("i2", PRIORITY_INTERACTIVE)]:
+        q.submit("record", name, priority=priority)
+    release.set()
+    for _ in range(4):
+        assert done.acquire(timeout=TIMEOUT)
+    assert order == ["i1", "i2", "b1", "b2"]
+
+
+def test_same_key_is_queued_once(make_queue):
+    q, release, order, done = blocked_queue(make_queue)
+    first = q.submit("record", "a", key="same")
+    assert q.submit("record", "b", key="same") == first
+    release.set()
+    assert done.acquire(timeout=TIMEOUT)
+    assert order == ["a"]
+    assert wait_finished(q, first)["result"] == "a"
+    # 終わった後は同じ key でも新しく積む
+    assert q.submit("record", "c", key="same") != first
+
+
+def test_unpersistable_result_marks_job_and_worker_survives(make_queue, tmp_path):
+    q = make_queue(workers=1, db_path=str(tmp_path / "jobs.db"))
+    q.register("bad", lambda payload, job: {"x": object()})
+    q.register("ok", lambda payload, job: payload)
+    bad = q.submit("bad", None)
+    ok = q.submit("ok", 1)
+    snap = wait_finished(q, bad)
+    assert snap["status"] == "error" and snap["result"] is None
+    assert wait_finished(q, ok)["result"] == 1
+
+
+def test_metrics_failure_does_not_kill_worker(make_queue, monkeypatch):
+    def broken(*args, **kw):
+        raise RuntimeError("metrics down")
+
+    monkeypatch.setattr("pe_analysis.jobs.METRICS.observe", broken)
+    q = make_queue(workers=1)
+    q.register("ok", lambda payload, job: payload)
+    ids = [q.submit("ok", i) for i in range(3)]
+    assert [wait_finished(q, i)["result"] for i in ids] == [0, 1, 2]
+
+
+def test_shutdown_stops_workers_and_rejects_new_jobs(make_queue):
+    q = make_queue(workers=2)
+    q.register("ok", lambda payload, job: payload)
+    q.shutdown(TIMEOUT)
+    assert not any(t.is_alive() for t in q._threads)
+    with pytest.raises(RuntimeError):
+        q.submit("ok", 1)
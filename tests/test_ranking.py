@@ -0,0 +1,27 @@
+"""ranking.ClassIndex（種目が混ざる「全体」では種目で意味が変わる指標を並べない）"""
+from pe_analysis.core import parse_sheet
+from pe_analysis.ranking import ALL, ClassIndex
+
+
+def sheet(dist, race_m):
+    splits = [f"{m}:{s:02d}" for m, s in ((1, 10), (2, 20), (3, 35))]
+    return parse_sheet({"records": [{"attempt": 1, "splits_mmss": splits, "time_run_dist_m": dist,
+                                     "distance_race_m": race_m}]})
+
+
+def test_event_metrics_are_ranked_per_group_only():
+    index = ClassIndex.from_sheets([("m1", sheet(3600, 3000)), ("m2", sheet(3300, 3000)),
+                                    ("f1", sheet(2700, 2100)), ("f2", sheet(2400, 2100))])
+    assert index.metrics(ALL) == ["vo2max"]
+    assert index.count("target_time_pred_sec", ALL) == 0
+    assert index.top("time_run_dist_m", 10, ALL) == []
+    assert index.count("vo2max", ALL) == 4
+    for g in index.group_names:
+        assert index.count("target_time_pred_sec", g) == 2
+    assert [name for name, _ in index.top("target_time_pred_sec", 10, "女子12分")] == ["f1", "f2"]
+
+
+def test_single_group_keeps_all_metrics():
+    index = ClassIndex.from_sheets([("m1", sheet(3600, 3000)), ("m2", sheet(3300, 3000))])
+    assert index.metrics(ALL) == list(index.columns)
+    assert index.count("target_time_pred_sec", ALL) == 2
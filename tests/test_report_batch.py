@@ -0,0 +1,60 @@
+"""report.collect_report_batch（終わり方ごとの受け取り）と iter_reports（1件の失敗）"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from pe_analysis.report import collect_report_batch, iter_reports
+
+
+def ok_row(i, text):
+    return {"custom_id": f"report-{i}", "response": {"status_code": 200, "body": {
+        "output": [{"type": "message", "content": [{"type": "output_text", "text": text}]}]}}}
+
+
+def error_row(i, message):
+    return {"custom_id": f"report-{i}", "response": None, "error": {"code": "batch_expired", "message": message}}
+
+
+def fake_client(status, files):
+    """batches.retrieve と files.content だけを持つクライアント（files: {file_id: [row, ...]}）"""
+    batch = SimpleNamespace(status=status, output_file_id="out" if "out" in files else None,
+                            error_file_id="err" if "err" in files else None)
+    content = {fid: SimpleNamespace(text="".join(json.dumps(r) + "\n" for r in rows)) for fid, rows in files.items()}
+    return SimpleNamespace(batches=SimpleNamespace(retrieve=lambda batch_id: batch),
+                           files=SimpleNamespace(content=lambda fid: content[fid]))
+
+
+def test_in_progress_returns_nothing_yet():
+    assert collect_report_batch(fake_client("in_progress", {}), "b") == ("in_progress", None, None)
+
+
+def test_expired_returns_partial_results_and_errors():
+    client = fake_client("expired", {"out": [ok_row(0, "A"), ok_row(2, "C")], "err": [error_row(1, "期限切れ")]})
+    status, results, errors = collect_report_batch(client, "b")
+    assert status == "expired"
+    assert results == {0: "A", 2: "C"}
+    assert errors == {1: "期限切れ"}
+
+
+@pytest.mark.parametrize("status", ["failed", "cancelled"])
+def test_terminal_without_files_is_empty_not_pending(status):
+    assert collect_report_batch(fake_client(status, {}), "b") == (status, {}, {})
+
+
+def test_iter_reports_keeps_going_after_one_failure(monkeypatch):
+    def complete(client, prompt):
+        if prompt == "bad":
+            raise RuntimeError("boom")
+        return prompt.upper()
+
+    monkeypatch.setattr("pe_analysis.report.complete_text_report", complete)
+    got = {i: (text, err) for i, text, _, err in iter_reports(None, ["a", "bad", "c"], workers=2)}
+    assert got == {0: ("A", None), 1: (None, "RuntimeError: boom"), 2: ("C", None)}
+
+
+def test_incomplete_body_is_an_error_not_a_result():
+    row = ok_row(0, "途中")
+    row["response"]["body"].update(status="incomplete", incomplete_details={"reason": "max_output_tokens"})
+    status, results, errors = collect_report_batch(fake_client("completed", {"out": [row]}), "b")
+    assert results == {} and "max_output_tokens" in errors[0]
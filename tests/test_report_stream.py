@@ -0,0 +1,52 @@
+"""report.stream_text_report / complete_text_report（失敗・打ち切りは例外にして、途中の本文を完成品にしない）"""
+from types import SimpleNamespace
+
+import pytest
+
+from pe_analysis.report import complete_text_report, stream_text_report
+
+
+def ev(type_, **kw):
+    return SimpleNamespace(type=type_, **kw)
+
+
+def delta(text):
+    return ev("response.output_text.delta", delta=text)
+
+
+def streaming_client(events):
+    return SimpleNamespace(responses=SimpleNamespace(create=lambda **kw: iter(events)))
+
+
+def test_completed_stream_yields_text():
+    events = [delta("①"), delta("本文"), ev("response.completed", response=SimpleNamespace(usage=None))]
+    assert "".join(stream_text_report(streaming_client(events), "p")) == "①本文"
+
+
+@pytest.mark.parametrize("last, message", [
+    (ev("response.failed", response=SimpleNamespace(status="failed", error=SimpleNamespace(message="overloaded"),
+                                                    usage=None)), "overloaded"),
+    (ev("response.incomplete", response=SimpleNamespace(
+        status="incomplete", incomplete_details=SimpleNamespace(reason="max_output_tokens"), usage=None)),
+     "max_output_tokens"),
+    (ev("error", message="server_error"), "server_error"),
+    (None, "途切れ"),
+])
+def test_broken_stream_raises_after_partial_text(last, message):
+    events = [delta("途中まで")] + ([last] if last else [])
+    got = []
+    with pytest.raises(RuntimeError, match=message):
+        for d in stream_text_report(streaming_client(events), "p"):
+            got.append(d)
+    assert got == ["途中まで"]
+
+
+@pytest.mark.parametrize("resp, message", [
+    (SimpleNamespace(status="incomplete", incomplete_details=SimpleNamespace(reason="max_output_tokens"),
+                     output_text="途中", usage=None), "max_output_tokens"),
+    (SimpleNamespace(status="completed", output_text="  ", usage=None), "空"),
+])
+def test_complete_text_report_rejects_incomplete_or_empty(resp, message):
+    client = SimpleNamespace(responses=SimpleNamespace(create=lambda **kw: resp))
+    with pytest.raises(RuntimeError, match=message):
+        complete_text_report(client, "p")
@@ -0,0 +1,122 @@
+"""singleflight.SingleFlight（同じ key の同時呼び出しは1回にまとめ、結果も例外も待っていた側へ渡す）"""
+import threading
+
+import pytest
+
+from pe_analysis.singleflight import SingleFlight
+
+WAITERS = 5
+TIMEOUT = 10
+
+
+class CountingEvent:
+    """先行側の done を包み、待ちに入った数を数える（全員が待ってから先行側を終わらせるため）"""
+
+    def __init__(self, event, expected):
+        self.event = event
+        self.expected = expected
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.all_waiting = threading.Event()
+
+    def wait(self, timeout=None):
+        with self.lock:
+            self.waiting += 1
+            if self.waiting == self.expected:
+                self.all_waiting.set()
+        return self.event.wait(timeout)
+
+    def set(self):
+        self.event.set()
+
+
+def run_coalesced(sf, leader_fn):
+    """先行側が leader_fn を実行中に WAITERS 人が同じ key で do() し、全員の (結果 or 例外) を返す"""
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def lead():
+        calls.append("leader")
+        started.set()
+        assert release.wait(TIMEOUT)
+        return leader_fn()
+
+    def follow():
+        calls.append("waiter")
+        return "should not run"
+
+    outcomes = [None] * (WAITERS + 1)
+
+    def worker(i, fn):
+        try:
+            outcomes[i] = sf.do("k", fn)
+        except Exception as e:
+            outcomes[i] = e
+
+    leader = threading.Thread(target=worker, args=(0, lead))
+    leader.start()
+    assert started.wait(TIMEOUT)
+    counting = sf._calls["k"].done = CountingEvent(sf._calls["k"].done, WAITERS)
+    waiters = [threading.Thread(target=worker, args=(i, follow)) for i in range(1, WAITERS + 1)]
+    for t in waiters:
+        t.start()
+    assert counting.all_waiting.wait(TIMEOUT)
+    release.set()
+    for t in [leader, *waiters]:
+        t.join(TIMEOUT)
+    return calls, outcomes
+
+
+def test_concurrent_calls_run_once_and_share_result():
+    sf = SingleFlight("test")
+    calls, outcomes = run_coalesced(sf, lambda: 42)
+    assert calls == ["leader"]
+    assert outcomes == [(42, False)] + [(42, True)] * WAITERS
+    assert sf.in_flight() == 0
+
+
+def test_error_reaches_every_waiter_and_is_not_cached():
+    sf = SingleFlight("test")
+    boom = ValueError("boom")
+
+    def fail():
+        raise boom
+
+    calls, outcomes = run_coalesced(sf, fail)
+    assert calls == ["leader"]
+    assert all(o is boom for o in outcomes)
+    # 失敗は覚えない：次の呼び出しはもう一度実行される
+    assert sf.do("k", lambda: "retry") == ("retry", False)
+
+
+def test_waiter_takes_over_when_leader_is_interrupted():
+    sf = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    outcome = {}
+
+    class Interrupted(BaseException):
+        pass
+
+    def lead():
+        started.set()
+        assert release.wait(TIMEOUT)
+        raise Interrupted
+
+    def leader():
+        with pytest.raises(Interrupted):
+            sf.do("k", lead)
+
+    def waiter():
+        outcome["w"] = sf.do("k", lambda: "mine")
+
+    t1 = threading.Thread(target=leader)
+    t1.start()
+    assert started.wait(TIMEOUT)
+    counting = sf._calls["k"].done = CountingEvent(sf._calls["k"].done, 1)
+    t2 = threading.Thread(target=waiter)
+    t2.start()
+    assert counting.all_waiting.wait(TIMEOUT)
+    release.set()
+    t1.join(TIMEOUT)
+    t2.join(TIMEOUT)
+    assert outcome["w"] == ("mine", False)
@@ -0,0 +1,46 @@
+import pytest
+
+from pe_analysis.core import infer_profile, parse_sheet, pick_best_time_run
+from pe_analysis.report import (
+    COACH_PROMPT_MARKER,
+    REPORT_SECTIONS,
+    build_report_prompt,
+    complete_text_report,
+    report_request,
+)
+
+SHEET = {
+    "name": "山田",
+    "sheet_hints": "男子 15分",
+    "records": [
+        {"attempt": 1, "splits_mmss": ["0:58", "2:02", "3:08", "4:15", "5:26"], "time_run_dist_m": 4100,
+         "distance_race_m": 3000, "distance_race_time_mmss": "11:12"},
+        {"attempt": 2, "splits_mmss": ["1:00", "2:03"], "time_run_dist_m": 3900},
+    ],
+}
+
+
+@pytest.fixture
+def best():
+    sheet = parse_sheet(SHEET)
+    rec = pick_best_time_run(sheet.records)
+    return sheet, rec, infer_profile(rec, sheet.sheet_hints)
+
+
+def test_coach_prompt_gets_only_coach_text(standin_client, best):
+    sheet, rec, profile = best
+    prefix, prompt = report_request(sheet.name, profile, rec, sheet.records, "local")
+    assert COACH_PROMPT_MARKER in prompt
+    text = complete_text_report(standin_client, prompt)
+    assert not any(section in text for section in REPORT_SECTIONS)
+    # ①〜③はローカルで作った分だけ、④の見出しも1回だけ
+    report = prefix + text
+    assert [report.count(section) for section in REPORT_SECTIONS] == [1, 1, 1, 1]
+
+
+def test_full_prompt_gets_full_report(standin_client, best):
+    sheet, rec, profile = best
+    prompt = build_report_prompt(sheet.name, profile, rec, sheet.records)
+    assert COACH_PROMPT_MARKER not in prompt
+    text = complete_text_report(standin_client, prompt)
+    assert [text.count(section) for section in REPORT_SECTIONS] == [1, 1, 1, 1]